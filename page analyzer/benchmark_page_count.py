@@ -0,0 +1,107 @@
+"""Compare the xref page-count probe with a full PyPDF2 parse on a corpus of PDFs.
+
+Usage: python benchmark_page_count.py [folder_or_pdf ...] [--repeat N]
+
+Defaults to the uploaded PDFs in ./pdfs. Reports per-file timings, whether both
+approaches agree, and which files needed the PyPDF2 fallback.
+"""
+import argparse
+import os
+import time
+
+import PyPDF2
+
+from pdf_probe import probe_pdf, ProbeError
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def collect_pdfs(paths):
+    pdfs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                pdfs.extend(os.path.join(root, f) for f in files if f.lower().endswith('.pdf'))
+        elif path.lower().endswith('.pdf'):
+            pdfs.append(path)
+    return sorted(pdfs)
+
+
+def best_of(repeat, func, *args):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception as e:
+            result = e
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def full_parse_count(pdf_path):
+    with open(pdf_path, 'rb') as pdf_file:
+        return len(PyPDF2.PdfReader(pdf_file).pages)
+
+
+def probe_count(pdf_path):
+    return probe_pdf(pdf_path)['pages']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', default=[os.path.join(BASE_DIR, 'pdfs')])
+    parser.add_argument('--repeat', type=int, default=3, help="runs per file; the best time is kept")
+    args = parser.parse_args()
+
+    pdfs = collect_pdfs(args.paths)
+    if not pdfs:
+        print("No PDFs found")
+        return
+
+    print(f"{'file':40} {'size KB':>9} {'pages':>7} {'probe ms':>9} {'PyPDF2 ms':>10} {'speedup':>8}  result")
+    totals = {'probe': 0.0, 'full': 0.0}
+    fallbacks = mismatches = 0
+    for pdf_path in pdfs:
+        size_kb = os.path.getsize(pdf_path) / 1024
+        probe_result, probe_time = best_of(args.repeat, probe_count, pdf_path)
+        full_result, full_time = best_of(args.repeat, full_parse_count, pdf_path)
+        totals['full'] += full_time
+
+        if isinstance(probe_result, ProbeError):
+            # What ingestion actually pays: the failed probe plus the full parse
+            fallbacks += 1
+            totals['probe'] += probe_time + full_time
+            status = f"fallback ({probe_result})"
+            pages = '-' if isinstance(full_result, Exception) else full_result
+            if isinstance(full_result, Exception):
+                status += f", PyPDF2 failed: {full_result}"
+            speedup = full_time / (probe_time + full_time)
+        else:
+            totals['probe'] += probe_time
+            pages = probe_result
+            speedup = full_time / probe_time if probe_time else float('inf')
+            if isinstance(full_result, Exception):
+                status = f"ok (PyPDF2 failed: {full_result})"
+            elif full_result != probe_result:
+                mismatches += 1
+                status = f"MISMATCH (PyPDF2 says {full_result})"
+            else:
+                status = "ok"
+
+        name = os.path.basename(pdf_path)
+        name = name if len(name) <= 40 else name[:37] + '...'
+        print(f"{name:40} {size_kb:9.1f} {str(pages):>7} {probe_time * 1000:9.2f} "
+              f"{full_time * 1000:10.2f} {speedup:7.1f}x  {status}")
+
+    print()
+    print(f"Files: {len(pdfs)}, fallbacks: {fallbacks}, mismatches: {mismatches}")
+    print(f"Total probe (incl. fallbacks): {totals['probe'] * 1000:.1f} ms, "
+          f"total PyPDF2: {totals['full'] * 1000:.1f} ms, "
+          f"overall speedup: {totals['full'] / totals['probe']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,7 @@ sudo apt-get update
 sudo apt-get upgrade -y
 
 # Install required packages
-sudo apt-get install -y python3-pip python3-venv nginx apache2-utils
+sudo apt-get install -y python3-pip python3-venv nginx apache2-utils qpdf
 
 # Create application directory
 sudo mkdir -p /var/www/ai_analytics
@@ -19,6 +19,11 @@ source /var/www/ai_analytics/venv/bin/activate
 pip install -r requirements.txt
 pip install gunicorn
 
+# Bundle pdf.js locally so the viewer doesn't depend on third-party CDNs.
+# Air-gapped hosts: run vendor_assets.py on a connected machine (or with
+# NPM_REGISTRY pointing at an internal mirror) and copy static/ instead.
+python vendor_assets.py
+
 # Copy application files
 sudo cp -r * /var/www/ai_analytics/
 sudo chown -R www-data:www-data /var/www/ai_analytics
@@ -31,6 +36,7 @@ sudo systemctl enable ai_analytics
 
 # Setup Nginx
 sudo cp nginx.conf /etc/nginx/sites-available/ai_analytics
+sudo cp ai_analytics_pdf.conf /etc/nginx/snippets/ai_analytics_pdf.conf
 sudo ln -s /etc/nginx/sites-available/ai_analytics /etc/nginx/sites-enabled/
 sudo rm /etc/nginx/sites-enabled/default
 sudo systemctl restart nginx
@@ -0,0 +1,36 @@
+#!/bin/bash
+# Checks that nginx, not gunicorn, is serving PDF bytes (PDF_ACCEL_REDIRECT=on).
+# Usage: ./verify_accel.sh http://your_domain.com <unique_url>
+
+BASE_URL=${1:?base url required}
+UNIQUE_URL=${2:?unique_url of an uploaded PDF required}
+PDF_URL="$BASE_URL/serve-online-pdf/$UNIQUE_URL"
+FAILED=0
+
+check() {
+    if [ "$2" = "$3" ]; then
+        echo "ok   $1"
+    else
+        echo "FAIL $1: expected '$3', got '$2'"
+        FAILED=1
+    fi
+}
+
+header() {
+    grep -i "^$1:" | head -n 1 | cut -d' ' -f2- | tr -d '\r'
+}
+
+HEADERS=$(curl -s -D - -o /dev/null "$PDF_URL")
+check "full download" "$(echo "$HEADERS" | head -n 1 | cut -d' ' -f2)" "200"
+check "content type" "$(echo "$HEADERS" | header Content-Type)" "application/pdf"
+check "X-Accel-Redirect not leaked" "$(echo "$HEADERS" | header X-Accel-Redirect)" ""
+check "CORS header" "$(echo "$HEADERS" | header Access-Control-Allow-Origin)" "*"
+echo "     Cache-Control: $(echo "$HEADERS" | header Cache-Control)"
+
+ETAG=$(echo "$HEADERS" | header ETag)
+check "conditional GET" "$(curl -s -o /dev/null -w '%{http_code}' -H "If-None-Match: $ETAG" "$PDF_URL")" "304"
+check "range request" "$(curl -s -o /dev/null -w '%{http_code}' -H 'Range: bytes=0-1023' "$PDF_URL")" "206"
+check "range length" "$(curl -s -H 'Range: bytes=0-1023' "$PDF_URL" | wc -c | tr -d ' ')" "1024"
+check "internal location hidden" "$(curl -s -o /dev/null -w '%{http_code}' "$BASE_URL/_protected/pdfs/")" "404"
+
+exit $FAILED
@@ -0,0 +1,17 @@
+# gunicorn reads this from the working directory, so deployment/ai_analytics.service
+# picks it up without a -c flag.
+
+
+def on_starting(server):
+    # Migrations and the PDF folder sync, once in the master before any worker
+    # starts; a failed migration stops gunicorn
+    from pdftracker import init_db
+    init_db()
+
+
+def post_worker_init(worker):
+    # Threads don't survive the fork, so each worker starts its own background
+    # tasks (compactor, spool replayer, session reaper, upload-job requeuer,
+    # partition maintenance, purge); the cross-worker ones take named locks
+    from pdftracker import start_background_tasks
+    start_background_tasks()
@@ -0,0 +1,618 @@
+import argparse
+import hashlib
+import time
+
+import mysql.connector
+from mysql.connector import errorcode
+
+# Named lock so only one process (e.g. one of several gunicorn workers) migrates at a time
+MIGRATION_LOCK_NAME = 'pdf_analytics_schema_migrations'
+MIGRATION_LOCK_TIMEOUT = 60
+
+# Keep metadata-lock waits short while altering live tables; a blocked ALTER would
+# otherwise queue every reader of the table behind it
+DDL_LOCK_WAIT_TIMEOUT = 10
+
+# Errors MySQL raises when an ALTER cannot run with the requested ALGORITHM/LOCK
+ONLINE_DDL_UNSUPPORTED = {
+    errorcode.ER_ALTER_OPERATION_NOT_SUPPORTED,
+    errorcode.ER_ALTER_OPERATION_NOT_SUPPORTED_REASON,
+}
+
+
+def add_column(table, column, definition):
+    # Added only when information_schema says the column is missing
+    return ('add_column', table, column, definition)
+
+
+def add_index(table, name, columns):
+    # Built in place without blocking writes where the server supports it
+    return ('add_index', table, name, columns)
+
+
+def add_unique_index(table, name, columns):
+    # As add_index; fails if the column already holds duplicate values
+    return ('add_unique_index', table, name, columns)
+
+
+def drop_foreign_key(table, name):
+    # `python partitions.py enable` drops every foreign key on and to page_views and
+    # viewing_sessions outside this list, so those keys may already be gone
+    return ('drop_foreign_key', table, name)
+
+
+def when_column_exists(table, column, *steps):
+    # Steps of a multi-statement conversion whose last ALTER drops this column: they
+    # run only while it exists, so an interrupted conversion is simply rerun
+    return ('when_column_exists', table, column, steps)
+
+
+# Each duplicated pdfs.filename keeps one row (the oldest not deleted, else the
+# oldest) and maps its other rows onto it
+PDF_FILENAME_KEEPERS = '''
+    SELECT filename,
+           COALESCE(MIN(CASE WHEN permanent_delete = FALSE THEN id END), MIN(id)) AS keep_id
+    FROM pdfs GROUP BY filename HAVING COUNT(*) > 1'''
+PDF_FILENAME_DUPLICATES = f'''
+    SELECT p.id AS duplicate_id, k.keep_id, kp.unique_url AS keep_url
+    FROM pdfs p
+    JOIN ({PDF_FILENAME_KEEPERS}) k ON k.filename = p.filename AND p.id <> k.keep_id
+    JOIN pdfs kp ON kp.id = k.keep_id'''
+
+
+# Ordered, append-only list of (version, name, steps). Never edit a migration that
+# has shipped: its checksum is recorded in schema_version and verified on upgrade.
+# page_views and viewing_sessions may have been partitioned since (partitions.py):
+# they then have no foreign keys and (id, start_time) primary keys, so steps on
+# them must not rely on either; use drop_foreign_key rather than a bare DROP.
+MIGRATIONS = [
+    (1, 'create_base_tables', [
+        '''CREATE TABLE IF NOT EXISTS admins
+           (id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(50) NOT NULL UNIQUE,
+            password VARCHAR(255) NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP)''',
+        '''CREATE TABLE IF NOT EXISTS pdfs
+           (id INT AUTO_INCREMENT PRIMARY KEY,
+            filename VARCHAR(255) NOT NULL,
+            original_filename VARCHAR(255) NOT NULL,
+            unique_url VARCHAR(36) NOT NULL UNIQUE,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            total_pages INT NOT NULL DEFAULT 0)''',
+        '''CREATE TABLE IF NOT EXISTS url_mappings
+           (id INT AUTO_INCREMENT PRIMARY KEY,
+            original_url VARCHAR(36) NOT NULL,
+            public_url VARCHAR(36) NOT NULL UNIQUE,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN NOT NULL DEFAULT TRUE,
+            last_used DATETIME,
+            pdf_id INT NOT NULL,
+            original_filename VARCHAR(255) NOT NULL,
+            total_views INT NOT NULL DEFAULT 0,
+            last_viewed_at DATETIME,
+            FOREIGN KEY (pdf_id) REFERENCES pdfs(id) ON DELETE CASCADE,
+            FOREIGN KEY (original_url) REFERENCES pdfs(unique_url) ON DELETE CASCADE)''',
+        '''CREATE TABLE IF NOT EXISTS viewing_sessions
+           (id INT AUTO_INCREMENT PRIMARY KEY,
+            session_id VARCHAR(50) NOT NULL,
+            pdf_id INT NOT NULL,
+            public_url VARCHAR(36) NOT NULL,
+            start_time DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            end_time DATETIME,
+            total_duration FLOAT NOT NULL DEFAULT 0,
+            total_pages INT NOT NULL DEFAULT 0,
+            unique_pages INT NOT NULL DEFAULT 0,
+            is_admin BOOLEAN NOT NULL DEFAULT FALSE,
+            user_agent VARCHAR(255),
+            ip_address VARCHAR(45),
+            last_activity DATETIME,
+            status ENUM('active', 'completed', 'abandoned') NOT NULL DEFAULT 'active',
+            original_filename VARCHAR(255) NOT NULL,
+            browser VARCHAR(100),
+            device_type VARCHAR(50),
+            operating_system VARCHAR(100),
+            country VARCHAR(100),
+            city VARCHAR(100),
+            is_remote_view BOOLEAN NOT NULL DEFAULT FALSE,
+            email VARCHAR(255),
+            FOREIGN KEY (pdf_id) REFERENCES pdfs(id) ON DELETE CASCADE,
+            FOREIGN KEY (public_url) REFERENCES url_mappings(public_url) ON DELETE CASCADE)''',
+        '''CREATE TABLE IF NOT EXISTS page_views
+           (id INT AUTO_INCREMENT PRIMARY KEY,
+            session_id INT NOT NULL,
+            pdf_id INT NOT NULL,
+            page_number INT NOT NULL DEFAULT 1,
+            start_time DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            end_time DATETIME,
+            duration FLOAT NOT NULL DEFAULT 0,
+            scroll_depth FLOAT NOT NULL DEFAULT 0,
+            zoom_level FLOAT NOT NULL DEFAULT 1.0,
+            time_to_first_view FLOAT,
+            is_complete BOOLEAN NOT NULL DEFAULT FALSE,
+            original_filename VARCHAR(255) NOT NULL,
+            view_count INT NOT NULL DEFAULT 1,
+            last_viewed_at DATETIME,
+            total_time_on_page FLOAT NOT NULL DEFAULT 0,
+            max_scroll_depth FLOAT NOT NULL DEFAULT 0,
+            max_zoom_level FLOAT NOT NULL DEFAULT 1.0,
+            FOREIGN KEY (session_id) REFERENCES viewing_sessions(id) ON DELETE CASCADE,
+            FOREIGN KEY (pdf_id) REFERENCES pdfs(id) ON DELETE CASCADE)''',
+        # Default admin user, only on an empty admins table
+        '''INSERT INTO admins (username, password)
+           SELECT 'admin', 'admin123' FROM DUAL
+           WHERE NOT EXISTS (SELECT 1 FROM admins)''',
+    ]),
+    (2, 'pdfs_soft_delete_columns', [
+        add_column('pdfs', 'permanent_delete', 'BOOLEAN DEFAULT FALSE'),
+        add_column('pdfs', 'deleted_at', 'DATETIME DEFAULT NULL'),
+    ]),
+    (3, 'lookup_indexes', [
+        add_index('pdfs', 'idx_created_at', 'created_at'),
+        add_index('pdfs', 'idx_deleted_at', 'deleted_at'),
+        add_index('url_mappings', 'idx_created_at', 'created_at'),
+        add_index('viewing_sessions', 'idx_session_id', 'session_id'),
+        add_index('viewing_sessions', 'idx_start_time', 'start_time'),
+        add_index('viewing_sessions', 'idx_status', 'status'),
+        add_index('viewing_sessions', 'idx_pdf_admin_start', 'pdf_id, is_admin, start_time'),
+        add_index('page_views', 'idx_start_time', 'start_time'),
+        add_index('page_views', 'idx_session_page', 'session_id, page_number'),
+    ]),
+    (4, 'upload_jobs', [
+        '''CREATE TABLE IF NOT EXISTS upload_jobs
+           (id VARCHAR(36) PRIMARY KEY,
+            pdf_id INT NOT NULL,
+            status ENUM('queued', 'processing', 'completed', 'failed') NOT NULL DEFAULT 'queued',
+            stage VARCHAR(50),
+            progress TINYINT UNSIGNED NOT NULL DEFAULT 0,
+            error_message VARCHAR(1000),
+            metadata TEXT,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (pdf_id) REFERENCES pdfs(id) ON DELETE CASCADE,
+            INDEX idx_status_updated (status, updated_at))''',
+    ]),
+    (5, 'chunked_uploads', [
+        '''CREATE TABLE IF NOT EXISTS chunked_uploads
+           (id VARCHAR(36) PRIMARY KEY,
+            original_filename VARCHAR(255) NOT NULL,
+            total_size BIGINT NOT NULL,
+            received_bytes BIGINT NOT NULL DEFAULT 0,
+            sha256 CHAR(64),
+            status ENUM('uploading', 'finalized', 'expired') NOT NULL DEFAULT 'uploading',
+            unique_url VARCHAR(36),
+            job_id VARCHAR(36),
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_status_updated (status, updated_at))''',
+    ]),
+    (6, 'pdfs_linearized_copy', [
+        add_column('pdfs', 'linearized_filename', 'VARCHAR(255) DEFAULT NULL'),
+        add_column('pdfs', 'original_size', 'BIGINT DEFAULT NULL'),
+        add_column('pdfs', 'linearized_size', 'BIGINT DEFAULT NULL'),
+    ]),
+    (7, 'view_events', [
+        # Append-only ingest log for INGEST_MODE=events; no secondary indexes or
+        # foreign keys so inserts stay cheap. Rows are deleted once compacted.
+        '''CREATE TABLE IF NOT EXISTS view_events
+           (id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            viewing_session_id INT NOT NULL,
+            pdf_id INT NOT NULL,
+            page_number INT NOT NULL,
+            kind ENUM('view', 'duration', 'complete') NOT NULL,
+            duration FLOAT NOT NULL DEFAULT 0,
+            scroll_depth FLOAT NOT NULL DEFAULT 0,
+            zoom_level FLOAT NOT NULL DEFAULT 1.0,
+            time_to_first_view FLOAT NOT NULL DEFAULT 0,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)''',
+    ]),
+    (8, 'ingest_dedup', [
+        # Keys of ingested events, claimed in the same transaction as the write so
+        # a replayed or retried event is applied at most once
+        '''CREATE TABLE IF NOT EXISTS ingest_dedup
+           (event_key VARCHAR(64) PRIMARY KEY,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_created_at (created_at))''',
+    ]),
+    (9, 'viewer_activity', [
+        # One row per distinct email; the hash of the normalised address is the lookup key
+        '''CREATE TABLE IF NOT EXISTS viewers
+           (id INT AUTO_INCREMENT PRIMARY KEY,
+            email_hash CHAR(64) NOT NULL,
+            email VARCHAR(255) NOT NULL,
+            first_seen DATETIME NOT NULL,
+            last_seen DATETIME NOT NULL,
+            UNIQUE KEY uq_email_hash (email_hash))''',
+        # Per-viewer, per-PDF rollup of viewing_sessions, refreshed on ingest
+        '''CREATE TABLE IF NOT EXISTS viewer_pdf_activity
+           (viewer_id INT NOT NULL,
+            pdf_id INT NOT NULL,
+            sessions INT NOT NULL DEFAULT 0,
+            completed_sessions INT NOT NULL DEFAULT 0,
+            total_duration FLOAT NOT NULL DEFAULT 0,
+            max_unique_pages INT NOT NULL DEFAULT 0,
+            first_seen DATETIME NOT NULL,
+            last_seen DATETIME NOT NULL,
+            PRIMARY KEY (viewer_id, pdf_id))''',
+        add_column('viewing_sessions', 'viewer_id', 'INT NULL'),
+        add_index('viewing_sessions', 'idx_viewer_pdf', 'viewer_id, pdf_id'),
+        # Backfill from the emails already collected; each statement is safe to rerun
+        '''INSERT IGNORE INTO viewers (email_hash, email, first_seen, last_seen)
+           SELECT SHA2(LOWER(TRIM(email)), 256), MIN(LOWER(TRIM(email))),
+                  MIN(start_time), MAX(start_time)
+           FROM viewing_sessions
+           WHERE email IS NOT NULL AND TRIM(email) <> '' AND start_time IS NOT NULL
+           GROUP BY SHA2(LOWER(TRIM(email)), 256)''',
+        '''UPDATE viewing_sessions vs
+           JOIN viewers v ON v.email_hash = SHA2(LOWER(TRIM(vs.email)), 256)
+           SET vs.viewer_id = v.id
+           WHERE vs.viewer_id IS NULL AND vs.email IS NOT NULL''',
+        '''INSERT INTO viewer_pdf_activity
+               (viewer_id, pdf_id, sessions, completed_sessions, total_duration,
+                max_unique_pages, first_seen, last_seen)
+           SELECT viewer_id, pdf_id, COUNT(*), SUM(status = 'completed'),
+                  COALESCE(SUM(total_duration), 0), COALESCE(MAX(unique_pages), 0),
+                  MIN(start_time), MAX(COALESCE(last_activity, start_time))
+           FROM viewing_sessions
+           WHERE viewer_id IS NOT NULL AND is_admin = FALSE
+           GROUP BY viewer_id, pdf_id
+           ON DUPLICATE KEY UPDATE
+               sessions = VALUES(sessions),
+               completed_sessions = VALUES(completed_sessions),
+               total_duration = VALUES(total_duration),
+               max_unique_pages = VALUES(max_unique_pages),
+               first_seen = VALUES(first_seen),
+               last_seen = VALUES(last_seen)''',
+    ]),
+    (10, 'session_reaper_index', [
+        # The session reaper looks for active sessions by last activity
+        add_index('viewing_sessions', 'idx_status_last_activity', 'status, last_activity'),
+    ]),
+    (11, 'pdfs_purge', [
+        # permanent_delete becomes a plain two-valued flag so catalogue queries can
+        # filter on permanent_delete = FALSE through an index
+        "UPDATE pdfs SET permanent_delete = FALSE WHERE permanent_delete IS NULL",
+        # PDFs deleted before deleted_at existed get their grace period from now
+        "UPDATE pdfs SET deleted_at = NOW() WHERE permanent_delete = TRUE AND deleted_at IS NULL",
+        "ALTER TABLE pdfs MODIFY permanent_delete BOOLEAN NOT NULL DEFAULT FALSE",
+        add_index('pdfs', 'idx_permanent_delete_created', 'permanent_delete, created_at'),
+        # The purge job deletes a PDF's rollup rows by pdf_id
+        add_index('viewer_pdf_activity', 'idx_pdf', 'pdf_id'),
+    ]),
+    (12, 'compact_event_tables', [
+        # Each distinct user agent, browser, OS and device type is stored once and
+        # referenced by id from viewing_sessions
+        '''CREATE TABLE IF NOT EXISTS user_agents
+           (id INT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            UNIQUE KEY uq_name (name))''',
+        '''CREATE TABLE IF NOT EXISTS browsers
+           (id SMALLINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            UNIQUE KEY uq_name (name))''',
+        '''CREATE TABLE IF NOT EXISTS operating_systems
+           (id SMALLINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            UNIQUE KEY uq_name (name))''',
+        '''CREATE TABLE IF NOT EXISTS device_types
+           (id SMALLINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(50) NOT NULL,
+            UNIQUE KEY uq_name (name))''',
+        # viewing_sessions: session_id becomes the UUID's 16 bytes; the filename
+        # copy and the never-written country, city and is_remote_view go
+        when_column_exists('viewing_sessions', 'user_agent',
+            add_column('viewing_sessions', 'session_uuid', 'BINARY(16) NULL'),
+            add_column('viewing_sessions', 'user_agent_id', 'INT UNSIGNED NULL'),
+            add_column('viewing_sessions', 'browser_id', 'SMALLINT UNSIGNED NULL'),
+            add_column('viewing_sessions', 'operating_system_id', 'SMALLINT UNSIGNED NULL'),
+            add_column('viewing_sessions', 'device_type_id', 'SMALLINT UNSIGNED NULL'),
+            '''INSERT IGNORE INTO user_agents (name)
+               SELECT DISTINCT user_agent FROM viewing_sessions WHERE CHAR_LENGTH(user_agent) > 0''',
+            '''INSERT IGNORE INTO browsers (name)
+               SELECT DISTINCT browser FROM viewing_sessions WHERE CHAR_LENGTH(browser) > 0''',
+            '''INSERT IGNORE INTO operating_systems (name)
+               SELECT DISTINCT operating_system FROM viewing_sessions WHERE CHAR_LENGTH(operating_system) > 0''',
+            '''INSERT IGNORE INTO device_types (name)
+               SELECT DISTINCT device_type FROM viewing_sessions WHERE CHAR_LENGTH(device_type) > 0''',
+            # Anything that isn't a UUID string gets a fresh random one
+            '''UPDATE viewing_sessions vs
+               LEFT JOIN user_agents ua ON ua.name = vs.user_agent
+               LEFT JOIN browsers br ON br.name = vs.browser
+               LEFT JOIN operating_systems os ON os.name = vs.operating_system
+               LEFT JOIN device_types dt ON dt.name = vs.device_type
+               SET vs.session_uuid = COALESCE(
+                       IF(CHAR_LENGTH(REPLACE(vs.session_id, '-', '')) = 32,
+                          UNHEX(REPLACE(vs.session_id, '-', '')), NULL),
+                       UNHEX(REPLACE(UUID(), '-', ''))),
+                   vs.user_agent_id = ua.id,
+                   vs.browser_id = br.id,
+                   vs.operating_system_id = os.id,
+                   vs.device_type_id = dt.id
+               WHERE vs.session_uuid IS NULL''',
+            '''ALTER TABLE viewing_sessions
+               DROP INDEX idx_session_id,
+               DROP COLUMN session_id,
+               CHANGE session_uuid session_id BINARY(16) NOT NULL AFTER id,
+               ADD INDEX idx_session_id (session_id),
+               DROP COLUMN user_agent,
+               DROP COLUMN original_filename,
+               DROP COLUMN browser,
+               DROP COLUMN operating_system,
+               DROP COLUMN device_type,
+               DROP COLUMN country,
+               DROP COLUMN city,
+               DROP COLUMN is_remote_view''',
+        ),
+        # page_views: scroll depth (0-1) in units of 1/10000 and zoom level in
+        # units of 1/100 as SMALLINT UNSIGNED; the filename copy and the
+        # never-written view_count, last_viewed_at, total_time_on_page,
+        # max_scroll_depth and max_zoom_level go
+        when_column_exists('page_views', 'original_filename',
+            add_column('page_views', 'scroll_depth_fixed', 'SMALLINT UNSIGNED NULL'),
+            add_column('page_views', 'zoom_level_fixed', 'SMALLINT UNSIGNED NULL'),
+            '''UPDATE page_views
+               SET scroll_depth_fixed = ROUND(LEAST(GREATEST(COALESCE(scroll_depth, 0), 0), 1) * 10000),
+                   zoom_level_fixed = ROUND(LEAST(GREATEST(COALESCE(zoom_level, 1), 0), 655.35) * 100)
+               WHERE scroll_depth_fixed IS NULL OR zoom_level_fixed IS NULL''',
+            '''ALTER TABLE page_views
+               DROP COLUMN scroll_depth,
+               DROP COLUMN zoom_level,
+               CHANGE scroll_depth_fixed scroll_depth SMALLINT UNSIGNED NOT NULL DEFAULT 0 AFTER duration,
+               CHANGE zoom_level_fixed zoom_level SMALLINT UNSIGNED NOT NULL DEFAULT 100 AFTER scroll_depth,
+               DROP COLUMN original_filename,
+               DROP COLUMN view_count,
+               DROP COLUMN last_viewed_at,
+               DROP COLUMN total_time_on_page,
+               DROP COLUMN max_scroll_depth,
+               DROP COLUMN max_zoom_level''',
+        ),
+    ]),
+    (13, 'pdfs_unique_filename', [
+        # The folder sync used to run in every worker at once and could register
+        # the same file twice; merge those rows before filename becomes unique
+        *[f'''UPDATE {table} t JOIN ({PDF_FILENAME_DUPLICATES}) d ON t.pdf_id = d.duplicate_id
+              SET t.pdf_id = d.keep_id'''
+          for table in ('viewing_sessions', 'page_views', 'view_events', 'upload_jobs')],
+        f'''UPDATE url_mappings um JOIN ({PDF_FILENAME_DUPLICATES}) d ON um.pdf_id = d.duplicate_id
+            SET um.pdf_id = d.keep_id, um.original_url = d.keep_url''',
+        f'''DELETE vpa FROM viewer_pdf_activity vpa
+            JOIN ({PDF_FILENAME_DUPLICATES}) d ON vpa.pdf_id = d.duplicate_id''',
+        f'''INSERT INTO viewer_pdf_activity
+               (viewer_id, pdf_id, sessions, completed_sessions, total_duration,
+                max_unique_pages, first_seen, last_seen)
+           SELECT vs.viewer_id, vs.pdf_id, COUNT(*), SUM(vs.status = 'completed'),
+                  COALESCE(SUM(vs.total_duration), 0), COALESCE(MAX(vs.unique_pages), 0),
+                  MIN(vs.start_time), MAX(COALESCE(vs.last_activity, vs.start_time))
+           FROM viewing_sessions vs
+           JOIN ({PDF_FILENAME_KEEPERS}) k ON k.keep_id = vs.pdf_id
+           WHERE vs.viewer_id IS NOT NULL AND vs.is_admin = FALSE
+           GROUP BY vs.viewer_id, vs.pdf_id
+           ON DUPLICATE KEY UPDATE
+               sessions = VALUES(sessions),
+               completed_sessions = VALUES(completed_sessions),
+               total_duration = VALUES(total_duration),
+               max_unique_pages = VALUES(max_unique_pages),
+               first_seen = VALUES(first_seen),
+               last_seen = VALUES(last_seen)''',
+        f'''DELETE p FROM pdfs p
+            JOIN ({PDF_FILENAME_KEEPERS}) k ON k.filename = p.filename AND p.id <> k.keep_id''',
+        add_unique_index('pdfs', 'uq_filename', 'filename'),
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Migrations that rebuild whole tables with blocking ALTERs and full-table UPDATEs.
+# Startup applies them only while those tables hold at most OFFLINE_ROW_LIMIT rows
+# (a new or lightly used install); otherwise it stops with a message and they are
+# applied by `python migrations.py --offline` with the app stopped.
+OFFLINE_MIGRATIONS = {
+    12: ['viewing_sessions', 'page_views'],
+}
+OFFLINE_ROW_LIMIT = 10000
+
+
+def migration_checksum(name, steps):
+    # Whitespace-insensitive so re-indenting a migration doesn't count as editing it
+    digest = hashlib.sha256(name.encode('utf-8'))
+    for step in steps:
+        digest.update(b'\0')
+        digest.update(' '.join(repr(step).split()).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get_schema_version(cursor):
+    """Return the applied schema version, or None if schema_version doesn't exist"""
+    try:
+        cursor.execute("SELECT MAX(version) FROM schema_version")
+    except mysql.connector.ProgrammingError as e:
+        if e.errno == errorcode.ER_NO_SUCH_TABLE:
+            return None
+        raise
+    row = cursor.fetchone()
+    return row[0] or 0
+
+
+def column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    return cursor.fetchone()[0] > 0
+
+
+def index_exists(cursor, table, name):
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, name))
+    return cursor.fetchone()[0] > 0
+
+
+def foreign_key_exists(cursor, table, name):
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.REFERENTIAL_CONSTRAINTS
+        WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = %s AND CONSTRAINT_NAME = %s
+    """, (table, name))
+    return cursor.fetchone()[0] > 0
+
+
+def has_more_rows(cursor, tables, limit):
+    for table in tables:
+        cursor.execute(f"SELECT 1 FROM {table} LIMIT 1 OFFSET {int(limit)}")
+        if cursor.fetchone():
+            return True
+    return False
+
+
+def run_online_ddl(cursor, statement):
+    # Try a non-locking in-place ALTER first and fall back to the server's default
+    # algorithm only if the server refuses it
+    try:
+        cursor.execute(f"{statement}, ALGORITHM=INPLACE, LOCK=NONE")
+    except mysql.connector.Error as e:
+        if e.errno not in ONLINE_DDL_UNSUPPORTED:
+            raise
+        print(f"Online DDL not supported ({e.msg}), falling back to default algorithm")
+        cursor.execute(statement)
+
+
+def apply_step(cursor, step):
+    if isinstance(step, str):
+        cursor.execute(step)
+        return
+
+    kind = step[0]
+    if kind == 'add_column':
+        _, table, column, definition = step
+        if column_exists(cursor, table, column):
+            print(f"  {table}.{column} already exists")
+            return
+        print(f"  Adding column {table}.{column}")
+        run_online_ddl(cursor, f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    elif kind == 'add_index':
+        _, table, name, columns = step
+        if index_exists(cursor, table, name):
+            print(f"  Index {table}.{name} already exists")
+            return
+        print(f"  Creating index {table}.{name} ({columns})")
+        run_online_ddl(cursor, f"ALTER TABLE {table} ADD INDEX {name} ({columns})")
+    elif kind == 'add_unique_index':
+        _, table, name, columns = step
+        if index_exists(cursor, table, name):
+            print(f"  Index {table}.{name} already exists")
+            return
+        print(f"  Creating unique index {table}.{name} ({columns})")
+        run_online_ddl(cursor, f"ALTER TABLE {table} ADD UNIQUE INDEX {name} ({columns})")
+    elif kind == 'drop_foreign_key':
+        _, table, name = step
+        if not foreign_key_exists(cursor, table, name):
+            print(f"  Foreign key {table}.{name} already dropped")
+            return
+        print(f"  Dropping foreign key {table}.{name}")
+        cursor.execute(f"ALTER TABLE {table} DROP FOREIGN KEY {name}")
+    elif kind == 'when_column_exists':
+        _, table, column, steps = step
+        if not column_exists(cursor, table, column):
+            print(f"  {table}.{column} already converted")
+            return
+        for inner_step in steps:
+            apply_step(cursor, inner_step)
+    else:
+        raise ValueError(f"Unknown migration step: {kind}")
+
+
+def run_migrations(conn, offline=False):
+    """Bring the schema up to LATEST_VERSION; returns the number of migrations applied.
+
+    Without offline, stops at an OFFLINE_MIGRATIONS entry whose tables are large.
+    """
+    cursor = conn.cursor(buffered=True)
+
+    # Fast path: a single indexed read when the schema is already current
+    current_version = get_schema_version(cursor)
+    if current_version is not None and current_version >= LATEST_VERSION:
+        if current_version > LATEST_VERSION:
+            print(f"Database schema version {current_version} is newer than this code ({LATEST_VERSION})")
+        else:
+            print(f"Database schema is up to date (version {current_version})")
+        cursor.close()
+        return 0
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            checksum CHAR(64) NOT NULL,
+            applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            execution_ms INT NOT NULL DEFAULT 0
+        )
+    """)
+
+    cursor.execute("SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK_NAME, MIGRATION_LOCK_TIMEOUT))
+    if cursor.fetchone()[0] != 1:
+        raise RuntimeError("Timed out waiting for another process to finish schema migrations")
+
+    try:
+        cursor.execute(f"SET SESSION lock_wait_timeout = {DDL_LOCK_WAIT_TIMEOUT}")
+
+        # Re-read under the lock; another process may have migrated while we waited
+        cursor.execute("SELECT version, checksum FROM schema_version")
+        applied = dict(cursor.fetchall())
+
+        applied_count = 0
+        for version, name, steps in MIGRATIONS:
+            checksum = migration_checksum(name, steps)
+            if version in applied:
+                if applied[version] != checksum:
+                    raise RuntimeError(
+                        f"Checksum mismatch for applied migration {version} ({name}); "
+                        f"shipped migrations must not be edited")
+                continue
+
+            rebuilt = OFFLINE_MIGRATIONS.get(version)
+            if rebuilt and not offline and has_more_rows(cursor, rebuilt, OFFLINE_ROW_LIMIT):
+                raise RuntimeError(
+                    f"Migration {version} ({name}) rebuilds {', '.join(rebuilt)}, which are too large "
+                    f"to convert at startup; stop the app and run `python migrations.py --offline`")
+
+            print(f"Applying migration {version}: {name}")
+            started = time.time()
+            for step in steps:
+                apply_step(cursor, step)
+            execution_ms = int((time.time() - started) * 1000)
+
+            cursor.execute("""
+                INSERT INTO schema_version (version, name, checksum, execution_ms)
+                VALUES (%s, %s, %s, %s)
+            """, (version, name, checksum, execution_ms))
+            conn.commit()
+            applied_count += 1
+            print(f"Migration {version} applied in {execution_ms} ms")
+
+        return applied_count
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK_NAME,))
+        cursor.fetchone()
+        cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations")
+    parser.add_argument('--offline', action='store_true',
+                        help="also apply migrations that rebuild large tables (stop the app first)")
+    args = parser.parse_args()
+
+    from pdftracker import get_db_connection
+    conn = get_db_connection()
+    try:
+        applied = run_migrations(conn, offline=args.offline)
+        print(f"{applied} migration(s) applied")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
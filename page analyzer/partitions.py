@@ -0,0 +1,288 @@
+"""Monthly RANGE partitioning and retention for the event tables.
+
+Usage: python partitions.py status|enable|maintain
+
+page_views and viewing_sessions grow with every view. Partitioned by month on
+start_time, queries with a date filter only touch the matching months, and old
+months can be archived to gzip files and dropped instantly instead of DELETEd.
+
+Partitioning is opt-in: `enable` rebuilds both tables (run it in a maintenance
+window). MySQL doesn't allow foreign keys on partitioned tables, so it drops
+the ones on and to these tables, and widens their primary keys to
+(id, start_time). That happens outside migrations.py, so `enable` requires a
+fully migrated schema, and migrations touching those keys must check for them. Once enabled, the app's maintenance task keeps
+EVENT_PARTITION_MONTHS_AHEAD months of empty partitions ready and applies
+EVENT_RETENTION_MONTHS.
+"""
+import datetime
+import gzip
+import json
+import os
+import re
+import sys
+
+PARTITIONED_TABLES = ['page_views', 'viewing_sessions']
+PARTITION_COLUMN = 'start_time'
+FUTURE_PARTITION = 'pfuture'
+PARTITION_NAME = re.compile(r'^p(\d{4})(\d{2})$')
+MAINTENANCE_LOCK_NAME = 'pdf_analytics_partition_maintenance'
+# Page views are stamped by the database clock and sessions in IST, so a page view
+# can sit in the month before its session's partition; page view months are kept
+# this many months longer than session months
+PAGE_VIEW_RETENTION_SLACK_MONTHS = 1
+ARCHIVE_FETCH_ROWS = 5000
+
+
+def month_start(day):
+    return datetime.date(day.year, day.month, 1)
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return datetime.date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"p{month.year:04d}{month.month:02d}"
+
+
+def partition_definition(month):
+    # Holds rows from `month` up to the start of the next month
+    return (f"PARTITION {partition_name(month)} VALUES LESS THAN "
+            f"(TO_DAYS('{add_months(month, 1).isoformat()}'))")
+
+
+def monthly_partitions(cursor, table):
+    """First day of each month with a partition on table, oldest first ([] if unpartitioned)"""
+    cursor.execute("""
+        SELECT PARTITION_NAME
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+    """, (table,))
+    months = []
+    for (name,) in cursor.fetchall():
+        match = PARTITION_NAME.match(name)
+        if match:
+            months.append(datetime.date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+def is_partitioned(cursor):
+    return all(monthly_partitions(cursor, table) for table in PARTITIONED_TABLES)
+
+
+def foreign_keys(cursor, tables):
+    """(table, constraint) for every foreign key on or referencing these tables"""
+    placeholders = ', '.join(['%s'] * len(tables))
+    cursor.execute(f"""
+        SELECT TABLE_NAME, CONSTRAINT_NAME
+        FROM information_schema.REFERENTIAL_CONSTRAINTS
+        WHERE CONSTRAINT_SCHEMA = DATABASE()
+          AND (TABLE_NAME IN ({placeholders}) OR REFERENCED_TABLE_NAME IN ({placeholders}))
+    """, list(tables) + list(tables))
+    return cursor.fetchall()
+
+
+def enable_partitioning(conn, months_ahead=3):
+    """Rebuild page_views and viewing_sessions as monthly partitioned tables"""
+    from migrations import LATEST_VERSION, get_schema_version
+    cursor = conn.cursor(buffered=True)
+    try:
+        # The foreign keys and primary keys change outside migrations.py, so only
+        # on a fully migrated schema; migrations that touch these keys check for them
+        version = get_schema_version(cursor)
+        if version != LATEST_VERSION:
+            raise RuntimeError(f"Schema is at version {version}, expected {LATEST_VERSION}; "
+                               f"run `python migrations.py` first")
+        for table, constraint in foreign_keys(cursor, PARTITIONED_TABLES):
+            print(f"Dropping foreign key {table}.{constraint}")
+            cursor.execute(f"ALTER TABLE {table} DROP FOREIGN KEY {constraint}")
+
+        current = month_start(datetime.date.today())
+        for table in PARTITIONED_TABLES:
+            if monthly_partitions(cursor, table):
+                print(f"{table} is already partitioned")
+                continue
+            cursor.execute(f"SELECT MIN({PARTITION_COLUMN}) FROM {table}")
+            oldest = cursor.fetchone()[0]
+            month = month_start(oldest.date() if oldest else current)
+            definitions = []
+            while month <= add_months(current, months_ahead):
+                definitions.append(partition_definition(month))
+                month = add_months(month, 1)
+            definitions.append(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE")
+
+            print(f"Partitioning {table} into {len(definitions)} partitions (this rebuilds the table)")
+            cursor.execute(f"""
+                ALTER TABLE {table}
+                DROP PRIMARY KEY,
+                ADD PRIMARY KEY (id, {PARTITION_COLUMN})
+                PARTITION BY RANGE (TO_DAYS({PARTITION_COLUMN})) (
+                    {', '.join(definitions)}
+                )
+            """)
+    finally:
+        cursor.close()
+
+
+def add_future_partitions(cursor, table, months_ahead):
+    """Split empty monthly partitions off pfuture so inserts never land in it"""
+    months = monthly_partitions(cursor, table)
+    if not months:
+        return 0
+    target = add_months(month_start(datetime.date.today()), months_ahead)
+    month = add_months(months[-1], 1)
+    definitions = []
+    while month <= target:
+        definitions.append(partition_definition(month))
+        month = add_months(month, 1)
+    if definitions:
+        definitions.append(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE")
+        cursor.execute(f"ALTER TABLE {table} REORGANIZE PARTITION {FUTURE_PARTITION} INTO ({', '.join(definitions)})")
+        print(f"Added {len(definitions) - 1} partition(s) to {table}")
+    return len(definitions) - 1 if definitions else 0
+
+
+def archive_value(value):
+    # BINARY columns (session UUIDs) as hex; datetimes and decimals as strings
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    return str(value)
+
+
+def write_archive(path, cursor):
+    """Stream the rows of an executed dictionary cursor to path as gzipped JSON lines"""
+    staging = path + '.tmp'
+    rows = 0
+    with open(staging, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as archive:
+            while True:
+                batch = cursor.fetchmany(ARCHIVE_FETCH_ROWS)
+                if not batch:
+                    break
+                for row in batch:
+                    archive.write(json.dumps(row, default=archive_value).encode('utf-8') + b'\n')
+                rows += len(batch)
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(staging, path)
+    return rows
+
+
+def archive_partition(conn, table, month, archive_folder):
+    """Write every row of one partition to <archive_folder>/<table>-pYYYYMM.jsonl.gz"""
+    os.makedirs(archive_folder, exist_ok=True)
+    path = os.path.join(archive_folder, f"{table}-{partition_name(month)}.jsonl.gz")
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"SELECT * FROM {table} PARTITION ({partition_name(month)}) ORDER BY id")
+        rows = write_archive(path, cursor)
+    finally:
+        cursor.close()
+    return path, rows
+
+
+def drop_partition(conn, cursor, table, month, archive_folder):
+    if archive_folder:
+        path, rows = archive_partition(conn, table, month, archive_folder)
+        print(f"Archived {rows} row(s) of {table} {partition_name(month)} to {path}")
+    cursor.execute(f"ALTER TABLE {table} DROP PARTITION {partition_name(month)}")
+    print(f"Dropped {table} partition {partition_name(month)}")
+
+
+def references_kept_session(cursor, month):
+    cursor.execute(f"""
+        SELECT 1
+        FROM page_views PARTITION ({partition_name(month)}) pv
+        JOIN viewing_sessions vs ON vs.id = pv.session_id
+        LIMIT 1
+    """)
+    return cursor.fetchone() is not None
+
+
+def apply_retention(conn, retention_months, archive_folder=None):
+    """Archive (when archive_folder is set) and drop partitions older than retention_months.
+
+    Without foreign keys nothing else keeps the tables consistent, so sessions go
+    first and a page view month only once every session it can belong to is gone:
+    PAGE_VIEW_RETENTION_SLACK_MONTHS after the session cutoff, and only if none of
+    its rows still joins to a session. Until then its rows are invisible to
+    reports, which all reach page_views through viewing_sessions.
+    """
+    if retention_months <= 0:
+        return 0
+    session_cutoff = add_months(month_start(datetime.date.today()), -retention_months)
+    page_view_cutoff = add_months(session_cutoff, -PAGE_VIEW_RETENTION_SLACK_MONTHS)
+    cursor = conn.cursor(buffered=True)
+    dropped = 0
+    try:
+        for month in monthly_partitions(cursor, 'viewing_sessions'):
+            if month >= session_cutoff:
+                break
+            drop_partition(conn, cursor, 'viewing_sessions', month, archive_folder)
+            dropped += 1
+        for month in monthly_partitions(cursor, 'page_views'):
+            if month >= page_view_cutoff:
+                break
+            if references_kept_session(cursor, month):
+                print(f"Keeping page_views {partition_name(month)}: some of its sessions are still kept")
+                break
+            drop_partition(conn, cursor, 'page_views', month, archive_folder)
+            dropped += 1
+    finally:
+        cursor.close()
+    return dropped
+
+
+def maintain(conn, months_ahead=3, retention_months=0, archive_folder=None):
+    """Add upcoming partitions and apply retention; a no-op on unpartitioned tables"""
+    cursor = conn.cursor(buffered=True)
+    try:
+        if not is_partitioned(cursor):
+            return False
+        # One maintainer at a time across workers; the others skip this round
+        cursor.execute("SELECT GET_LOCK(%s, 0)", (MAINTENANCE_LOCK_NAME,))
+        if cursor.fetchone()[0] != 1:
+            return False
+        try:
+            for table in PARTITIONED_TABLES:
+                add_future_partitions(cursor, table, months_ahead)
+            apply_retention(conn, retention_months, archive_folder)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (MAINTENANCE_LOCK_NAME,))
+            cursor.fetchone()
+        return True
+    finally:
+        cursor.close()
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    if command not in ('status', 'enable', 'maintain'):
+        print(__doc__)
+        sys.exit(2)
+
+    from pdftracker import (get_db_connection, EVENT_PARTITION_MONTHS_AHEAD,
+                            EVENT_RETENTION_MONTHS, EVENT_ARCHIVE_FOLDER)
+    conn = get_db_connection()
+    try:
+        if command == 'enable':
+            enable_partitioning(conn, EVENT_PARTITION_MONTHS_AHEAD)
+        elif command == 'maintain':
+            if not maintain(conn, EVENT_PARTITION_MONTHS_AHEAD, EVENT_RETENTION_MONTHS, EVENT_ARCHIVE_FOLDER):
+                print("Tables are not partitioned (or another process holds the maintenance lock)")
+        cursor = conn.cursor(buffered=True)
+        for table in PARTITIONED_TABLES:
+            months = monthly_partitions(cursor, table)
+            if months:
+                print(f"{table}: {len(months)} monthly partitions, "
+                      f"{partition_name(months[0])} to {partition_name(months[-1])}")
+            else:
+                print(f"{table}: not partitioned")
+        cursor.close()
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,575 @@
+"""Lightweight PDF inspection that reads only the cross-reference data and the few
+objects it needs (trailer, /Root, /Root/Pages, /Info) instead of building a full
+PyPDF2.PdfReader and walking the page tree. Anything the probe doesn't understand
+raises ProbeError so callers can fall back to the full parser."""
+import re
+import zlib
+from collections import namedtuple
+
+TAIL_SIZE = 4096
+OBJECT_WINDOW = 16 * 1024
+MAX_OBJECT_WINDOW = 16 * 1024 * 1024
+MAX_XREF_SECTIONS = 256
+XREF_ENTRY_SIZE = 20
+
+WHITESPACE = b'\x00\t\n\x0c\r '
+DELIMITERS = b'()<>[]{}/%'
+
+OBJ_HEADER = re.compile(rb'\s*(\d+)\s+(\d+)\s+obj')
+XREF_SUBSECTION = re.compile(rb'(\d+)\s+(\d+)[ \t]*(?:\r\n|\r|\n)')
+XREF_ENTRY = re.compile(rb'(\d{10}) (\d{5}) ([nf])')
+NUMBER = re.compile(rb'[+-]?(?:\d+\.?\d*|\.\d+)')
+INTEGER = re.compile(rb'\s*(\d+)')
+
+INFO_FIELDS = (('/Title', 'title'), ('/Author', 'author'), ('/Producer', 'producer'))
+
+Ref = namedtuple('Ref', 'num gen')
+
+
+class ProbeError(Exception):
+    """The file uses a structure the probe doesn't handle; use the full parser"""
+
+
+class Truncated(ProbeError):
+    """The read window ended in the middle of an object"""
+
+
+class Parser:
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def skip_whitespace(self):
+        data = self.data
+        while self.pos < len(data):
+            c = data[self.pos]
+            if c in WHITESPACE:
+                self.pos += 1
+            elif c == 0x25:  # % comment
+                while self.pos < len(data) and data[self.pos] not in b'\r\n':
+                    self.pos += 1
+            else:
+                return
+        raise Truncated("Unexpected end of data")
+
+    def startswith(self, token):
+        return self.data.startswith(token, self.pos)
+
+    def parse_object(self):
+        self.skip_whitespace()
+        data = self.data
+        c = data[self.pos]
+        if self.startswith(b'<<'):
+            return self.parse_dict()
+        if c == 0x2F:  # /
+            return self.parse_name()
+        if c == 0x5B:  # [
+            return self.parse_array()
+        if c == 0x28:  # (
+            return self.parse_literal_string()
+        if c == 0x3C:  # <
+            return self.parse_hex_string()
+        if c in b'+-.0123456789':
+            return self.parse_number_or_ref()
+        for keyword, value in ((b'true', True), (b'false', False), (b'null', None)):
+            if self.startswith(keyword):
+                self.pos += len(keyword)
+                return value
+        raise ProbeError(f"Unexpected token at offset {self.pos}")
+
+    def parse_dict(self):
+        self.pos += 2
+        result = {}
+        while True:
+            self.skip_whitespace()
+            if self.startswith(b'>>'):
+                self.pos += 2
+                return result
+            key = self.parse_object()
+            if not isinstance(key, str):
+                raise ProbeError("Dictionary key is not a name")
+            result[key] = self.parse_object()
+
+    def parse_array(self):
+        self.pos += 1
+        result = []
+        while True:
+            self.skip_whitespace()
+            if self.data[self.pos] == 0x5D:  # ]
+                self.pos += 1
+                return result
+            result.append(self.parse_object())
+
+    def parse_name(self):
+        data = self.data
+        start = self.pos
+        self.pos += 1
+        while self.pos < len(data) and data[self.pos] not in WHITESPACE and data[self.pos] not in DELIMITERS:
+            self.pos += 1
+        if self.pos >= len(data):
+            raise Truncated("Name runs past the end of data")
+        raw = data[start:self.pos]
+        if b'#' in raw:
+            raw = re.sub(rb'#([0-9A-Fa-f]{2})', lambda m: bytes([int(m.group(1), 16)]), raw)
+        return raw.decode('latin-1')
+
+    def parse_number_or_ref(self):
+        m = NUMBER.match(self.data, self.pos)
+        if not m:
+            raise ProbeError(f"Bad number at offset {self.pos}")
+        self.pos = m.end()
+        token = m.group(0)
+        if b'.' in token:
+            return float(token)
+        value = int(token)
+
+        # "num gen R" is an indirect reference
+        saved = self.pos
+        try:
+            self.skip_whitespace()
+            gen = INTEGER.match(self.data, self.pos)
+            if gen:
+                self.pos = gen.end()
+                self.skip_whitespace()
+                if self.startswith(b'R'):
+                    self.pos += 1
+                    return Ref(value, int(gen.group(1)))
+        except Truncated:
+            if self.pos >= len(self.data):
+                raise
+        self.pos = saved
+        return value
+
+    def parse_literal_string(self):
+        data = self.data
+        self.pos += 1
+        depth = 1
+        out = bytearray()
+        escapes = {ord('n'): b'\n', ord('r'): b'\r', ord('t'): b'\t', ord('b'): b'\b', ord('f'): b'\f'}
+        while self.pos < len(data):
+            c = data[self.pos]
+            self.pos += 1
+            if c == 0x5C:  # backslash
+                if self.pos >= len(data):
+                    break
+                e = data[self.pos]
+                self.pos += 1
+                if e in escapes:
+                    out += escapes[e]
+                elif 0x30 <= e <= 0x37:
+                    digits = bytes([e])
+                    while len(digits) < 3 and self.pos < len(data) and 0x30 <= data[self.pos] <= 0x37:
+                        digits += bytes([data[self.pos]])
+                        self.pos += 1
+                    out.append(int(digits, 8) & 0xFF)
+                elif e == 0x0D:
+                    if self.pos < len(data) and data[self.pos] == 0x0A:
+                        self.pos += 1
+                elif e != 0x0A:
+                    out.append(e)
+            elif c == 0x28:
+                depth += 1
+                out.append(c)
+            elif c == 0x29:
+                depth -= 1
+                if depth == 0:
+                    return bytes(out)
+                out.append(c)
+            else:
+                out.append(c)
+        raise Truncated("String runs past the end of data")
+
+    def parse_hex_string(self):
+        end = self.data.find(b'>', self.pos)
+        if end < 0:
+            raise Truncated("Hex string runs past the end of data")
+        digits = bytes(c for c in self.data[self.pos + 1:end] if c not in WHITESPACE)
+        self.pos = end + 1
+        if len(digits) % 2:
+            digits += b'0'
+        try:
+            return bytes.fromhex(digits.decode('ascii'))
+        except ValueError:
+            raise ProbeError("Bad hex string")
+
+
+def png_unpredict(data, columns, bytes_per_pixel):
+    row_length = columns + 1
+    if len(data) % row_length:
+        raise ProbeError("Predicted stream length is not a whole number of rows")
+    out = bytearray()
+    previous = bytearray(columns)
+    for start in range(0, len(data), row_length):
+        kind = data[start]
+        row = bytearray(data[start + 1:start + row_length])
+        if kind == 1:
+            for i in range(bytes_per_pixel, columns):
+                row[i] = (row[i] + row[i - bytes_per_pixel]) & 0xFF
+        elif kind == 2:
+            row = bytearray((a + b) & 0xFF for a, b in zip(row, previous))
+        elif kind == 3:
+            for i in range(columns):
+                left = row[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
+                row[i] = (row[i] + ((left + previous[i]) >> 1)) & 0xFF
+        elif kind == 4:
+            for i in range(columns):
+                a = row[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
+                b = previous[i]
+                c = previous[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                if pa <= pb and pa <= pc:
+                    predictor = a
+                elif pb <= pc:
+                    predictor = b
+                else:
+                    predictor = c
+                row[i] = (row[i] + predictor) & 0xFF
+        elif kind != 0:
+            raise ProbeError(f"Unknown PNG predictor {kind}")
+        out += row
+        previous = row
+    return bytes(out)
+
+
+def decode_stream(stream_dict, raw):
+    filters = stream_dict.get('/Filter')
+    params = stream_dict.get('/DecodeParms')
+    if isinstance(filters, list):
+        if len(filters) > 1:
+            raise ProbeError("Chained stream filters are not supported")
+        filters = filters[0] if filters else None
+        params = params[0] if isinstance(params, list) and params else params
+    if filters is None:
+        return raw
+    if filters != '/FlateDecode':
+        raise ProbeError(f"Unsupported stream filter {filters}")
+    try:
+        data = zlib.decompress(raw)
+    except zlib.error:
+        # Tolerate trailing garbage after the compressed data
+        data = zlib.decompressobj().decompress(raw)
+
+    params = params if isinstance(params, dict) else {}
+    predictor = params.get('/Predictor', 1)
+    if predictor == 1:
+        return data
+    if predictor < 10:
+        raise ProbeError(f"Unsupported predictor {predictor}")
+    colors = params.get('/Colors', 1)
+    bits = params.get('/BitsPerComponent', 8)
+    columns = params.get('/Columns', 1)
+    return png_unpredict(data, columns * colors * bits // 8, max(1, colors * bits // 8))
+
+
+class ClassicSection:
+    def __init__(self, subsections):
+        self.subsections = subsections
+
+    def lookup(self, probe, num):
+        for first, count, position in self.subsections:
+            if first <= num < first + count:
+                entry = probe.read_at(position + (num - first) * XREF_ENTRY_SIZE, XREF_ENTRY_SIZE)
+                m = XREF_ENTRY.match(entry)
+                if not m:
+                    raise ProbeError(f"Malformed xref entry for object {num}")
+                if m.group(3) == b'f':
+                    return ('f',)
+                return ('n', int(m.group(1)))
+        return None
+
+
+class StreamSection:
+    def __init__(self, stream_dict, data):
+        widths = stream_dict.get('/W')
+        if not isinstance(widths, list) or len(widths) != 3:
+            raise ProbeError("Bad /W in xref stream")
+        self.widths = widths
+        self.row_size = sum(widths)
+        index = stream_dict.get('/Index', [0, stream_dict.get('/Size', 0)])
+        self.ranges = []
+        row = 0
+        for i in range(0, len(index) - 1, 2):
+            self.ranges.append((index[i], index[i + 1], row))
+            row += index[i + 1]
+        self.data = data
+
+    def field(self, offset, width, default):
+        if width == 0:
+            return default
+        return int.from_bytes(self.data[offset:offset + width], 'big')
+
+    def lookup(self, probe, num):
+        for first, count, row in self.ranges:
+            if first <= num < first + count:
+                offset = (row + num - first) * self.row_size
+                if offset + self.row_size > len(self.data):
+                    raise ProbeError("Xref stream is shorter than its /Index")
+                w1, w2, w3 = self.widths
+                kind = self.field(offset, w1, 1)
+                second = self.field(offset + w1, w2, 0)
+                third = self.field(offset + w1 + w2, w3, 0)
+                if kind == 0:
+                    return ('f',)
+                if kind == 1:
+                    return ('n', second)
+                if kind == 2:
+                    return ('c', second, third)
+                return None
+        return None
+
+
+class PdfProbe:
+    def __init__(self, pdf_file):
+        self.file = pdf_file
+        self.size = pdf_file.seek(0, 2)
+        self.sections = []
+        self.trailer = None
+        self.object_streams = {}
+
+    def read_at(self, offset, length):
+        if offset < 0 or offset >= self.size:
+            raise ProbeError(f"Offset {offset} is outside the file")
+        self.file.seek(offset)
+        return self.file.read(length)
+
+    def parse_at(self, offset, parse):
+        """Run parse(Parser) on a window at offset, growing the window if it was too small"""
+        window = OBJECT_WINDOW
+        while True:
+            data = self.read_at(offset, window)
+            try:
+                return parse(data), data
+            except (Truncated, IndexError):
+                if len(data) < window or window >= MAX_OBJECT_WINDOW:
+                    raise ProbeError(f"Object at offset {offset} is truncated")
+                window *= 4
+
+    def find_startxref(self):
+        tail_offset = max(0, self.size - TAIL_SIZE)
+        tail = self.read_at(tail_offset, TAIL_SIZE)
+        position = tail.rfind(b'startxref')
+        if position < 0:
+            raise ProbeError("No startxref")
+        m = INTEGER.match(tail, position + len(b'startxref'))
+        if not m:
+            raise ProbeError("Bad startxref")
+        return int(m.group(1))
+
+    def load_xref(self):
+        pending = [self.find_startxref()]
+        seen = set()
+        while pending:
+            offset = pending.pop(0)
+            if offset in seen:
+                continue
+            if len(seen) >= MAX_XREF_SECTIONS:
+                raise ProbeError("Too many xref sections")
+            seen.add(offset)
+
+            head = self.read_at(offset, 32).lstrip(WHITESPACE)
+            if head.startswith(b'xref'):
+                section, trailer = self.load_classic_section(offset)
+            else:
+                section, trailer = self.load_stream_section(offset)
+            self.sections.append(section)
+            if self.trailer is None:
+                self.trailer = trailer
+
+            # Lookup order: this section, its hybrid /XRefStm, then older revisions
+            following = []
+            for key in ('/XRefStm', '/Prev'):
+                if isinstance(trailer.get(key), int):
+                    following.append(trailer[key])
+            pending = following + pending
+
+        if not isinstance(self.trailer.get('/Root'), Ref):
+            raise ProbeError("Trailer has no /Root")
+
+    def load_classic_section(self, offset):
+        data = self.read_at(offset, 64)
+        position = offset + data.index(b'xref') + 4
+        subsections = []
+        while True:
+            data = self.read_at(position, 64)
+            stripped = data.lstrip(WHITESPACE)
+            position += len(data) - len(stripped)
+            if stripped.startswith(b'trailer'):
+                def parse_trailer(window):
+                    parser = Parser(window, len(b'trailer'))
+                    parser.skip_whitespace()
+                    if not parser.startswith(b'<<'):
+                        raise ProbeError("Trailer is not a dictionary")
+                    return parser.parse_dict()
+                trailer, _ = self.parse_at(position, parse_trailer)
+                return ClassicSection(subsections), trailer
+            m = XREF_SUBSECTION.match(stripped)
+            if not m:
+                raise ProbeError(f"Malformed xref subsection at offset {position}")
+            first, count = int(m.group(1)), int(m.group(2))
+            entries = position + m.end()
+            subsections.append((first, count, entries))
+            position = entries + count * XREF_ENTRY_SIZE
+
+    def load_stream_section(self, offset):
+        stream_dict, data = self.read_stream_object(offset)
+        if stream_dict.get('/Type') != '/XRef':
+            raise ProbeError("startxref does not point at an xref table or stream")
+        return StreamSection(stream_dict, data), stream_dict
+
+    def read_indirect(self, offset, num=None):
+        """Parse the object at offset; returns (object, absolute offset just after it)"""
+        def parse(window):
+            m = OBJ_HEADER.match(window)
+            if not m or (num is not None and int(m.group(1)) != num):
+                raise ProbeError(f"No object {num} at offset {offset}")
+            parser = Parser(window, m.end())
+            value = parser.parse_object()
+            parser.skip_whitespace()
+            return value, parser.pos
+        (value, end), _ = self.parse_at(offset, parse)
+        return value, offset + end
+
+    def read_stream_object(self, offset, num=None):
+        stream_dict, position = self.read_indirect(offset, num)
+        if not isinstance(stream_dict, dict):
+            raise ProbeError(f"Object at offset {offset} is not a stream")
+        head = self.read_at(position, 8)
+        if not head.startswith(b'stream'):
+            raise ProbeError(f"Object at offset {offset} has no stream data")
+        position += 6
+        if head[6:8] == b'\r\n':
+            position += 2
+        elif head[6:7] in (b'\n', b'\r'):
+            position += 1
+
+        length = stream_dict.get('/Length')
+        if isinstance(length, Ref) and self.sections:
+            length = self.resolve(length)
+        if isinstance(length, int) and length >= 0:
+            raw = self.read_at(position, length)
+        else:
+            # Length not usable yet (e.g. an indirect length inside an xref stream)
+            window = self.read_at(position, MAX_OBJECT_WINDOW)
+            end = window.find(b'endstream')
+            if end < 0:
+                raise ProbeError("Stream has no endstream")
+            raw = window[:end].rstrip(b'\r\n')
+        return stream_dict, decode_stream(stream_dict, raw)
+
+    def fetch(self, ref):
+        for section in self.sections:
+            entry = section.lookup(self, ref.num)
+            if entry is None:
+                continue
+            if entry[0] == 'f':
+                return None
+            if entry[0] == 'n':
+                value, _ = self.read_indirect(entry[1], ref.num)
+                return value
+            return self.fetch_compressed(ref.num, entry[1], entry[2])
+        return None
+
+    def fetch_compressed(self, num, stream_num, index):
+        if '/Encrypt' in self.trailer:
+            raise ProbeError("Object streams of encrypted files need the full parser")
+        if stream_num not in self.object_streams:
+            stream_offset = None
+            for section in self.sections:
+                entry = section.lookup(self, stream_num)
+                if entry is not None:
+                    if entry[0] != 'n':
+                        raise ProbeError(f"Object stream {stream_num} is not a plain object")
+                    stream_offset = entry[1]
+                    break
+            if stream_offset is None:
+                raise ProbeError(f"Object stream {stream_num} not found")
+            stream_dict, data = self.read_stream_object(stream_offset, stream_num)
+            count, first = stream_dict.get('/N'), stream_dict.get('/First')
+            if not isinstance(count, int) or not isinstance(first, int):
+                raise ProbeError(f"Object stream {stream_num} lacks /N or /First")
+            numbers = [int(token) for token in data[:first].split()]
+            if len(numbers) < count * 2:
+                raise ProbeError(f"Object stream {stream_num} has a short header")
+            offsets = {numbers[i]: numbers[i + 1] for i in range(0, count * 2, 2)}
+            self.object_streams[stream_num] = (first, offsets, data)
+
+        first, offsets, data = self.object_streams[stream_num]
+        if num not in offsets:
+            raise ProbeError(f"Object {num} missing from object stream {stream_num}")
+        try:
+            return Parser(data, first + offsets[num]).parse_object()
+        except (Truncated, IndexError):
+            raise ProbeError(f"Object {num} in object stream {stream_num} is truncated")
+
+    def resolve(self, value, depth=0):
+        while isinstance(value, Ref):
+            if depth > 32:
+                raise ProbeError("Reference chain too deep")
+            value = self.fetch(value)
+            depth += 1
+        return value
+
+    def page_count(self):
+        root = self.resolve(self.trailer['/Root'])
+        if not isinstance(root, dict):
+            raise ProbeError("/Root is not a dictionary")
+        pages = self.resolve(root.get('/Pages'))
+        if not isinstance(pages, dict):
+            raise ProbeError("/Root/Pages is not a dictionary")
+        count = self.resolve(pages.get('/Count'))
+        if not isinstance(count, int) or count < 0:
+            raise ProbeError("/Root/Pages/Count is not a valid integer")
+        return count
+
+    def document_info(self):
+        info = {}
+        if '/Encrypt' in self.trailer:
+            # Info strings are encrypted too
+            return info
+        try:
+            info_dict = self.resolve(self.trailer.get('/Info'))
+            if not isinstance(info_dict, dict):
+                return info
+            for key, name in INFO_FIELDS:
+                value = self.resolve(info_dict.get(key))
+                if isinstance(value, bytes) and value:
+                    info[name] = decode_text(value)
+        except ProbeError:
+            # Metadata is best effort; the page count is what matters
+            pass
+        return info
+
+
+def decode_text(value):
+    if value.startswith(b'\xfe\xff'):
+        return value[2:].decode('utf-16-be', errors='replace')
+    if value.startswith(b'\xef\xbb\xbf'):
+        return value[3:].decode('utf-8', errors='replace')
+    # PDFDocEncoding matches Latin-1 for everything but a few punctuation marks
+    return value.decode('latin-1')
+
+
+def probe_pdf(pdf_path):
+    """Return {'pages', 'encrypted', 'info'} for pdf_path or raise ProbeError"""
+    with open(pdf_path, 'rb') as pdf_file:
+        probe = PdfProbe(pdf_file)
+        try:
+            probe.load_xref()
+            return {
+                'pages': probe.page_count(),
+                'encrypted': '/Encrypt' in probe.trailer,
+                'info': probe.document_info()
+            }
+        except ProbeError:
+            raise
+        except (ValueError, IndexError, KeyError, TypeError, zlib.error) as e:
+            raise ProbeError(f"{type(e).__name__}: {str(e)}")
+
+
+def probe_page_count(pdf_path):
+    """Page count from /Root/Pages/Count, or None if the file needs the full parser"""
+    try:
+        return probe_pdf(pdf_path)['pages']
+    except ProbeError:
+        return None
@@ -1,31 +1,107 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file, Response
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file
+from flask.json.provider import DefaultJSONProvider
 import mysql.connector
 import datetime
 import uuid
 import os
 from dotenv import load_dotenv
-from werkzeug.utils import secure_filename
+from werkzeug.utils import secure_filename, send_file as werkzeug_send_file
+from werkzeug.wsgi import wrap_file
+from urllib.parse import quote
 import shutil
 import pytz
 import PyPDF2
 import random
 import string
 import time
+import json
+import hashlib
+import heapq
+import threading
+import zipfile
+import re
+import subprocess
+import mmap
+import gzip
+import decimal
+import struct
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from migrations import run_migrations
+from pdf_probe import probe_pdf, ProbeError
+import partitions
+import vendor_assets
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Optional: faster JSON encoding and brotli compression when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 load_dotenv()
 
+class AnalyticsJSONProvider(DefaultJSONProvider):
+    """JSON for MySQL rows as they come back: DECIMAL as numbers, DATETIME as '%Y-%m-%d %H:%M:%S'
+    and DATE as '%Y-%m-%d' strings, formatted as stored with no timezone conversion"""
+    sort_keys = False
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, decimal.Decimal):
+            return float(o)
+        if isinstance(o, datetime.datetime):
+            return o.strftime('%Y-%m-%d %H:%M:%S')
+        if isinstance(o, datetime.date):
+            return o.strftime('%Y-%m-%d')
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return self.orjson_dumps(obj).decode('utf-8')
+        return super().dumps(obj, **kwargs)
+
+    def orjson_dumps(self, obj):
+        return orjson.dumps(obj, default=self.default,
+                            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.orjson_dumps(obj) + b"\n", mimetype=self.mimetype)
+
 app = Flask(__name__)
 app.secret_key = "your_secret_key_here"
+app.json = AnalyticsJSONProvider(app)
 
 # Configure upload folders
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 USER_PDF_FOLDER = os.path.join(BASE_DIR, 'pdfs')
 ADMIN_PDF_FOLDER = os.path.join(BASE_DIR, 'admin_pdfs')
+CHUNKED_UPLOAD_FOLDER = os.path.join(BASE_DIR, 'partial_uploads')
+PAGE_CACHE_FOLDER = os.path.join(BASE_DIR, 'page_cache')
+INGEST_SPOOL_FOLDER = os.path.join(BASE_DIR, 'ingest_spool')
 ALLOWED_EXTENSIONS = {'pdf'}
 
+# Linearized ("fast web view") copies are written next to the original in the user folder
+LINEARIZED_SUFFIX = '.linear.pdf'
+
 # Create upload folders if they don't exist
 os.makedirs(USER_PDF_FOLDER, exist_ok=True)
 os.makedirs(ADMIN_PDF_FOLDER, exist_ok=True)
+os.makedirs(CHUNKED_UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(PAGE_CACHE_FOLDER, exist_ok=True)
+os.makedirs(INGEST_SPOOL_FOLDER, exist_ok=True)
 
 # Set folder permissions (if on Unix-like system)
 if os.name != 'nt':  # Not Windows
@@ -55,15 +131,62 @@ def generate_random_url():
     timestamp = int(time.time())
     return f"{random_string}-{timestamp}"
 
+def inspect_pdf(pdf_path):
+    """Page count, encryption flag and document info for pdf_path"""
+    # Read /Root/Pages/Count straight from the xref; only files the probe can't
+    # handle (damaged xref, unusual filters) pay for a full PyPDF2 parse
+    try:
+        return probe_pdf(pdf_path)
+    except ProbeError as e:
+        print(f"Page count probe fell back to PyPDF2 for {pdf_path}: {str(e)}")
+
+    with open(pdf_path, 'rb') as pdf_file:
+        pdf_reader = PyPDF2.PdfReader(pdf_file)
+        result = {'pages': len(pdf_reader.pages), 'encrypted': pdf_reader.is_encrypted, 'info': {}}
+        info = pdf_reader.metadata or {}
+        for key, name in (('/Title', 'title'), ('/Author', 'author'), ('/Producer', 'producer')):
+            if info.get(key):
+                result['info'][name] = str(info.get(key))
+    return result
+
+def count_pdf_pages(pdf_path):
+    return inspect_pdf(pdf_path)['pages']
+
+# The folder sync registers PDFs copied into the folders by hand. Files younger
+# than PDF_SYNC_MIN_AGE seconds are left alone: an upload saves its file before
+# registering it, and a bulk upload may take a while to get to the registration.
+PDF_SYNC_MIN_AGE = int(os.getenv('PDF_SYNC_MIN_AGE', '3600'))
+PDF_SYNC_LOCK = 'pdf_analytics_pdf_folder_sync'
+
+def sync_candidates(folder):
+    cutoff = time.time() - PDF_SYNC_MIN_AGE
+    files = set()
+    for f in os.listdir(folder):
+        if not f.endswith('.pdf') or f.endswith(LINEARIZED_SUFFIX):
+            continue
+        try:
+            if os.stat(os.path.join(folder, f)).st_mtime <= cutoff:
+                files.add(f)
+        except FileNotFoundError:
+            continue
+    return files
+
 def sync_pdf_folders():
     try:
         print("\n=== Starting PDF Folder Sync ===")
         conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
+        cursor = conn.cursor(dictionary=True, buffered=True)
+        
+        # One sync at a time, also across hosts sharing the database
+        cursor.execute("SELECT GET_LOCK(%s, 0) AS acquired", (PDF_SYNC_LOCK,))
+        if cursor.fetchone()['acquired'] != 1:
+            print("PDF folder sync already running elsewhere, skipping")
+            conn.close()
+            return
         
         # Get all PDFs from both folders
-        admin_files = set(f for f in os.listdir(ADMIN_PDF_FOLDER) if f.endswith('.pdf'))
-        user_files = set(f for f in os.listdir(USER_PDF_FOLDER) if f.endswith('.pdf'))
+        admin_files = sync_candidates(ADMIN_PDF_FOLDER)
+        user_files = sync_candidates(USER_PDF_FOLDER)
         print(f"Found {len(admin_files)} admin files and {len(user_files)} user files")
         
         # Get all PDFs and their mappings from database
@@ -109,9 +232,7 @@ def sync_pdf_folders():
                     if not os.path.exists(pdf_path):
                         pdf_path = os.path.join(ADMIN_PDF_FOLDER, filename)
                     
-                    with open(pdf_path, 'rb') as pdf_file:
-                        pdf_reader = PyPDF2.PdfReader(pdf_file)
-                        total_pages = len(pdf_reader.pages)
+                    total_pages = count_pdf_pages(pdf_path)
                     print(f"File has {total_pages} pages")
                 except Exception as e:
                     print(f"Error getting total pages for {filename}: {str(e)}")
@@ -144,6 +265,8 @@ def sync_pdf_folders():
                     print(f"Error adding file to database: {str(e)}")
                     conn.rollback()
         
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (PDF_SYNC_LOCK,))
+        cursor.fetchone()
         conn.close()
         print("=== PDF Folder Sync Completed ===\n")
     except Exception as e:
@@ -151,113 +274,17 @@ def sync_pdf_folders():
         import traceback
         print(f"Traceback: {traceback.format_exc()}")
 
-# Initialize Database
+# Initialize Database: migrations and the folder sync, once per deployment start
+# (gunicorn's master runs this from gunicorn.conf.py before forking workers)
 def init_db():
+    conn = None
     try:
         print("\n=== Starting Database Initialization ===")
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Create tables if they don't exist
-        print("Creating/updating tables...")
-        
-        # 1. First create admins table
-        cursor.execute('''CREATE TABLE IF NOT EXISTS admins 
-                          (id INT AUTO_INCREMENT PRIMARY KEY,
-                           username VARCHAR(50) NOT NULL UNIQUE,
-                           password VARCHAR(255) NOT NULL,
-                           created_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-        print("Admins table ready")
-        
-        # 2. Create pdfs table
-        cursor.execute('''CREATE TABLE IF NOT EXISTS pdfs
-                          (id INT AUTO_INCREMENT PRIMARY KEY,
-                           filename VARCHAR(255) NOT NULL,
-                           original_filename VARCHAR(255) NOT NULL,
-                           unique_url VARCHAR(36) NOT NULL UNIQUE,
-                           created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                           total_pages INT NOT NULL DEFAULT 0)''')
-        print("PDFs table ready")
-        
-        # 3. Create url_mappings table
-        cursor.execute('''CREATE TABLE IF NOT EXISTS url_mappings
-                          (id INT AUTO_INCREMENT PRIMARY KEY,
-                           original_url VARCHAR(36) NOT NULL,
-                           public_url VARCHAR(36) NOT NULL UNIQUE,
-                           created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                           is_active BOOLEAN NOT NULL DEFAULT TRUE,
-                           last_used DATETIME,
-                           pdf_id INT NOT NULL,
-                           original_filename VARCHAR(255) NOT NULL,
-                           total_views INT NOT NULL DEFAULT 0,
-                           last_viewed_at DATETIME,
-                           FOREIGN KEY (pdf_id) REFERENCES pdfs(id) ON DELETE CASCADE,
-                           FOREIGN KEY (original_url) REFERENCES pdfs(unique_url) ON DELETE CASCADE)''')
-        print("URL mappings table ready")
-        
-        # 4. Create viewing_sessions table
-        cursor.execute('''CREATE TABLE IF NOT EXISTS viewing_sessions
-                          (id INT AUTO_INCREMENT PRIMARY KEY,
-                           session_id VARCHAR(50) NOT NULL,
-                           pdf_id INT NOT NULL,
-                           public_url VARCHAR(36) NOT NULL,
-                           start_time DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                           end_time DATETIME,
-                           total_duration FLOAT NOT NULL DEFAULT 0,
-                           total_pages INT NOT NULL DEFAULT 0,
-                           unique_pages INT NOT NULL DEFAULT 0,
-                           is_admin BOOLEAN NOT NULL DEFAULT FALSE,
-                           user_agent VARCHAR(255),
-                           ip_address VARCHAR(45),
-                           last_activity DATETIME,
-                           status ENUM('active', 'completed', 'abandoned') NOT NULL DEFAULT 'active',
-                           original_filename VARCHAR(255) NOT NULL,
-                           browser VARCHAR(100),
-                           device_type VARCHAR(50),
-                           operating_system VARCHAR(100),
-                           country VARCHAR(100),
-                           city VARCHAR(100),
-                           is_remote_view BOOLEAN NOT NULL DEFAULT FALSE,
-                           email VARCHAR(255),
-                           FOREIGN KEY (pdf_id) REFERENCES pdfs(id) ON DELETE CASCADE,
-                           FOREIGN KEY (public_url) REFERENCES url_mappings(public_url) ON DELETE CASCADE)''')
-        print("Viewing sessions table ready")
-        
-        # 5. Create page_views table
-        cursor.execute('''CREATE TABLE IF NOT EXISTS page_views
-                          (id INT AUTO_INCREMENT PRIMARY KEY,
-                           session_id INT NOT NULL,
-                           pdf_id INT NOT NULL,
-                           page_number INT NOT NULL DEFAULT 1,
-                           start_time DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                           end_time DATETIME,
-                           duration FLOAT NOT NULL DEFAULT 0,
-                           scroll_depth FLOAT NOT NULL DEFAULT 0,
-                           zoom_level FLOAT NOT NULL DEFAULT 1.0,
-                           time_to_first_view FLOAT,
-                           is_complete BOOLEAN NOT NULL DEFAULT FALSE,
-                           original_filename VARCHAR(255) NOT NULL,
-                           view_count INT NOT NULL DEFAULT 1,
-                           last_viewed_at DATETIME,
-                           total_time_on_page FLOAT NOT NULL DEFAULT 0,
-                           max_scroll_depth FLOAT NOT NULL DEFAULT 0,
-                           max_zoom_level FLOAT NOT NULL DEFAULT 1.0,
-                           FOREIGN KEY (session_id) REFERENCES viewing_sessions(id) ON DELETE CASCADE,
-                           FOREIGN KEY (pdf_id) REFERENCES pdfs(id) ON DELETE CASCADE)''')
-        print("Page views table ready")
-        
-        # Create a default admin user if none exists
-        cursor.execute("SELECT COUNT(*) FROM admins")
-        admin_count = cursor.fetchone()[0]
-        if admin_count == 0:
-            cursor.execute("""
-                INSERT INTO admins (username, password) 
-                VALUES ('admin', 'admin123')
-            """)
-            print("Created default admin user")
         
-        conn.commit()
-        print("Database initialized successfully")
+        # Apply any pending schema migrations (a single version check when current)
+        applied = run_migrations(conn)
+        print(f"Database initialized successfully ({applied} migration(s) applied)")
         
         # Sync PDF folders after creating tables
         sync_pdf_folders()
@@ -327,7 +354,7 @@ def list_pdfs():
                 FROM url_mappings 
                 WHERE is_active = TRUE
             ) um ON p.unique_url = um.original_url
-            WHERE p.permanent_delete = FALSE OR p.permanent_delete IS NULL
+            WHERE p.permanent_delete = FALSE
             GROUP BY p.id, p.original_filename, p.unique_url, p.created_at, p.total_pages, um.public_url
         """
         
@@ -398,6 +425,267 @@ def list_pdfs():
         print(f"Error in list_pdfs: {str(e)}")
         return jsonify({"message": "Internal server error", "error": str(e)}), 500
 
+# Background upload processing
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '2'))
+# A running job's worker refreshes updated_at every UPLOAD_JOB_HEARTBEAT_SECONDS,
+# so a job only goes UPLOAD_JOB_STALE_SECONDS without an update once its worker
+# is gone; a periodic task then puts it back on the queue.
+UPLOAD_JOB_STALE_SECONDS = int(os.getenv('UPLOAD_JOB_STALE_SECONDS', '300'))
+UPLOAD_JOB_HEARTBEAT_SECONDS = 30
+UPLOAD_JOB_REQUEUE_INTERVAL = 60
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='upload-worker')
+
+def update_upload_job(job_id, **fields):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        assignments = ', '.join(f"{name} = %s" for name in fields)
+        cursor.execute(f"""
+            UPDATE upload_jobs 
+            SET {assignments}, updated_at = NOW()
+            WHERE id = %s
+        """, (*fields.values(), job_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+def upload_job_heartbeat(job_id, stop):
+    while not stop.wait(UPLOAD_JOB_HEARTBEAT_SECONDS):
+        try:
+            conn = get_db_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE upload_jobs
+                    SET updated_at = NOW()
+                    WHERE id = %s AND status = 'processing'
+                """, (job_id,))
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Error in upload job heartbeat for {job_id}: {str(e)}")
+
+def stage_copy_to_admin(job):
+    # Keep the admin folder copy in step with the user folder
+    if not os.path.exists(job['admin_path']):
+        shutil.copy2(job['user_path'], job['admin_path'])
+        print(f"File copied to admin folder: {job['admin_path']}")
+
+def stage_inspect_pdf(job):
+    # Count pages and pull document metadata in a single pass
+    result = inspect_pdf(job['user_path'])
+    total_pages = result['pages']
+    job['metadata']['encrypted'] = result['encrypted']
+    job['metadata'].update(result['info'])
+    print(f"Total pages in PDF: {total_pages}")
+
+    job['total_pages'] = total_pages
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE pdfs SET total_pages = %s WHERE id = %s", (total_pages, job['pdf_id']))
+        conn.commit()
+    finally:
+        conn.close()
+
+# Linearization needs the qpdf command line tool; 'auto' enables it when qpdf is installed
+PDF_LINEARIZE = os.getenv('PDF_LINEARIZE', 'auto').lower()
+QPDF_BINARY = os.getenv('QPDF_BINARY', 'qpdf')
+QPDF_TIMEOUT = int(os.getenv('QPDF_TIMEOUT', '300'))
+
+def linearization_enabled():
+    if PDF_LINEARIZE in ('0', 'false', 'no', 'off'):
+        return False
+    return shutil.which(QPDF_BINARY) is not None
+
+def is_linearized(pdf_path):
+    # The linearization dictionary must be the first object and its /L must match the
+    # file length; an incremental update after linearizing invalidates it
+    with open(pdf_path, 'rb') as pdf_file:
+        head = pdf_file.read(1024)
+        size = os.fstat(pdf_file.fileno()).st_size
+    if b'/Linearized' not in head:
+        return False
+    length = re.search(rb'/L\s+(\d+)', head)
+    return bool(length) and int(length.group(1)) == size
+
+def stage_linearize(job):
+    original_size = os.path.getsize(job['user_path'])
+    linearized_filename = None
+    linearized_size = None
+
+    if is_linearized(job['user_path']):
+        job['metadata']['linearized'] = 'already linearized'
+    elif not linearization_enabled():
+        job['metadata']['linearized'] = 'skipped (qpdf not available)'
+    else:
+        linearized_filename = job['filename'][:-len('.pdf')] + LINEARIZED_SUFFIX
+        linearized_path = os.path.join(app.config['USER_PDF_FOLDER'], linearized_filename)
+        temp_path = linearized_path + '.tmp'
+        try:
+            result = subprocess.run(
+                [QPDF_BINARY, '--linearize', '--object-streams=generate', '--compress-streams=y',
+                 job['user_path'], temp_path],
+                capture_output=True, timeout=QPDF_TIMEOUT
+            )
+            # Exit status 3 means qpdf repaired something but still wrote a usable file
+            if result.returncode not in (0, 3) or not os.path.exists(temp_path):
+                raise RuntimeError(result.stderr.decode('utf-8', 'replace').strip()[:500])
+            os.replace(temp_path, linearized_path)
+            linearized_size = os.path.getsize(linearized_path)
+            job['metadata']['linearized'] = 'linearized'
+            print(f"Linearized {job['filename']}: {original_size} -> {linearized_size} bytes")
+        except Exception as e:
+            # Optional stage: the original is still served if linearizing fails
+            print(f"Error linearizing {job['filename']}: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            linearized_filename = None
+            job['metadata']['linearized'] = f"failed: {str(e)}"
+
+    job['metadata']['original_size'] = original_size
+    if linearized_size is not None:
+        job['metadata']['linearized_size'] = linearized_size
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE pdfs 
+            SET linearized_filename = %s, original_size = %s, linearized_size = %s
+            WHERE id = %s
+        """, (linearized_filename, original_size, linearized_size, job['pdf_id']))
+        conn.commit()
+    finally:
+        conn.close()
+
+# Stages run in order by the upload workers; progress is reported per stage
+UPLOAD_PIPELINE = [
+    ('copy_to_admin', stage_copy_to_admin),
+    ('inspect_pdf', stage_inspect_pdf),
+    ('linearize', stage_linearize),
+]
+
+def process_upload_job(job_id):
+    try:
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor(dictionary=True)
+            # Claim the job; another worker may already have picked it up
+            cursor.execute("""
+                UPDATE upload_jobs 
+                SET status = 'processing', updated_at = NOW()
+                WHERE id = %s AND status = 'queued'
+            """, (job_id,))
+            conn.commit()
+            if cursor.rowcount == 0:
+                return
+
+            cursor.execute("""
+                SELECT j.pdf_id, p.filename
+                FROM upload_jobs j
+                JOIN pdfs p ON p.id = j.pdf_id
+                WHERE j.id = %s
+            """, (job_id,))
+            row = cursor.fetchone()
+        finally:
+            conn.close()
+
+        job = {
+            'id': job_id,
+            'pdf_id': row['pdf_id'],
+            'filename': row['filename'],
+            'user_path': os.path.join(app.config['USER_PDF_FOLDER'], row['filename']),
+            'admin_path': os.path.join(app.config['ADMIN_PDF_FOLDER'], row['filename']),
+            'metadata': {}
+        }
+        print(f"Processing upload job {job_id} for {row['filename']}")
+
+        # Stages such as linearize can run for minutes without reporting progress
+        stop_heartbeat = threading.Event()
+        threading.Thread(target=upload_job_heartbeat, args=(job_id, stop_heartbeat),
+                         name=f"upload-heartbeat-{job_id}", daemon=True).start()
+        try:
+            for index, (stage, handler) in enumerate(UPLOAD_PIPELINE):
+                update_upload_job(job_id, stage=stage, progress=int(index * 100 / len(UPLOAD_PIPELINE)))
+                try:
+                    handler(job)
+                except Exception as e:
+                    print(f"Upload job {job_id} failed in stage {stage}: {str(e)}")
+                    update_upload_job(job_id, status='failed', error_message=str(e)[:1000],
+                                      metadata=json.dumps(job['metadata']))
+                    return
+
+            update_upload_job(job_id, status='completed', stage='done', progress=100,
+                              metadata=json.dumps(job['metadata']))
+        finally:
+            stop_heartbeat.set()
+        print(f"Upload job {job_id} completed")
+    except Exception as e:
+        print(f"Error in process_upload_job: {str(e)}")
+        import traceback
+        print(f"Traceback: {traceback.format_exc()}")
+
+def requeue_stale_upload_jobs(job_id=None):
+    # Jobs whose worker died (restart, crash) stop heartbeating and are put back
+    # on the queue
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        query = """
+            SELECT id FROM upload_jobs 
+            WHERE status IN ('queued', 'processing')
+            AND updated_at < NOW() - INTERVAL %s SECOND
+        """
+        params = [UPLOAD_JOB_STALE_SECONDS]
+        if job_id:
+            query += " AND id = %s"
+            params.append(job_id)
+        cursor.execute(query, params)
+        job_ids = [row[0] for row in cursor.fetchall()]
+
+        if job_ids:
+            placeholders = ', '.join(['%s'] * len(job_ids))
+            # Staleness is rechecked so a heartbeat that lands meanwhile wins
+            cursor.execute(f"""
+                UPDATE upload_jobs 
+                SET status = 'queued', updated_at = NOW()
+                WHERE id IN ({placeholders}) AND status IN ('queued', 'processing')
+                AND updated_at < NOW() - INTERVAL %s SECOND
+            """, job_ids + [UPLOAD_JOB_STALE_SECONDS])
+            conn.commit()
+    finally:
+        conn.close()
+
+    for stale_job_id in job_ids:
+        print(f"Requeueing upload job {stale_job_id}")
+        upload_executor.submit(process_upload_job, stale_job_id)
+    return len(job_ids)
+
+def register_uploaded_pdf(cursor, unique_url, original_filename, timestamp):
+    """Insert the pdfs, url_mappings and upload_jobs rows for a file saved in the user folder"""
+    cursor.execute("""
+        INSERT INTO pdfs (filename, original_filename, unique_url, created_at, total_pages) 
+        VALUES (%s, %s, %s, %s, 0)
+    """, (f"{unique_url}.pdf", original_filename, unique_url, timestamp))
+    pdf_id = cursor.lastrowid
+    
+    # Generate a public URL and insert into url_mappings
+    public_url = str(uuid.uuid4())
+    cursor.execute("""
+        INSERT INTO url_mappings (original_url, public_url, created_at, pdf_id, original_filename) 
+        VALUES (%s, %s, %s, %s, %s)
+    """, (unique_url, public_url, timestamp, pdf_id, original_filename))
+    
+    # Queue the processing job; the caller submits it once the transaction commits
+    job_id = str(uuid.uuid4())
+    cursor.execute("""
+        INSERT INTO upload_jobs (id, pdf_id, status, stage, created_at, updated_at)
+        VALUES (%s, %s, 'queued', 'queued', %s, %s)
+    """, (job_id, pdf_id, timestamp, timestamp))
+    return pdf_id, public_url, job_id
+
 # Upload PDF
 @app.route('/upload-pdf', methods=['POST'])
 def upload_pdf():
@@ -418,68 +706,499 @@ def upload_pdf():
             unique_filename = f"{unique_url}.pdf"
             original_filename = file.filename  # Store original filename
             
-            # Save file in both user and admin folders
+            # Save to user folder; the admin copy and page count are done by the upload workers
             user_file_path = os.path.join(app.config['USER_PDF_FOLDER'], unique_filename)
-            admin_file_path = os.path.join(app.config['ADMIN_PDF_FOLDER'], unique_filename)
-            
-            # Save to user folder
             file.save(user_file_path)
             print(f"File saved to user folder: {user_file_path}")
             
-            # Copy to admin folder
-            shutil.copy2(user_file_path, admin_file_path)
-            print(f"File copied to admin folder: {admin_file_path}")
-            
-            # Verify files were saved
-            if not os.path.exists(user_file_path) or not os.path.exists(admin_file_path):
+            # Verify file was saved
+            if not os.path.exists(user_file_path):
                 return jsonify({"message": "Error saving files"}), 500
             
-            # Get total pages from PDF
-            total_pages = 0
-            try:
-                with open(user_file_path, 'rb') as pdf_file:
-                    pdf_reader = PyPDF2.PdfReader(pdf_file)
-                    total_pages = len(pdf_reader.pages)
-                    print(f"Total pages in PDF: {total_pages}")
-            except Exception as e:
-                print(f"Error getting total pages: {str(e)}")
-            
             timestamp = datetime.datetime.now()
             
             conn = get_db_connection()
             cursor = conn.cursor()
-            
-            # Insert into pdfs table
-            cursor.execute("""
-                INSERT INTO pdfs (filename, original_filename, unique_url, created_at, total_pages) 
-                VALUES (%s, %s, %s, %s, %s)
-            """, (unique_filename, original_filename, unique_url, timestamp, total_pages))
-            
-            # Get the inserted PDF ID
-            pdf_id = cursor.lastrowid
-            
-            # Generate a public URL and insert into url_mappings
-            public_url = str(uuid.uuid4())
-            cursor.execute("""
-                INSERT INTO url_mappings (original_url, public_url, created_at, pdf_id, original_filename) 
-                VALUES (%s, %s, %s, %s, %s)
-            """, (unique_url, public_url, timestamp, pdf_id, original_filename))
-            
+            pdf_id, public_url, job_id = register_uploaded_pdf(cursor, unique_url, original_filename, timestamp)
             conn.commit()
             conn.close()
             
+            upload_executor.submit(process_upload_job, job_id)
+            
             return jsonify({
                 "message": "File uploaded successfully",
                 "unique_url": unique_url,
                 "view_url": url_for('view_pdf', url_type='pdfs', unique_url=public_url, _external=True),
-                "total_pages": total_pages
-            })
+                "job_id": job_id,
+                "status_url": url_for('upload_status', job_id=job_id, _external=True),
+                "total_pages": 0
+            }), 202
         except Exception as e:
             print(f"Error in upload_pdf: {str(e)}")
             return jsonify({"message": f"Error uploading file: {str(e)}"}), 500
     
     return jsonify({"message": "Invalid file type"}), 400
 
+@app.route('/upload-status/<job_id>')
+def upload_status(job_id):
+    if not session.get("admin_logged_in"):
+        return jsonify({"message": "Unauthorized"}), 401
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT 
+                j.id, j.status, j.stage, j.progress, j.error_message, j.metadata,
+                j.created_at, j.updated_at, p.unique_url, p.total_pages
+            FROM upload_jobs j
+            JOIN pdfs p ON p.id = j.pdf_id
+            WHERE j.id = %s
+        """, (job_id,))
+        job = cursor.fetchone()
+        
+        if not job:
+            return jsonify({"message": "Upload job not found"}), 404
+        
+        return jsonify({
+            "job_id": job['id'],
+            "status": job['status'],
+            "stage": job['stage'],
+            "progress": int(job['progress']),
+            "error": job['error_message'],
+            "metadata": json.loads(job['metadata']) if job['metadata'] else {},
+            "unique_url": job['unique_url'],
+            "total_pages": int(job['total_pages'] or 0),
+            "created_at": job['created_at'].strftime('%Y-%m-%d %H:%M:%S'),
+            "updated_at": job['updated_at'].strftime('%Y-%m-%d %H:%M:%S')
+        })
+    except Exception as e:
+        print(f"Error in upload_status: {str(e)}")
+        return jsonify({"message": "Internal server error", "error": str(e)}), 500
+    finally:
+        if conn:
+            conn.close()
+
+# Resumable chunked uploads
+CHUNKED_UPLOAD_MAX_BYTES = int(os.getenv('CHUNKED_UPLOAD_MAX_BYTES', str(1024 * 1024 * 1024)))
+CHUNKED_UPLOAD_MAX_CHUNK_BYTES = int(os.getenv('CHUNKED_UPLOAD_MAX_CHUNK_BYTES', str(16 * 1024 * 1024)))
+CHUNKED_UPLOAD_TTL_SECONDS = int(os.getenv('CHUNKED_UPLOAD_TTL_SECONDS', str(24 * 3600)))
+CHUNK_READ_SIZE = 64 * 1024
+
+# Per-process running hashes: upload_id -> [hashed_bytes, sha256 object]. A hash only
+# ever moves forward, so each process reads a given part file at most once in total.
+chunked_upload_hashers = {}
+chunked_upload_hashers_lock = threading.Lock()
+
+def chunked_upload_path(upload_id):
+    return os.path.join(CHUNKED_UPLOAD_FOLDER, f"{upload_id}.part")
+
+def lock_part_file(part_file):
+    # Serializes writers to the same part file across gunicorn workers
+    if fcntl:
+        fcntl.flock(part_file.fileno(), fcntl.LOCK_EX)
+
+def advance_upload_hash(upload_id, part_file, size):
+    """Bring this process's running hash for upload_id up to `size` bytes of the part file"""
+    with chunked_upload_hashers_lock:
+        state = chunked_upload_hashers.setdefault(upload_id, [0, hashlib.sha256()])
+    if state[0] < size:
+        part_file.seek(state[0])
+        remaining = size - state[0]
+        while remaining > 0:
+            data = part_file.read(min(CHUNK_READ_SIZE, remaining))
+            if not data:
+                break
+            state[1].update(data)
+            remaining -= len(data)
+        state[0] = size - remaining
+    return state
+
+def expire_stale_chunked_uploads():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id FROM chunked_uploads 
+            WHERE status = 'uploading'
+            AND updated_at < NOW() - INTERVAL %s SECOND
+            LIMIT 100
+        """, (CHUNKED_UPLOAD_TTL_SECONDS,))
+        upload_ids = [row[0] for row in cursor.fetchall()]
+        for upload_id in upload_ids:
+            try:
+                os.remove(chunked_upload_path(upload_id))
+            except FileNotFoundError:
+                pass
+            with chunked_upload_hashers_lock:
+                chunked_upload_hashers.pop(upload_id, None)
+            cursor.execute("""
+                UPDATE chunked_uploads SET status = 'expired', updated_at = NOW()
+                WHERE id = %s AND status = 'uploading'
+            """, (upload_id,))
+        conn.commit()
+        if upload_ids:
+            print(f"Expired {len(upload_ids)} stale chunked upload(s)")
+    finally:
+        conn.close()
+
+@app.route('/upload-chunked', methods=['POST'])
+def initiate_chunked_upload():
+    if not session.get("admin_logged_in"):
+        return jsonify({"message": "Unauthorized"}), 401
+
+    data = request.get_json(silent=True) or {}
+    original_filename = data.get('filename') or ''
+    total_size = data.get('size')
+
+    if not allowed_file(original_filename):
+        return jsonify({"message": "Invalid file type"}), 400
+    if not isinstance(total_size, int) or total_size <= 0:
+        return jsonify({"message": "File size is required"}), 400
+    if total_size > CHUNKED_UPLOAD_MAX_BYTES:
+        return jsonify({"message": f"File exceeds the {CHUNKED_UPLOAD_MAX_BYTES} byte limit"}), 413
+
+    try:
+        expire_stale_chunked_uploads()
+
+        upload_id = str(uuid.uuid4())
+        open(chunked_upload_path(upload_id), 'wb').close()
+
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO chunked_uploads (id, original_filename, total_size)
+                VALUES (%s, %s, %s)
+            """, (upload_id, original_filename, total_size))
+            conn.commit()
+        finally:
+            conn.close()
+
+        print(f"Started chunked upload {upload_id} for {original_filename} ({total_size} bytes)")
+        return jsonify({
+            "upload_id": upload_id,
+            "received_bytes": 0,
+            "total_size": total_size,
+            "max_chunk_bytes": CHUNKED_UPLOAD_MAX_CHUNK_BYTES,
+            "chunk_url": url_for('upload_chunk', upload_id=upload_id, _external=True)
+        }), 201
+    except Exception as e:
+        print(f"Error in initiate_chunked_upload: {str(e)}")
+        return jsonify({"message": f"Error starting upload: {str(e)}"}), 500
+
+def get_chunked_upload(upload_id):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM chunked_uploads WHERE id = %s", (upload_id,))
+        return cursor.fetchone()
+    finally:
+        conn.close()
+
+@app.route('/upload-chunked/<upload_id>', methods=['GET', 'PUT'])
+def upload_chunk(upload_id):
+    if not session.get("admin_logged_in"):
+        return jsonify({"message": "Unauthorized"}), 401
+
+    try:
+        upload = get_chunked_upload(upload_id)
+        if not upload:
+            return jsonify({"message": "Upload not found"}), 404
+        if upload['status'] == 'expired':
+            return jsonify({"message": "Upload expired"}), 410
+
+        part_path = chunked_upload_path(upload_id)
+        if request.method == 'GET' or upload['status'] == 'finalized':
+            # Resume point for the client: the bytes on disk are the source of truth
+            received_bytes = upload['total_size'] if upload['status'] == 'finalized' else os.path.getsize(part_path)
+            return jsonify({
+                "upload_id": upload_id,
+                "status": upload['status'],
+                "received_bytes": received_bytes,
+                "total_size": upload['total_size']
+            })
+
+        offset = request.args.get('offset', type=int)
+        chunk_length = request.content_length
+        if offset is None or offset < 0:
+            return jsonify({"message": "Chunk offset is required"}), 400
+        if chunk_length is None:
+            return jsonify({"message": "Content-Length is required"}), 411
+        if chunk_length > CHUNKED_UPLOAD_MAX_CHUNK_BYTES:
+            return jsonify({"message": f"Chunks may not exceed {CHUNKED_UPLOAD_MAX_CHUNK_BYTES} bytes"}), 413
+        if offset + chunk_length > upload['total_size']:
+            return jsonify({"message": "Chunk extends past the declared file size"}), 400
+
+        with open(part_path, 'r+b') as part_file:
+            lock_part_file(part_file)
+            received_bytes = os.fstat(part_file.fileno()).st_size
+
+            if offset > received_bytes:
+                # A gap: the client must resend from where we actually are
+                return jsonify({
+                    "message": "Chunk offset is ahead of received data",
+                    "received_bytes": received_bytes
+                }), 409
+
+            # Bytes before received_bytes are already stored (a retried chunk); skip them
+            state = advance_upload_hash(upload_id, part_file, received_bytes)
+            skip = received_bytes - offset
+            part_file.seek(received_bytes)
+            remaining = chunk_length
+            while remaining > 0:
+                data = request.stream.read(min(CHUNK_READ_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                if skip:
+                    dropped = min(skip, len(data))
+                    skip -= dropped
+                    data = data[dropped:]
+                if data:
+                    part_file.write(data)
+                    if state[0] == received_bytes:
+                        state[1].update(data)
+                        state[0] += len(data)
+                    received_bytes += len(data)
+            part_file.flush()
+
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE chunked_uploads 
+                SET received_bytes = GREATEST(received_bytes, %s), updated_at = NOW()
+                WHERE id = %s
+            """, (received_bytes, upload_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+        return jsonify({
+            "upload_id": upload_id,
+            "received_bytes": received_bytes,
+            "total_size": upload['total_size'],
+            "complete": received_bytes == upload['total_size']
+        })
+    except Exception as e:
+        print(f"Error in upload_chunk: {str(e)}")
+        import traceback
+        print(f"Traceback: {traceback.format_exc()}")
+        return jsonify({"message": f"Error uploading chunk: {str(e)}"}), 500
+
+@app.route('/upload-chunked/<upload_id>/finalize', methods=['POST'])
+def finalize_chunked_upload(upload_id):
+    if not session.get("admin_logged_in"):
+        return jsonify({"message": "Unauthorized"}), 401
+
+    conn = None
+    try:
+        upload = get_chunked_upload(upload_id)
+        if not upload:
+            return jsonify({"message": "Upload not found"}), 404
+        if upload['status'] == 'expired':
+            return jsonify({"message": "Upload expired"}), 410
+
+        if upload['status'] != 'finalized':
+            part_path = chunked_upload_path(upload_id)
+            with open(part_path, 'rb') as part_file:
+                lock_part_file(part_file)
+                received_bytes = os.fstat(part_file.fileno()).st_size
+                if received_bytes != upload['total_size']:
+                    return jsonify({
+                        "message": "Upload is incomplete",
+                        "received_bytes": received_bytes,
+                        "total_size": upload['total_size']
+                    }), 409
+                sha256 = advance_upload_hash(upload_id, part_file, received_bytes)[1].hexdigest()
+
+            expected_sha256 = (request.get_json(silent=True) or {}).get('sha256')
+            if expected_sha256 and expected_sha256.lower() != sha256:
+                return jsonify({"message": "Checksum mismatch", "sha256": sha256}), 422
+
+            unique_url = str(uuid.uuid4())
+            user_file_path = os.path.join(app.config['USER_PDF_FOLDER'], f"{unique_url}.pdf")
+            os.replace(part_path, user_file_path)
+
+            try:
+                timestamp = datetime.datetime.now()
+                conn = get_db_connection()
+                cursor = conn.cursor()
+                pdf_id, public_url, job_id = register_uploaded_pdf(cursor, unique_url, upload['original_filename'], timestamp)
+                cursor.execute("""
+                    UPDATE chunked_uploads 
+                    SET status = 'finalized', sha256 = %s, received_bytes = total_size,
+                        unique_url = %s, job_id = %s, updated_at = NOW()
+                    WHERE id = %s
+                """, (sha256, unique_url, job_id, upload_id))
+                conn.commit()
+            except Exception:
+                # Put the data back so the client can retry finalize
+                os.replace(user_file_path, part_path)
+                raise
+            with chunked_upload_hashers_lock:
+                chunked_upload_hashers.pop(upload_id, None)
+            print(f"Finalized chunked upload {upload_id} as {unique_url}")
+
+            upload_executor.submit(process_upload_job, job_id)
+        else:
+            # Finalize retried after success: report the original result
+            unique_url, job_id, sha256 = upload['unique_url'], upload['job_id'], upload['sha256']
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT public_url FROM url_mappings 
+                WHERE original_url = %s 
+                ORDER BY created_at LIMIT 1
+            """, (unique_url,))
+            public_url = cursor.fetchone()[0]
+
+        return jsonify({
+            "message": "File uploaded successfully",
+            "unique_url": unique_url,
+            "view_url": url_for('view_pdf', url_type='pdfs', unique_url=public_url, _external=True),
+            "job_id": job_id,
+            "status_url": url_for('upload_status', job_id=job_id, _external=True),
+            "sha256": sha256
+        }), 202
+    except Exception as e:
+        print(f"Error in finalize_chunked_upload: {str(e)}")
+        if conn:
+            conn.rollback()
+        return jsonify({"message": f"Error finalizing upload: {str(e)}"}), 500
+    finally:
+        if conn:
+            conn.close()
+
+# Bulk upload of many PDFs or a ZIP archive
+BULK_UPLOAD_MAX_FILES = int(os.getenv('BULK_UPLOAD_MAX_FILES', '500'))
+BULK_UPLOAD_MAX_ENTRY_BYTES = int(os.getenv('BULK_UPLOAD_MAX_ENTRY_BYTES', str(256 * 1024 * 1024)))
+
+def copy_limited(source, destination_path, limit):
+    """Stream source into destination_path, refusing to write more than limit bytes"""
+    written = 0
+    with open(destination_path, 'wb') as destination:
+        while True:
+            data = source.read(1024 * 1024)
+            if not data:
+                break
+            written += len(data)
+            if written > limit:
+                raise ValueError(f"File exceeds the {limit} byte limit")
+            destination.write(data)
+    return written
+
+def iter_bulk_upload_sources(files):
+    """Yield (original_filename, readable, skip_reason) for every file and ZIP entry uploaded"""
+    for file in files:
+        filename = file.filename or ''
+        if not filename.lower().endswith('.zip'):
+            if allowed_file(filename):
+                yield filename, file.stream, None
+            else:
+                yield filename, None, "Not a PDF file"
+            continue
+
+        # Entries are streamed one at a time; the archive is never extracted as a whole
+        try:
+            archive = zipfile.ZipFile(file.stream)
+        except zipfile.BadZipFile as e:
+            yield filename, None, f"Invalid ZIP archive: {str(e)}"
+            continue
+        with archive:
+            for info in archive.infolist():
+                entry_name = os.path.basename(info.filename)
+                if info.is_dir() or not entry_name or entry_name.startswith('.'):
+                    continue
+                if not allowed_file(entry_name):
+                    yield entry_name, None, "Not a PDF file"
+                    continue
+                with archive.open(info) as entry:
+                    yield entry_name, entry, None
+
+@app.route('/upload-pdfs', methods=['POST'])
+def upload_pdfs():
+    if not session.get("admin_logged_in"):
+        return jsonify({"message": "Unauthorized"}), 401
+
+    files = request.files.getlist('files') + request.files.getlist('file')
+    files = [file for file in files if file.filename]
+    if not files:
+        return jsonify({"message": "No files uploaded"}), 400
+
+    results = []
+    pending = []
+    try:
+        # 1. Stream every PDF to the user folder
+        for original_filename, source, skip_reason in iter_bulk_upload_sources(files):
+            result = {"filename": original_filename}
+            results.append(result)
+            if skip_reason:
+                result.update(status="skipped", message=skip_reason)
+                continue
+            if len(pending) >= BULK_UPLOAD_MAX_FILES:
+                result.update(status="skipped", message=f"Limit of {BULK_UPLOAD_MAX_FILES} files per request reached")
+                continue
+
+            unique_url = str(uuid.uuid4())
+            user_file_path = os.path.join(app.config['USER_PDF_FOLDER'], f"{unique_url}.pdf")
+            try:
+                copy_limited(source, user_file_path, BULK_UPLOAD_MAX_ENTRY_BYTES)
+            except Exception as e:
+                if os.path.exists(user_file_path):
+                    os.remove(user_file_path)
+                result.update(status="error", message=str(e))
+                continue
+            pending.append((result, unique_url, user_file_path))
+        print(f"Bulk upload: stored {len(pending)} of {len(results)} file(s)")
+
+        # 2. Register everything in one transaction; the admin copy, page count and
+        # linearization are done by the upload workers, as for single uploads
+        if pending:
+            timestamp = datetime.datetime.now()
+            registrations = []
+            conn = get_db_connection()
+            try:
+                cursor = conn.cursor()
+                for result, unique_url, user_file_path in pending:
+                    _, public_url, job_id = register_uploaded_pdf(cursor, unique_url, result['filename'], timestamp)
+                    registrations.append((result, unique_url, public_url, job_id))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                for _, _, user_file_path in pending:
+                    if os.path.exists(user_file_path):
+                        os.remove(user_file_path)
+                raise
+            finally:
+                conn.close()
+
+            for result, unique_url, public_url, job_id in registrations:
+                upload_executor.submit(process_upload_job, job_id)
+                result.update(
+                    status="uploaded",
+                    unique_url=unique_url,
+                    view_url=url_for('view_pdf', url_type='pdfs', unique_url=public_url, _external=True),
+                    job_id=job_id,
+                    status_url=url_for('upload_status', job_id=job_id, _external=True),
+                    total_pages=0
+                )
+
+        uploaded = sum(1 for result in results if result['status'] == 'uploaded')
+        print(f"Bulk upload registered {uploaded} PDF(s)")
+        return jsonify({
+            "message": f"Uploaded {uploaded} of {len(results)} file(s)",
+            "uploaded": uploaded,
+            "results": results
+        })
+    except Exception as e:
+        print(f"Error in upload_pdfs: {str(e)}")
+        import traceback
+        print(f"Traceback: {traceback.format_exc()}")
+        return jsonify({"message": f"Error uploading files: {str(e)}", "results": results}), 500
+
 # PDF Viewer Page
 @app.route('/view-pdf/<url_type>/<unique_url>', methods=['GET', 'POST'])
 def view_pdf(url_type, unique_url):
@@ -592,17 +1311,24 @@ def view_pdf(url_type, unique_url):
 
             print(f"Creating session record with ID: {session_id}")
             try:
+                viewer_id = None
+                if not is_admin and email.strip():
+                    viewer_id = upsert_viewer(cursor, email, start_time)
                 cursor.execute("""
-                    INSERT INTO viewing_sessions 
-                    (session_id, pdf_id, public_url, start_time, total_duration, 
-                     total_pages, unique_pages, user_agent, ip_address, last_activity, is_admin,
-                     original_filename, browser, device_type, operating_system, email)
+                    INSERT INTO viewing_sessions
+                    (session_id, pdf_id, public_url, start_time, total_duration,
+                     total_pages, unique_pages, user_agent_id, ip_address, last_activity, is_admin,
+                     browser_id, device_type_id, operating_system_id, email, viewer_id)
                     VALUES (%s, %s, %s, %s, 0, %s, 0, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (session_id, pdf['pdf_id'], unique_url, start_time, pdf['total_pages'],
-                     user_agent, ip_address, start_time, is_admin, pdf['original_filename'],
-                     browser, device_type, operating_system, email if not is_admin else None))
-                conn.commit()
+                """, (session_uuid_bytes(session_id), pdf['pdf_id'], unique_url, start_time, pdf['total_pages'],
+                     dictionary_id(cursor, 'user_agents', user_agent[:255]), ip_address, start_time, is_admin,
+                     dictionary_id(cursor, 'browsers', browser),
+                     dictionary_id(cursor, 'device_types', device_type),
+                     dictionary_id(cursor, 'operating_systems', operating_system),
+                     email if not is_admin else None, viewer_id))
                 viewing_session_id = cursor.lastrowid
+                refresh_viewer_activity(cursor, [viewing_session_id])
+                conn.commit()
                 print(f"Created viewing session with ID: {viewing_session_id}")
             except Exception as e:
                 print(f"Error creating session record: {str(e)}")
@@ -652,6 +1378,276 @@ def view_pdf(url_type, unique_url):
         print(f"Traceback: {traceback.format_exc()}")
         return "Internal server error", 500
 
+# Stored PDFs never change once written (new uploads get new filenames), so
+# their bytes can be cached by the browser for a long time. The ETag is a hash
+# of the content, memoised per (path, size, mtime) so each file is hashed once
+# per process.
+PDF_CACHE_MAX_AGE = int(os.getenv('PDF_CACHE_MAX_AGE', str(365 * 24 * 3600)))
+STATIC_CACHE_MAX_AGE = int(os.getenv('STATIC_CACHE_MAX_AGE', str(24 * 3600)))
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = STATIC_CACHE_MAX_AGE
+
+# pdf.js and friends are bundled by vendor_assets.py under content-hashed names
+# in static/vendor/, so those files can be cached forever
+VENDOR_STATIC_PREFIX = app.static_url_path + '/vendor/'
+vendor_fallback_warned = set()
+
+@app.template_global()
+def asset_url(name):
+    target = vendor_assets.load_manifest().get(name)
+    if target:
+        return url_for('static', filename='vendor/' + target)
+    # Not bundled (e.g. a dev checkout): fall back to the public CDN
+    if name not in vendor_fallback_warned:
+        vendor_fallback_warned.add(name)
+        print(f"Vendor asset {name} is not bundled, using the CDN. Run vendor_assets.py to self-host it.")
+    return vendor_assets.cdn_url(name)
+
+@app.after_request
+def cache_vendor_assets(response):
+    if request.path.startswith(VENDOR_STATIC_PREFIX) and response.status_code in (200, 206, 304):
+        response.cache_control.public = True
+        response.cache_control.max_age = PDF_CACHE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+file_etags = {}
+file_etags_lock = threading.Lock()
+FILE_ETAG_CACHE_SIZE = 4096
+
+def file_etag(file_path):
+    stat = os.stat(file_path)
+    key = (file_path, stat.st_size, stat.st_mtime_ns)
+    etag = file_etags.get(key)
+    if etag is None:
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as pdf_file:
+            for block in iter(lambda: pdf_file.read(1024 * 1024), b''):
+                digest.update(block)
+        etag = digest.hexdigest()
+        with file_etags_lock:
+            if len(file_etags) >= FILE_ETAG_CACHE_SIZE:
+                file_etags.clear()
+            file_etags[key] = etag
+    return etag
+
+# Optional: let nginx stream the bytes. The app still does the lookup and checks,
+# then answers with an X-Accel-Redirect to an internal location (see
+# deployment/nginx.conf) that serves the file with sendfile, ranges and ETags.
+PDF_ACCEL_REDIRECT = os.getenv('PDF_ACCEL_REDIRECT', 'off').lower() in ('1', 'on', 'true', 'yes')
+PDF_ACCEL_PREFIX = os.getenv('PDF_ACCEL_PREFIX', '/_protected').rstrip('/')
+ACCEL_LOCATIONS = {
+    USER_PDF_FOLDER: 'pdfs',
+    ADMIN_PDF_FOLDER: 'admin_pdfs',
+    PAGE_CACHE_FOLDER: 'page_cache',
+}
+
+def accel_redirect_uri(file_path):
+    file_path = os.path.abspath(file_path)
+    for folder, location in ACCEL_LOCATIONS.items():
+        if file_path.startswith(folder + os.sep):
+            relative_path = os.path.relpath(file_path, folder).replace(os.sep, '/')
+            return f"{PDF_ACCEL_PREFIX}/{location}/{quote(relative_path)}"
+    return None
+
+# Hot-file cache: the most requested PDFs are kept memory-mapped so repeat
+# requests are served from memory instead of re-reading storage. Mappings share
+# the OS page cache, so gunicorn workers don't each hold a private copy. A file
+# is admitted once it has been requested HOT_CACHE_MIN_REQUESTS times; the least
+# recently used entries are dropped to stay within HOT_CACHE_MAX_BYTES.
+HOT_CACHE_MAX_BYTES = int(os.getenv('HOT_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+HOT_CACHE_MAX_FILE_BYTES = int(os.getenv('HOT_CACHE_MAX_FILE_BYTES', str(HOT_CACHE_MAX_BYTES // 4)))
+HOT_CACHE_MIN_REQUESTS = int(os.getenv('HOT_CACHE_MIN_REQUESTS', '2'))
+HOT_CACHE_REVALIDATE_SECONDS = float(os.getenv('HOT_CACHE_REVALIDATE_SECONDS', '1'))
+HOT_CACHE_CANDIDATES = 4096
+
+hot_files = OrderedDict()
+hot_file_requests = OrderedDict()
+hot_files_lock = threading.Lock()
+hot_cache_stats = {'hits': 0, 'misses': 0, 'admissions': 0, 'evictions': 0,
+                   'invalidations': 0, 'bytes': 0}
+
+class MappedFileReader:
+    """Read-only file object over a shared mmap with its own position, one per response.
+
+    fileno() is the mapped file's descriptor, which is never read or seeked (its
+    offset stays 0), so a server's wsgi.file_wrapper can sendfile() a full
+    response straight from the page cache the mapping shares. WSGI bodies must be
+    bytes, so Range responses, which are iterated, still copy each chunk out.
+    """
+
+    def __init__(self, mapped, pdf_file):
+        self.mapped = mapped
+        self.pdf_file = pdf_file
+        self.position = 0
+
+    def fileno(self):
+        return self.pdf_file.fileno()
+
+    def read(self, size=-1):
+        end = len(self.mapped) if size is None or size < 0 else min(self.position + size, len(self.mapped))
+        data = self.mapped[self.position:end]
+        self.position = end
+        return data
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += len(self.mapped)
+        self.position = max(0, min(offset, len(self.mapped)))
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        # The mapping stays open for other requests; it is unmapped once the
+        # cache and every in-flight reader have dropped it
+        self.mapped = None
+
+def hot_file_signature(stat):
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+def drop_hot_file(file_path, counter):
+    entry = hot_files.pop(file_path, None)
+    if entry:
+        hot_cache_stats['bytes'] -= entry['size']
+        hot_cache_stats[counter] += 1
+
+def invalidate_hot_file(*file_paths):
+    with hot_files_lock:
+        for file_path in file_paths:
+            drop_hot_file(os.path.abspath(file_path), 'invalidations')
+            hot_file_requests.pop(os.path.abspath(file_path), None)
+
+def admit_hot_file(file_path, stat):
+    # The file stays open with the mapping (closed once both are unreferenced) for
+    # sendfile; see MappedFileReader
+    pdf_file = open(file_path, 'rb')
+    mapped = mmap.mmap(pdf_file.fileno(), 0, access=mmap.ACCESS_READ)
+    etag = hashlib.sha256(mapped).hexdigest()
+    with file_etags_lock:
+        file_etags[(file_path, stat.st_size, stat.st_mtime_ns)] = etag
+
+    entry = {'mapped': mapped, 'file': pdf_file, 'size': stat.st_size, 'signature': hot_file_signature(stat),
+             'mtime': stat.st_mtime, 'etag': etag, 'checked_at': time.monotonic()}
+    with hot_files_lock:
+        drop_hot_file(file_path, 'invalidations')
+        while hot_files and hot_cache_stats['bytes'] + entry['size'] > HOT_CACHE_MAX_BYTES:
+            drop_hot_file(next(iter(hot_files)), 'evictions')
+        hot_files[file_path] = entry
+        hot_cache_stats['bytes'] += entry['size']
+        hot_cache_stats['admissions'] += 1
+    return entry
+
+def get_hot_file(file_path):
+    """Cached mapping for file_path, admitting it if it has become popular; None to read from disk"""
+    if HOT_CACHE_MAX_BYTES <= 0:
+        return None
+    file_path = os.path.abspath(file_path)
+    now = time.monotonic()
+
+    with hot_files_lock:
+        entry = hot_files.get(file_path)
+        if entry and now - entry['checked_at'] < HOT_CACHE_REVALIDATE_SECONDS:
+            hot_files.move_to_end(file_path)
+            hot_cache_stats['hits'] += 1
+            return entry
+
+    # Unknown, or time to make sure the file wasn't replaced or removed
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        invalidate_hot_file(file_path)
+        raise
+
+    with hot_files_lock:
+        if entry and hot_files.get(file_path) is entry:
+            if entry['signature'] == hot_file_signature(stat):
+                entry['checked_at'] = now
+                hot_files.move_to_end(file_path)
+                hot_cache_stats['hits'] += 1
+                return entry
+            drop_hot_file(file_path, 'invalidations')
+
+        hot_cache_stats['misses'] += 1
+        if stat.st_size == 0 or stat.st_size > min(HOT_CACHE_MAX_FILE_BYTES, HOT_CACHE_MAX_BYTES):
+            return None
+        requests_seen = hot_file_requests.pop(file_path, 0) + 1
+        if requests_seen < HOT_CACHE_MIN_REQUESTS:
+            hot_file_requests[file_path] = requests_seen
+            while len(hot_file_requests) > HOT_CACHE_CANDIDATES:
+                hot_file_requests.popitem(last=False)
+            return None
+
+    return admit_hot_file(file_path, stat)
+
+def send_hot_file(entry, file_path, download_name):
+    # Build the headers as send_file would, then stream from the mapping
+    response = werkzeug_send_file(file_path, request.environ, mimetype='application/pdf',
+                                  as_attachment=False, download_name=download_name,
+                                  use_x_sendfile=True, conditional=False, etag=entry['etag'],
+                                  last_modified=entry['mtime'], max_age=PDF_CACHE_MAX_AGE)
+    del response.headers['X-Sendfile']
+    response.headers['Content-Length'] = str(entry['size'])
+    response.response = wrap_file(request.environ, MappedFileReader(entry['mapped'], entry['file']), 256 * 1024)
+    response.direct_passthrough = True
+    return response.make_conditional(request.environ, accept_ranges=True, complete_length=entry['size'])
+
+@app.route('/hot-cache-stats')
+def hot_cache_stats_view():
+    if not session.get("admin_logged_in"):
+        return jsonify({"message": "Unauthorized"}), 401
+
+    with hot_files_lock:
+        stats = dict(hot_cache_stats)
+        files = [{'path': os.path.relpath(path, BASE_DIR), 'size': entry['size']}
+                 for path, entry in reversed(hot_files.items())]
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else None
+    stats['max_bytes'] = HOT_CACHE_MAX_BYTES
+    stats['files'] = files
+    # Counters are per worker process
+    stats['pid'] = os.getpid()
+    return jsonify(stats)
+
+def send_pdf_file(file_path, download_name=None):
+    """send_file for stored PDFs: content-hash ETag, conditional/Range requests, long-lived private caching"""
+    accel_uri = accel_redirect_uri(file_path) if PDF_ACCEL_REDIRECT else None
+    if accel_uri:
+        # Headers only; nginx keeps Content-Disposition and Cache-Control from
+        # this response and handles Range requests itself. It drops the ETag
+        # across the redirect, so the internal location re-emits ours and
+        # If-None-Match is answered here, before redirecting.
+        etag = file_etag(file_path)
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            response.cache_control.max_age = PDF_CACHE_MAX_AGE
+        else:
+            response = werkzeug_send_file(file_path, request.environ, mimetype='application/pdf',
+                                          as_attachment=False, download_name=download_name,
+                                          use_x_sendfile=True, conditional=False, etag=etag,
+                                          max_age=PDF_CACHE_MAX_AGE)
+            del response.headers['X-Sendfile']
+            response.headers['Content-Length'] = '0'
+            response.headers['X-Accel-Redirect'] = accel_uri
+    else:
+        hot_entry = get_hot_file(file_path)
+        if hot_entry:
+            response = send_hot_file(hot_entry, file_path, download_name)
+        else:
+            response = send_file(file_path, mimetype='application/pdf', as_attachment=False,
+                                 download_name=download_name, conditional=True,
+                                 etag=file_etag(file_path), max_age=PDF_CACHE_MAX_AGE)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
 # Serve PDF file
 @app.route('/serve-pdf/<filename>')
 def serve_pdf(filename):
@@ -689,7 +1685,7 @@ def serve_pdf(filename):
             return "PDF file not found", 404
             
         print(f"Serving PDF from: {file_path}")
-        return send_file(file_path, mimetype='application/pdf', as_attachment=False)
+        return send_pdf_file(file_path)
     except Exception as e:
         print(f"Error in serve_pdf: {str(e)}")
         import traceback
@@ -732,7 +1728,7 @@ def serve_remote_pdf(unique_url):
                 return "PDF file not found", 404
             
             print(f"Serving remote PDF from: {file_path}")
-            return send_file(file_path, mimetype='application/pdf', as_attachment=False)
+            return send_pdf_file(file_path, download_name=pdf['original_filename'])
             
         finally:
             conn.close()
@@ -754,7 +1750,7 @@ def serve_online_pdf(unique_url):
         try:
             # Get the PDF information
             cursor.execute("""
-                SELECT p.filename, p.original_filename, p.permanent_delete
+                SELECT p.filename, p.original_filename, p.permanent_delete, p.linearized_filename
                 FROM pdfs p
                 WHERE p.unique_url = %s
             """, (unique_url,))
@@ -770,49 +1766,35 @@ def serve_online_pdf(unique_url):
             
             print(f"Found PDF in database: {pdf['original_filename']}")
             
+            # Prefer the linearized copy so the viewer can render page 1 early
+            linearized_path = None
+            if pdf.get('linearized_filename'):
+                linearized_path = os.path.join(app.config['USER_PDF_FOLDER'], pdf['linearized_filename'])
+            
             # Try to find the PDF in either folder
             admin_path = os.path.join(app.config['ADMIN_PDF_FOLDER'], pdf['filename'])
             user_path = os.path.join(app.config['USER_PDF_FOLDER'], pdf['filename'])
             
-            print(f"Checking paths:")
-            print(f"Admin path: {admin_path} (exists: {os.path.exists(admin_path)})")
-            print(f"User path: {user_path} (exists: {os.path.exists(user_path)})")
-            
             # Determine which path to use
-            if os.path.exists(admin_path):
+            if linearized_path and os.path.exists(linearized_path):
+                file_path = linearized_path
+                print(f"Using linearized copy: {file_path}")
+            elif os.path.exists(admin_path):
                 file_path = admin_path
                 print(f"Using admin path: {file_path}")
             elif os.path.exists(user_path):
                 file_path = user_path
                 print(f"Using user path: {file_path}")
             else:
-                print(f"PDF file not found in either location")
+                print("PDF file not found in either location")
                 return "PDF file not found", 404
             
-            # Read the PDF file and send it
-            try:
-                with open(file_path, 'rb') as f:
-                    pdf_data = f.read()
-                print(f"Successfully read PDF file of size: {len(pdf_data)} bytes")
-            except Exception as e:
-                print(f"Error reading PDF file: {str(e)}")
-                return f"Error reading PDF file: {str(e)}", 500
-            
-            # Set appropriate headers for PDF streaming
-            headers = {
-                'Content-Type': 'application/pdf',
-                'Content-Disposition': f'inline; filename="{pdf["original_filename"]}"',
-                'Cache-Control': 'no-cache, no-store, must-revalidate',
-                'Pragma': 'no-cache',
-                'Expires': '0',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, Range',
-                'Accept-Ranges': 'bytes'
-            }
+            # Streams the file and answers Range requests, which pdf.js uses to
+            # fetch only the parts of a linearized file it needs
+            response = send_pdf_file(file_path, download_name=pdf['original_filename'])
             
             print(f"Serving online PDF: {pdf['original_filename']}")
-            return Response(pdf_data, headers=headers)
+            return response
             
         finally:
             conn.close()
@@ -824,16 +1806,1164 @@ def serve_online_pdf(unique_url):
         print(f"Traceback: {traceback.format_exc()}")
         return f"Internal server error: {str(e)}", 500
 
+# Single-page PDFs for lazy loading, extracted on first request and kept on disk.
+# Entries are evicted least-recently-used first (atime is bumped on every hit;
+# mtime is left alone since ETags and the hot-file cache key on it) once the
+# cache grows past PAGE_CACHE_MAX_BYTES. Each worker keeps a running total of
+# the cache size instead of walking it on every extraction; the walk only runs
+# when that total goes over the limit, and every PAGE_CACHE_RESCAN_INTERVAL
+# seconds to pick up pages added by other workers and removed by purges. An
+# eviction frees down to PAGE_CACHE_EVICT_TO of the limit, so a full cache isn't
+# walked again on the very next extraction.
+PAGE_CACHE_MAX_BYTES = int(os.getenv('PAGE_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+PAGE_CACHE_RESCAN_INTERVAL = 300
+PAGE_CACHE_EVICT_TO = 0.9
+
+page_cache_usage = {'bytes': None}
+page_cache_usage_lock = threading.Lock()
+page_cache_evict_lock = threading.Lock()
+
+page_cache_locks = {}
+page_cache_locks_guard = threading.Lock()
+
+def page_cache_dir(unique_url):
+    return os.path.join(PAGE_CACHE_FOLDER, secure_filename(unique_url))
+
+def page_cache_lock(cache_path):
+    with page_cache_locks_guard:
+        return page_cache_locks.setdefault(cache_path, threading.Lock())
+
+def extract_pdf_page(source_path, page_number, cache_path):
+    """Write page page_number (1-based) of source_path to cache_path as its own PDF"""
+    reader = PyPDF2.PdfReader(source_path)
+    if page_number > len(reader.pages):
+        raise IndexError(f"Page {page_number} out of range ({len(reader.pages)} pages)")
+    writer = PyPDF2.PdfWriter()
+    writer.add_page(reader.pages[page_number - 1])
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, 'wb') as temp_file:
+            writer.write(temp_file)
+        os.replace(temp_path, cache_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def evict_page_cache(max_bytes=None):
+    """Once the cache is over max_bytes, delete least recently used pages down to
+    PAGE_CACHE_EVICT_TO of it"""
+    max_bytes = PAGE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    # One walk at a time per worker; a concurrent caller has nothing to add
+    if not page_cache_evict_lock.acquire(blocking=False):
+        return 0
+    try:
+        return walk_and_evict_page_cache(max_bytes)
+    finally:
+        page_cache_evict_lock.release()
+
+def walk_and_evict_page_cache(max_bytes):
+    entries = []
+    total = 0
+    for root, _, files in os.walk(PAGE_CACHE_FOLDER):
+        for name in files:
+            if not name.endswith('.pdf'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+            total += stat.st_size
+
+    evicted = 0
+    if total > max_bytes:
+        target = int(max_bytes * PAGE_CACHE_EVICT_TO)
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                evicted += 1
+            except FileNotFoundError:
+                total -= size
+        print(f"Evicted {evicted} cached pages, page cache now {total} bytes")
+    with page_cache_usage_lock:
+        page_cache_usage['bytes'] = total
+    return evicted
+
+def note_cached_page(size):
+    """Add a newly extracted page to the running total, evicting once it is over the limit"""
+    with page_cache_usage_lock:
+        if page_cache_usage['bytes'] is not None:
+            page_cache_usage['bytes'] += size
+            if page_cache_usage['bytes'] <= PAGE_CACHE_MAX_BYTES:
+                return 0
+    return evict_page_cache()
+
+def purge_page_cache(unique_url):
+    cache_dir = page_cache_dir(unique_url)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    with hot_files_lock:
+        for file_path in [path for path in hot_files if path.startswith(cache_dir + os.sep)]:
+            drop_hot_file(file_path, 'invalidations')
+
+@app.route('/serve-page/<unique_url>/<int:page_number>')
+def serve_page(unique_url, page_number):
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("""
+                SELECT filename, original_filename, total_pages, permanent_delete
+                FROM pdfs
+                WHERE unique_url = %s
+            """, (unique_url,))
+            pdf = cursor.fetchone()
+        finally:
+            conn.close()
+
+        if not pdf:
+            return "PDF not found", 404
+        if pdf.get('permanent_delete'):
+            return "PDF has been permanently deleted", 410
+        if page_number < 1 or (pdf['total_pages'] and page_number > pdf['total_pages']):
+            return "Page not found", 404
+
+        cache_path = os.path.join(page_cache_dir(unique_url), f"{page_number}.pdf")
+        if os.path.exists(cache_path):
+            # Mark as recently used for eviction, keeping mtime
+            try:
+                os.utime(cache_path, ns=(time.time_ns(), os.stat(cache_path).st_mtime_ns))
+            except FileNotFoundError:
+                pass
+
+        if not os.path.exists(cache_path):
+            # Extract from the original rather than the linearized copy; the
+            # single-page output is rewritten by PyPDF2 either way
+            admin_path = os.path.join(app.config['ADMIN_PDF_FOLDER'], pdf['filename'])
+            user_path = os.path.join(app.config['USER_PDF_FOLDER'], pdf['filename'])
+            source_path = admin_path if os.path.exists(admin_path) else user_path
+            if not os.path.exists(source_path):
+                return "PDF file not found", 404
+
+            # Concurrent requests for the same page wait for one extraction
+            with page_cache_lock(cache_path):
+                if not os.path.exists(cache_path):
+                    started = time.perf_counter()
+                    try:
+                        extract_pdf_page(source_path, page_number, cache_path)
+                    except IndexError:
+                        return "Page not found", 404
+                    print(f"Extracted page {page_number} of {pdf['original_filename']} "
+                          f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+                    note_cached_page(os.path.getsize(cache_path))
+
+        name, _ = os.path.splitext(pdf['original_filename'])
+        response = send_pdf_file(cache_path, download_name=f"{name} - page {page_number}.pdf")
+        if pdf['total_pages']:
+            response.headers['X-Total-Pages'] = str(pdf['total_pages'])
+        return response
+
+    except FileNotFoundError:
+        # Evicted between the existence check and send_file
+        return "Page temporarily unavailable, retry", 503
+    except Exception as e:
+        print(f"Error in serve_page: {str(e)}")
+        import traceback
+        print(f"Traceback: {traceback.format_exc()}")
+        return "Internal server error", 500
+
 def get_ist_time():
     """Get current time in Indian Standard Time"""
     ist = pytz.timezone('Asia/Kolkata')
     return datetime.datetime.now(ist)
 
+# Tracking ingest. In the default 'direct' mode every /log-view call updates
+# page_views and viewing_sessions in place. With INGEST_MODE=events the call only
+# appends a row to view_events, and a compactor folds those rows into
+# page_views/viewing_sessions every VIEW_EVENT_COMPACT_INTERVAL seconds, so
+# heartbeats no longer contend for the same rows.
+INGEST_MODE = os.getenv('INGEST_MODE', 'direct').lower()
+VIEW_EVENT_COMPACT_INTERVAL = float(os.getenv('VIEW_EVENT_COMPACT_INTERVAL', '5'))
+VIEW_EVENT_COMPACT_BATCH = int(os.getenv('VIEW_EVENT_COMPACT_BATCH', '5000'))
+VIEW_EVENT_COMPACT_LOCK = 'pdf_analytics_view_event_compactor'
+
+def parse_view_event(data):
+    """Normalise a /log-view payload; returns (event, error message)"""
+    if not isinstance(data, dict):
+        return None, "No data received"
+
+    event = {
+        'viewing_session_id': data.get('viewing_session_id'),
+        'pdf_id': data.get('pdf_id'),
+        'page': data.get('page'),
+        'duration': data.get('duration') or 0,
+        'scroll_depth': data.get('scroll_depth') or 0,
+        'zoom_level': data.get('zoom_level') or 1.0,
+        'time_to_first_view': data.get('time_to_first_view') or 0,
+    }
+    # Client-generated id; makes resending the same event harmless
+    event_id = data.get('event_id')
+    if isinstance(event_id, str) and 0 < len(event_id) <= 64:
+        event['event_key'] = event_id
+
+    if data.get('is_complete'):
+        event['kind'] = 'complete'
+    elif data.get('update_duration'):
+        event['kind'] = 'duration'
+    else:
+        event['kind'] = 'view'
+
+    # Validate required fields
+    if not event['viewing_session_id'] or not event['pdf_id'] or event['page'] is None:
+        return None, "Missing required fields"
+    return event, None
+
+# Compact event-table layout: viewing_sessions.session_id is the session UUID as
+# BINARY(16), and its user agent, browser, OS and device type are ids into small
+# dictionary tables. page_views keeps scroll depth (0-1) and zoom level as
+# SMALLINT fixed point; queries scale them back by dividing by the DOUBLE
+# literals 1e4 and 1e2.
+SCROLL_DEPTH_SCALE = 10000
+ZOOM_LEVEL_SCALE = 100
+SESSION_DICTIONARY_JOINS = """
+    LEFT JOIN browsers br ON br.id = vs.browser_id
+    LEFT JOIN operating_systems os ON os.id = vs.operating_system_id
+    LEFT JOIN device_types dt ON dt.id = vs.device_type_id"""
+DICTIONARY_CACHE_MAX = 10000
+dictionary_ids = {}
+
+def to_fixed_point(value, scale):
+    """value * scale rounded and clamped to SMALLINT UNSIGNED"""
+    try:
+        return max(0, min(65535, int(round(float(value) * scale))))
+    except (TypeError, ValueError):
+        return 0
+
+def session_uuid_bytes(value):
+    """The BINARY(16) form of a session UUID string, or None if it isn't one"""
+    try:
+        return uuid.UUID(str(value)).bytes
+    except ValueError:
+        return None
+
+def session_uuid_str(value):
+    return str(uuid.UUID(bytes=bytes(value))) if value else None
+
+def dictionary_id(cursor, table, name):
+    """Id of name in a dictionary table (dictionary cursor), added on first sight"""
+    if not name:
+        return None
+    key = (table, name)
+    if key in dictionary_ids:
+        return dictionary_ids[key]
+
+    # Looked up before inserting: even an ignored duplicate insert can use up one
+    # of the SMALLINT auto-increment values
+    cursor.execute(f"SELECT id FROM {table} WHERE name = %s", (name,))
+    row = cursor.fetchone()
+    if row:
+        # Only committed rows are cached; one inserted below could still be rolled back
+        if len(dictionary_ids) >= DICTIONARY_CACHE_MAX:
+            dictionary_ids.clear()
+        dictionary_ids[key] = row['id']
+        return row['id']
+
+    cursor.execute(f"INSERT IGNORE INTO {table} (name) VALUES (%s)", (name,))
+    if cursor.lastrowid:
+        return cursor.lastrowid
+    # Another request added it meanwhile; a locking read sees past our snapshot
+    cursor.execute(f"SELECT id FROM {table} WHERE name = %s LOCK IN SHARE MODE", (name,))
+    return cursor.fetchone()['id']
+
+def upsert_viewer(cursor, email, seen_at):
+    """Id of the viewers row for this email, created on first sight"""
+    cursor.execute("""
+        INSERT INTO viewers (email_hash, email, first_seen, last_seen)
+        VALUES (SHA2(LOWER(TRIM(%s)), 256), LOWER(TRIM(%s)), %s, %s)
+        ON DUPLICATE KEY UPDATE
+            last_seen = GREATEST(last_seen, VALUES(last_seen)),
+            id = LAST_INSERT_ID(id)
+    """, (email, email, seen_at, seen_at))
+    return cursor.lastrowid
+
+def refresh_viewer_activity(cursor, viewing_session_ids):
+    """Recompute the viewer_pdf_activity rows behind these sessions from viewing_sessions.
+
+    Each row aggregates one viewer's sessions on one PDF through idx_viewer_pdf,
+    so this stays cheap however many sessions the PDF has.
+    """
+    if not viewing_session_ids:
+        return
+    cursor.execute(f"""
+        INSERT INTO viewer_pdf_activity
+            (viewer_id, pdf_id, sessions, completed_sessions, total_duration,
+             max_unique_pages, first_seen, last_seen)
+        SELECT vs.viewer_id, vs.pdf_id, COUNT(*), SUM(vs.status = 'completed'),
+               COALESCE(SUM(vs.total_duration), 0), COALESCE(MAX(vs.unique_pages), 0),
+               MIN(vs.start_time), MAX(COALESCE(vs.last_activity, vs.start_time))
+        FROM viewing_sessions vs
+        JOIN (
+            SELECT DISTINCT viewer_id, pdf_id
+            FROM viewing_sessions
+            WHERE id IN ({', '.join(['%s'] * len(viewing_session_ids))}) AND viewer_id IS NOT NULL
+        ) touched ON touched.viewer_id = vs.viewer_id AND touched.pdf_id = vs.pdf_id
+        WHERE vs.is_admin = FALSE
+        GROUP BY vs.viewer_id, vs.pdf_id
+        ON DUPLICATE KEY UPDATE
+            sessions = VALUES(sessions),
+            completed_sessions = VALUES(completed_sessions),
+            total_duration = VALUES(total_duration),
+            max_unique_pages = VALUES(max_unique_pages),
+            first_seen = VALUES(first_seen),
+            last_seen = VALUES(last_seen)
+    """, list(viewing_session_ids))
+
+# Events replayed from the spool carry received_at, the Unix time they reached the
+# app. FROM_UNIXTIME turns it into the session time zone NOW() uses, so replayed
+# and live events land on the same clock; live events have none and use NOW().
+EVENT_TIME = "COALESCE(FROM_UNIXTIME(%s), NOW())"
+
+def event_timestamp(event):
+    received_at = event.get('received_at')
+    if isinstance(received_at, str):
+        # Spool records written before received_at became a Unix time hold a UTC string
+        received_at = datetime.datetime.strptime(received_at, '%Y-%m-%d %H:%M:%S').replace(
+            tzinfo=datetime.timezone.utc).timestamp()
+    return received_at
+
+def touch_viewer_activity(cursor, viewer_id, pdf_id, event_at):
+    """Move the viewer's last_seen on this PDF forward. The rest of the rollup only
+    changes when a session starts, completes, is reaped or compacted."""
+    if viewer_id is None:
+        return
+    cursor.execute(f"""
+        UPDATE viewer_pdf_activity
+        SET last_seen = GREATEST(last_seen, {EVENT_TIME})
+        WHERE viewer_id = %s AND pdf_id = %s
+    """, (event_at, viewer_id, pdf_id))
+
+def apply_view_event(cursor, event):
+    """Update page_views/viewing_sessions for one event; returns (response body, status)"""
+    viewing_session_id = event['viewing_session_id']
+    event_at = event_timestamp(event)
+    pdf_id = event['pdf_id']
+    page = event['page']
+    duration = event['duration']
+    scroll_depth = to_fixed_point(event['scroll_depth'], SCROLL_DEPTH_SCALE)
+    zoom_level = to_fixed_point(event['zoom_level'], ZOOM_LEVEL_SCALE)
+
+    # Verify the viewing session exists and get its data
+    cursor.execute("""
+        SELECT id, pdf_id, session_id, total_pages, viewer_id
+        FROM viewing_sessions 
+        WHERE id = %s
+    """, (viewing_session_id,))
+    viewing_session = cursor.fetchone()
+    if not viewing_session:
+        print(f"Viewing session not found: {viewing_session_id}")
+        return {"message": "Viewing session not found"}, 404
+
+    # Use the PDF ID from the session if not provided
+    if not pdf_id:
+        pdf_id = viewing_session[1]
+
+    # If this is a completion signal, update session status
+    if event['kind'] == 'complete':
+        print("Processing completion signal")
+        # First update the current page view
+        cursor.execute(f"""
+            UPDATE page_views 
+            SET duration = %s,
+                scroll_depth = GREATEST(scroll_depth, %s),
+                zoom_level = GREATEST(zoom_level, %s),
+                end_time = {EVENT_TIME},
+                is_complete = TRUE
+            WHERE session_id = %s AND page_number = %s
+        """, (duration, scroll_depth, zoom_level, event_at, viewing_session_id, page))
+        
+        # Then update the session status
+        cursor.execute(f"""
+            UPDATE viewing_sessions 
+            SET status = 'completed',
+                end_time = {EVENT_TIME},
+                last_activity = GREATEST(COALESCE(last_activity, {EVENT_TIME}), {EVENT_TIME}),
+                total_duration = (
+                    SELECT COALESCE(SUM(duration), 0)
+                    FROM page_views
+                    WHERE session_id = %s
+                ),
+                total_pages = %s,
+                unique_pages = (
+                    SELECT COUNT(DISTINCT page_number)
+                    FROM page_views
+                    WHERE session_id = %s
+                )
+            WHERE id = %s
+        """, (event_at, event_at, event_at, viewing_session_id, viewing_session[3],
+              viewing_session_id, viewing_session_id))
+        refresh_viewer_activity(cursor, [viewing_session_id])
+        
+        print("Session marked as completed")
+        return {'status': 'success', 'message': 'Session completed'}, 200
+
+    # Check if this is a duration update for a revisited page
+    if event['kind'] == 'duration':
+        print("Processing duration update")
+        # Update the duration for the existing page view
+        cursor.execute(f"""
+            UPDATE page_views 
+            SET duration = %s,
+                scroll_depth = GREATEST(scroll_depth, %s),
+                zoom_level = GREATEST(zoom_level, %s),
+                end_time = GREATEST(COALESCE(end_time, {EVENT_TIME}), {EVENT_TIME})
+            WHERE session_id = %s AND page_number = %s
+        """, (duration, scroll_depth, zoom_level, event_at, event_at, viewing_session_id, page))
+        
+        # Update session total duration
+        cursor.execute(f"""
+            UPDATE viewing_sessions 
+            SET total_duration = (
+                SELECT COALESCE(SUM(duration), 0)
+                FROM page_views
+                WHERE session_id = %s
+            ),
+            last_activity = GREATEST(COALESCE(last_activity, {EVENT_TIME}), {EVENT_TIME})
+            WHERE id = %s
+        """, (viewing_session_id, event_at, event_at, viewing_session_id))
+        touch_viewer_activity(cursor, viewing_session[4], viewing_session[1], event_at)
+        
+        print("Duration updated successfully")
+        return {'status': 'success', 'message': 'Duration updated'}, 200
+
+    # For new page views, check if this page has been viewed in this session
+    print("Processing new page view")
+    cursor.execute("""
+        SELECT COUNT(*) 
+        FROM page_views 
+        WHERE session_id = %s AND page_number = %s
+    """, (viewing_session_id, page))
+    page_count = cursor.fetchone()[0]
+    is_new_page = page_count == 0
+
+    if is_new_page:
+        print("Inserting new page view")
+        cursor.execute("SELECT total_pages FROM pdfs WHERE id = %s", (pdf_id,))
+        pdf = cursor.fetchone()
+        if not pdf:
+            return {"message": "PDF not found"}, 404
+
+        # Insert new page view
+        cursor.execute(f"""
+            INSERT INTO page_views (
+                session_id, pdf_id, page_number, duration,
+                scroll_depth, zoom_level, time_to_first_view, is_complete,
+                start_time, end_time
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, {EVENT_TIME}, {EVENT_TIME})
+        """, (
+            viewing_session_id, pdf_id, page, duration,
+            scroll_depth, zoom_level, event['time_to_first_view'], False, event_at, event_at
+        ))
+
+        # Update session statistics
+        cursor.execute(f"""
+            UPDATE viewing_sessions 
+            SET total_duration = (
+                SELECT COALESCE(SUM(duration), 0)
+                FROM page_views
+                WHERE session_id = %s
+            ),
+            total_pages = %s,
+            unique_pages = (
+                SELECT COUNT(DISTINCT page_number)
+                FROM page_views
+                WHERE session_id = %s
+            ),
+            last_activity = GREATEST(COALESCE(last_activity, {EVENT_TIME}), {EVENT_TIME})
+            WHERE id = %s
+        """, (viewing_session_id, pdf[0], viewing_session_id, event_at, event_at, viewing_session_id))
+        touch_viewer_activity(cursor, viewing_session[4], viewing_session[1], event_at)
+        
+        print("New page view logged successfully")
+
+    return {
+        'status': 'success',
+        'is_new_page': is_new_page,
+        'message': 'Page view logged successfully'
+    }, 200
+
+def append_view_event(cursor, event):
+    # Replayed events keep the time they were received
+    cursor.execute(f"""
+        INSERT INTO view_events (
+            viewing_session_id, pdf_id, page_number, kind,
+            duration, scroll_depth, zoom_level, time_to_first_view, created_at
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, {EVENT_TIME})
+    """, (event['viewing_session_id'], event['pdf_id'], event['page'], event['kind'],
+          event['duration'], event['scroll_depth'], event['zoom_level'], event['time_to_first_view'],
+          event_timestamp(event)))
+
+def ingest_view_event(cursor, event):
+    """Record one event according to INGEST_MODE; returns (response body, status).
+
+    Events carrying an event_key are applied at most once: the key is claimed in
+    ingest_dedup in the same transaction as the write.
+    """
+    if event.get('event_key'):
+        cursor.execute("INSERT IGNORE INTO ingest_dedup (event_key) VALUES (%s)", (event['event_key'],))
+        if cursor.rowcount == 0:
+            return {'status': 'success', 'duplicate': True, 'message': 'Event already recorded'}, 200
+
+    if INGEST_MODE == 'events':
+        append_view_event(cursor, event)
+        return {'status': 'success', 'message': 'Page view queued'}, 202
+    return apply_view_event(cursor, event)
+
+def fold_view_events(events):
+    """Collapse raw events (in id order) into one state per (session, page)"""
+    pages = {}
+    for event in events:
+        key = (event['viewing_session_id'], event['page_number'])
+        state = pages.get(key)
+        if state is None:
+            state = pages[key] = {
+                'pdf_id': event['pdf_id'],
+                'time_to_first_view': 0,
+                'scroll_depth': 0,
+                'zoom_level': event['zoom_level'],
+                'is_complete': False,
+                'has_update': False,
+                'start_time': event['created_at'],
+            }
+        if event['kind'] == 'view' and not state['time_to_first_view']:
+            state['time_to_first_view'] = event['time_to_first_view']
+        if event['kind'] != 'view':
+            state['has_update'] = True
+        if event['kind'] == 'complete':
+            state['is_complete'] = True
+        # Durations are cumulative, so the latest one wins; scroll and zoom keep the maximum
+        state['duration'] = event['duration']
+        state['scroll_depth'] = max(state['scroll_depth'], event['scroll_depth'])
+        state['zoom_level'] = max(state['zoom_level'], event['zoom_level'])
+        state['end_time'] = event['created_at']
+    return pages
+
+def compact_view_event_batch(cursor, events):
+    pages = fold_view_events(events)
+    session_ids = sorted({session_id for session_id, _ in pages})
+    placeholders = ', '.join(['%s'] * len(session_ids))
+
+    # Events for sessions that no longer exist are dropped
+    cursor.execute(f"""
+        SELECT vs.id, p.total_pages
+        FROM viewing_sessions vs
+        JOIN pdfs p ON p.id = vs.pdf_id
+        WHERE vs.id IN ({placeholders})
+    """, session_ids)
+    sessions = {row['id']: row for row in cursor.fetchall()}
+    pages = {key: state for key, state in pages.items() if key[0] in sessions}
+    if not pages:
+        return
+
+    keys = list(pages)
+    cursor.execute(f"""
+        SELECT DISTINCT session_id, page_number
+        FROM page_views
+        WHERE (session_id, page_number) IN ({', '.join(['(%s, %s)'] * len(keys))})
+    """, [value for key in keys for value in key])
+    existing = {(row['session_id'], row['page_number']) for row in cursor.fetchall()}
+
+    inserts = []
+    updates = []
+    for (session_id, page_number), state in pages.items():
+        scroll_depth = to_fixed_point(state['scroll_depth'], SCROLL_DEPTH_SCALE)
+        zoom_level = to_fixed_point(state['zoom_level'], ZOOM_LEVEL_SCALE)
+        if (session_id, page_number) not in existing:
+            inserts.append((
+                session_id, state['pdf_id'], page_number, state['duration'],
+                scroll_depth, zoom_level, state['time_to_first_view'],
+                state['is_complete'], state['start_time'], state['end_time']
+            ))
+        elif state['has_update']:
+            updates.append((
+                state['duration'], scroll_depth, zoom_level,
+                state['end_time'], state['is_complete'], session_id, page_number
+            ))
+
+    if inserts:
+        cursor.executemany("""
+            INSERT INTO page_views (
+                session_id, pdf_id, page_number, duration,
+                scroll_depth, zoom_level, time_to_first_view, is_complete,
+                start_time, end_time
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, inserts)
+    if updates:
+        cursor.executemany("""
+            UPDATE page_views
+            SET duration = %s,
+                scroll_depth = GREATEST(scroll_depth, %s),
+                zoom_level = GREATEST(zoom_level, %s),
+                end_time = %s,
+                is_complete = is_complete OR %s
+            WHERE session_id = %s AND page_number = %s
+        """, updates)
+
+    # One statement per touched session rather than one per event
+    session_updates = []
+    for session_id in {key[0] for key in pages}:
+        session_pages = [state for key, state in pages.items() if key[0] == session_id]
+        last_activity = max(state['end_time'] for state in session_pages)
+        completed_at = max((state['end_time'] for state in session_pages if state['is_complete']), default=None)
+        session_updates.append((
+            session_id, session_id, sessions[session_id]['total_pages'], last_activity, last_activity,
+            completed_at, completed_at, session_id
+        ))
+    cursor.executemany("""
+        UPDATE viewing_sessions
+        SET total_duration = (
+                SELECT COALESCE(SUM(duration), 0)
+                FROM page_views
+                WHERE session_id = %s
+            ),
+            unique_pages = (
+                SELECT COUNT(DISTINCT page_number)
+                FROM page_views
+                WHERE session_id = %s
+            ),
+            total_pages = %s,
+            last_activity = GREATEST(COALESCE(last_activity, %s), %s),
+            status = IF(%s IS NULL, status, 'completed'),
+            end_time = COALESCE(%s, end_time)
+        WHERE id = %s
+    """, session_updates)
+    refresh_viewer_activity(cursor, sorted({key[0] for key in pages}))
+
+def compact_view_events():
+    """Fold pending view_events into page_views/viewing_sessions and prune them; returns events processed"""
+    conn = None
+    processed = 0
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True, buffered=True)
+
+        # One compactor at a time across workers; the others skip this round
+        cursor.execute("SELECT GET_LOCK(%s, 0) AS acquired", (VIEW_EVENT_COMPACT_LOCK,))
+        if cursor.fetchone()['acquired'] != 1:
+            return 0
+
+        try:
+            while True:
+                cursor.execute("""
+                    SELECT id, viewing_session_id, pdf_id, page_number, kind,
+                           duration, scroll_depth, zoom_level, time_to_first_view, created_at
+                    FROM view_events
+                    ORDER BY id
+                    LIMIT %s
+                """, (VIEW_EVENT_COMPACT_BATCH,))
+                events = cursor.fetchall()
+                if not events:
+                    break
+
+                compact_view_event_batch(cursor, events)
+                cursor.execute("DELETE FROM view_events WHERE id <= %s", (events[-1]['id'],))
+                conn.commit()
+                processed += len(events)
+                if len(events) < VIEW_EVENT_COMPACT_BATCH:
+                    break
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (VIEW_EVENT_COMPACT_LOCK,))
+            cursor.fetchone()
+
+        if processed:
+            print(f"Compacted {processed} view event(s)")
+        return processed
+    finally:
+        if conn:
+            conn.close()
+
+# Local spool for ingest while MySQL is failing or too slow. /log-view appends the
+# event to a file of length-prefixed JSON records and answers 202; a background
+# replayer drains the spool in order once the database is back. Spooled events
+# get an event_key so a replay interrupted halfway never double-counts.
+INGEST_SPOOL_FILE = os.path.join(INGEST_SPOOL_FOLDER, 'events.spool')
+INGEST_SPOOL_FSYNC = os.getenv('INGEST_SPOOL_FSYNC', 'interval').lower()  # always, interval or never
+INGEST_SPOOL_FSYNC_INTERVAL = float(os.getenv('INGEST_SPOOL_FSYNC_INTERVAL', '1'))
+INGEST_SPOOL_REPLAY_INTERVAL = float(os.getenv('INGEST_SPOOL_REPLAY_INTERVAL', '5'))
+INGEST_DB_TIMEOUT = int(os.getenv('INGEST_DB_TIMEOUT', '3'))
+INGEST_DEDUP_RETENTION_DAYS = int(os.getenv('INGEST_DEDUP_RETENTION_DAYS', '7'))
+SPOOL_RECORD_HEADER = struct.Struct('>I')
+
+# Outages and timeouts; anything else (bad data, schema errors) would fail the same way on replay
+TRANSIENT_DB_ERRNOS = {1205, 1213, 2003, 2006, 2013, 2055}
+
+def is_transient_db_error(e):
+    return (isinstance(e, (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError))
+            or e.errno in TRANSIENT_DB_ERRNOS)
+
+spool_write_lock = threading.Lock()
+spool_state = {'last_fsync': 0.0}
+
+def get_ingest_db_connection():
+    # Fail fast so a stalled database sends events to the spool instead of
+    # holding the request
+    conn = mysql.connector.connect(**db_config, connection_timeout=INGEST_DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute("SET SESSION innodb_lock_wait_timeout = %s", (INGEST_DB_TIMEOUT,))
+    cursor.close()
+    return conn
+
+def spool_view_event(event):
+    """Append an event to the local spool; returns its event_key"""
+    event = dict(event)
+    event.setdefault('event_key', uuid.uuid4().hex)
+    event.setdefault('received_at', int(time.time()))
+    payload = json.dumps(event).encode('utf-8')
+    record = SPOOL_RECORD_HEADER.pack(len(payload)) + payload
+
+    with spool_write_lock:
+        while True:
+            spool_file = open(INGEST_SPOOL_FILE, 'ab')
+            # Other gunicorn workers append to the same file
+            if fcntl:
+                fcntl.flock(spool_file.fileno(), fcntl.LOCK_EX)
+            # The replayer may have renamed the file while we waited for the lock
+            try:
+                if os.stat(INGEST_SPOOL_FILE).st_ino == os.fstat(spool_file.fileno()).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            spool_file.close()
+
+        with spool_file:
+            spool_file.write(record)
+            spool_file.flush()
+            now = time.monotonic()
+            if INGEST_SPOOL_FSYNC == 'always' or (
+                    INGEST_SPOOL_FSYNC == 'interval'
+                    and now - spool_state['last_fsync'] >= INGEST_SPOOL_FSYNC_INTERVAL):
+                os.fsync(spool_file.fileno())
+                spool_state['last_fsync'] = now
+    return event['event_key']
+
+def read_spool_records(path):
+    """Yield (end offset, event) for each complete record; a torn final record is ignored"""
+    with open(path, 'rb') as spool_file:
+        offset = 0
+        while True:
+            header = spool_file.read(SPOOL_RECORD_HEADER.size)
+            if len(header) < SPOOL_RECORD_HEADER.size:
+                if header:
+                    print(f"Ignoring truncated record header at offset {offset} in {path}")
+                return
+            length, = SPOOL_RECORD_HEADER.unpack(header)
+            payload = spool_file.read(length)
+            if len(payload) < length:
+                print(f"Ignoring truncated record at offset {offset} in {path}")
+                return
+            offset += SPOOL_RECORD_HEADER.size + length
+            yield offset, json.loads(payload)
+
+def rotate_ingest_spool():
+    """Move the active spool aside so writers start a fresh file; returns files to drain, oldest first"""
+    if os.path.exists(INGEST_SPOOL_FILE) and os.path.getsize(INGEST_SPOOL_FILE) > 0:
+        with spool_write_lock, open(INGEST_SPOOL_FILE, 'ab') as spool_file:
+            # Taken by writers too, so the rename never lands mid-record
+            if fcntl:
+                fcntl.flock(spool_file.fileno(), fcntl.LOCK_EX)
+            draining = os.path.join(INGEST_SPOOL_FOLDER, f"events.{time.time_ns()}.draining")
+            os.rename(INGEST_SPOOL_FILE, draining)
+    return sorted(os.path.join(INGEST_SPOOL_FOLDER, name)
+                  for name in os.listdir(INGEST_SPOOL_FOLDER) if name.endswith('.draining'))
+
+def replay_ingest_spool():
+    """Apply spooled events in order; returns the number replayed"""
+    with open(os.path.join(INGEST_SPOOL_FOLDER, 'replay.lock'), 'a') as replay_lock:
+        # One replayer per host; others skip this round
+        if fcntl:
+            try:
+                fcntl.flock(replay_lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+
+        replayed = 0
+        for path in rotate_ingest_spool():
+            conn = get_ingest_db_connection()
+            try:
+                cursor = conn.cursor()
+                for _, event in read_spool_records(path):
+                    try:
+                        body, status = ingest_view_event(cursor, event)
+                        conn.commit()
+                    except mysql.connector.Error as e:
+                        conn.rollback()
+                        if is_transient_db_error(e):
+                            # Still unavailable; the file is retried from the start next
+                            # round and ingest_dedup skips what already went through
+                            raise
+                        body, status = {'message': str(e)}, 500
+                    if status >= 400:
+                        print(f"Dropped spooled event {event['event_key']}: {body.get('message')}")
+                    replayed += 1
+            finally:
+                conn.close()
+            os.remove(path)
+
+        if replayed:
+            print(f"Replayed {replayed} spooled view event(s)")
+        return replayed
+
+def prune_ingest_dedup():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            DELETE FROM ingest_dedup
+            WHERE created_at < NOW() - INTERVAL %s DAY
+            LIMIT 10000
+        """, (INGEST_DEDUP_RETENTION_DAYS,))
+        conn.commit()
+    finally:
+        conn.close()
+
+# Sessions whose tab went away without a completion beacon are closed by a
+# periodic reaper: once idle for SESSION_IDLE_TIMEOUT seconds they are marked
+# abandoned with their end time and totals finalised, SESSION_REAP_BATCH at a time.
+SESSION_IDLE_TIMEOUT = int(os.getenv('SESSION_IDLE_TIMEOUT', '1800'))
+SESSION_REAP_INTERVAL = int(os.getenv('SESSION_REAP_INTERVAL', '60'))
+SESSION_REAP_BATCH = int(os.getenv('SESSION_REAP_BATCH', '500'))
+SESSION_REAP_MAX_BATCHES = 20
+SESSION_REAP_LOCK = 'pdf_analytics_session_reaper'
+
+def reap_idle_sessions():
+    """Mark sessions idle past SESSION_IDLE_TIMEOUT as abandoned; returns sessions reaped"""
+    conn = get_db_connection()
+    reaped = 0
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=True)
+
+        # One reaper at a time across workers; the others skip this round
+        cursor.execute("SELECT GET_LOCK(%s, 0) AS acquired", (SESSION_REAP_LOCK,))
+        if cursor.fetchone()['acquired'] != 1:
+            return 0
+
+        try:
+            for _ in range(SESSION_REAP_MAX_BATCHES):
+                cursor.execute("""
+                    SELECT id
+                    FROM viewing_sessions
+                    WHERE status = 'active' AND last_activity < NOW() - INTERVAL %s SECOND
+                    ORDER BY last_activity
+                    LIMIT %s
+                """, (SESSION_IDLE_TIMEOUT, SESSION_REAP_BATCH))
+                session_ids = [row['id'] for row in cursor.fetchall()]
+                if not session_ids:
+                    break
+
+                placeholders = ', '.join(['%s'] * len(session_ids))
+                # status is rechecked so a completion that lands meanwhile wins
+                cursor.execute(f"""
+                    UPDATE viewing_sessions vs
+                    LEFT JOIN (
+                        SELECT session_id,
+                               COALESCE(SUM(duration), 0) AS total_duration,
+                               COUNT(DISTINCT page_number) AS unique_pages,
+                               MAX(end_time) AS last_view_end
+                        FROM page_views
+                        WHERE session_id IN ({placeholders})
+                        GROUP BY session_id
+                    ) pv ON pv.session_id = vs.id
+                    SET vs.status = 'abandoned',
+                        vs.end_time = COALESCE(vs.end_time, pv.last_view_end, vs.last_activity),
+                        vs.total_duration = COALESCE(pv.total_duration, 0),
+                        vs.unique_pages = COALESCE(pv.unique_pages, 0)
+                    WHERE vs.id IN ({placeholders}) AND vs.status = 'active'
+                """, session_ids + session_ids)
+                # Sessions a completion got to first are not counted
+                reaped += cursor.rowcount
+                refresh_viewer_activity(cursor, session_ids)
+                conn.commit()
+                if len(session_ids) < SESSION_REAP_BATCH:
+                    break
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (SESSION_REAP_LOCK,))
+            cursor.fetchone()
+
+        if reaped:
+            print(f"Marked {reaped} idle session(s) as abandoned")
+        return reaped
+    finally:
+        conn.close()
+
+# Once page_views/viewing_sessions are partitioned by month (python partitions.py
+# enable), an hourly task keeps EVENT_PARTITION_MONTHS_AHEAD months of partitions
+# ready and, with EVENT_RETENTION_MONTHS set, archives older months to gzipped
+# JSON lines in EVENT_ARCHIVE_FOLDER (empty to skip archiving) before dropping them.
+EVENT_PARTITION_MONTHS_AHEAD = int(os.getenv('EVENT_PARTITION_MONTHS_AHEAD', '3'))
+EVENT_RETENTION_MONTHS = int(os.getenv('EVENT_RETENTION_MONTHS', '0'))
+EVENT_ARCHIVE_FOLDER = os.getenv('EVENT_ARCHIVE_FOLDER', os.path.join(BASE_DIR, 'archive'))
+PARTITION_MAINTENANCE_INTERVAL = 3600
+
+def maintain_event_partitions():
+    conn = get_db_connection()
+    try:
+        partitions.maintain(conn, EVENT_PARTITION_MONTHS_AHEAD, EVENT_RETENTION_MONTHS,
+                            EVENT_ARCHIVE_FOLDER or None)
+    finally:
+        conn.close()
+
+# Deleting a PDF only marks it; PDF_PURGE_GRACE_DAYS later a purge task archives
+# its analytics to PDF_PURGE_ARCHIVE_FOLDER (empty to skip), deletes its rows
+# child tables first, PDF_PURGE_BATCH rows per transaction so no lock is held for
+# long, then removes its files and finally the pdfs row.
+PDF_PURGE_GRACE_DAYS = int(os.getenv('PDF_PURGE_GRACE_DAYS', '30'))
+PDF_PURGE_BATCH = int(os.getenv('PDF_PURGE_BATCH', '1000'))
+PDF_PURGE_ARCHIVE_FOLDER = os.getenv('PDF_PURGE_ARCHIVE_FOLDER', EVENT_ARCHIVE_FOLDER)
+PDF_PURGE_MAX_PDFS = 10
+PDF_PURGE_INTERVAL = 3600
+PDF_PURGE_LOCK = 'pdf_analytics_pdf_purge'
+# Children first, so the foreign key cascades (where present) have nothing left to do
+PDF_PURGE_TABLES = ['page_views', 'viewing_sessions', 'viewer_pdf_activity', 'url_mappings', 'upload_jobs']
+
+def archive_deleted_pdf(conn, pdf):
+    """Archive a PDF's rows to <folder>/pdf-<unique_url>/<table>.jsonl.gz"""
+    archive_dir = os.path.join(PDF_PURGE_ARCHIVE_FOLDER, f"pdf-{secure_filename(pdf['unique_url'])}")
+    # pdfs.jsonl.gz is written last; once present, an interrupted purge must not
+    # overwrite the complete archive with what is left
+    if os.path.exists(os.path.join(archive_dir, 'pdfs.jsonl.gz')):
+        return archive_dir
+    os.makedirs(archive_dir, exist_ok=True)
+    for table in PDF_PURGE_TABLES + ['pdfs']:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(f"SELECT * FROM {table} WHERE {'id' if table == 'pdfs' else 'pdf_id'} = %s",
+                           (pdf['id'],))
+            partitions.write_archive(os.path.join(archive_dir, f"{table}.jsonl.gz"), cursor)
+        finally:
+            cursor.close()
+    return archive_dir
+
+def purge_deleted_pdf(conn, pdf):
+    """Remove every trace of one soft-deleted PDF; safe to rerun after an interruption"""
+    if PDF_PURGE_ARCHIVE_FOLDER:
+        print(f"Archived analytics of {pdf['original_filename']} to {archive_deleted_pdf(conn, pdf)}")
+
+    cursor = conn.cursor()
+    try:
+        deleted = 0
+        for table in PDF_PURGE_TABLES:
+            while True:
+                cursor.execute(f"DELETE FROM {table} WHERE pdf_id = %s LIMIT %s", (pdf['id'], PDF_PURGE_BATCH))
+                conn.commit()
+                deleted += cursor.rowcount
+                if cursor.rowcount < PDF_PURGE_BATCH:
+                    break
+
+        file_paths = [os.path.join(ADMIN_PDF_FOLDER, pdf['filename']),
+                      os.path.join(USER_PDF_FOLDER, pdf['filename'])]
+        if pdf.get('linearized_filename'):
+            file_paths.append(os.path.join(USER_PDF_FOLDER, pdf['linearized_filename']))
+        invalidate_hot_file(*file_paths)
+        for file_path in file_paths:
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+        purge_page_cache(pdf['unique_url'])
+
+        cursor.execute("DELETE FROM pdfs WHERE id = %s AND permanent_delete = TRUE", (pdf['id'],))
+        conn.commit()
+        print(f"Purged {pdf['original_filename']} ({deleted} dependent row(s))")
+    finally:
+        cursor.close()
+
+def purge_deleted_pdfs():
+    """Purge PDFs soft-deleted more than PDF_PURGE_GRACE_DAYS ago; returns PDFs purged"""
+    conn = get_db_connection()
+    purged = 0
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=True)
+
+        # One purger at a time across workers; the others skip this round
+        cursor.execute("SELECT GET_LOCK(%s, 0) AS acquired", (PDF_PURGE_LOCK,))
+        if cursor.fetchone()['acquired'] != 1:
+            return 0
+
+        try:
+            cursor.execute("""
+                SELECT id, unique_url, filename, original_filename, linearized_filename
+                FROM pdfs
+                WHERE permanent_delete = TRUE AND deleted_at < NOW() - INTERVAL %s DAY
+                ORDER BY deleted_at
+                LIMIT %s
+            """, (PDF_PURGE_GRACE_DAYS, PDF_PURGE_MAX_PDFS))
+            for pdf in cursor.fetchall():
+                purge_deleted_pdf(conn, pdf)
+                purged += 1
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (PDF_PURGE_LOCK,))
+            cursor.fetchone()
+        return purged
+    finally:
+        conn.close()
+
+background_tasks = {}
+background_tasks_lock = threading.Lock()
+
+def start_periodic_task(name, interval, func):
+    """Run func every interval seconds in a daemon thread, once per process"""
+    with background_tasks_lock:
+        if name in background_tasks:
+            return background_tasks[name]
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    func()
+                except Exception as e:
+                    print(f"Error in background task {name}: {str(e)}")
+                    import traceback
+                    print(f"Traceback: {traceback.format_exc()}")
+
+        thread = threading.Thread(target=run, name=name, daemon=True)
+        thread.start()
+        background_tasks[name] = thread
+        return thread
+
+def start_background_tasks():
+    if INGEST_MODE == 'events':
+        start_periodic_task('view_event_compactor', VIEW_EVENT_COMPACT_INTERVAL, compact_view_events)
+    start_periodic_task('ingest_spool_replayer', INGEST_SPOOL_REPLAY_INTERVAL, replay_ingest_spool)
+    start_periodic_task('ingest_dedup_pruner', 3600, prune_ingest_dedup)
+    start_periodic_task('session_reaper', SESSION_REAP_INTERVAL, reap_idle_sessions)
+    start_periodic_task('partition_maintenance', PARTITION_MAINTENANCE_INTERVAL, maintain_event_partitions)
+    start_periodic_task('pdf_purge', PDF_PURGE_INTERVAL, purge_deleted_pdfs)
+    start_periodic_task('upload_job_requeuer', UPLOAD_JOB_REQUEUE_INTERVAL, requeue_stale_upload_jobs)
+    start_periodic_task('page_cache_rescan', PAGE_CACHE_RESCAN_INTERVAL, evict_page_cache)
+
+# Admission control for tracking traffic, so a slow database can't tie up the
+# workers that also serve PDFs. At most TRACKING_MAX_CONCURRENCY ingest requests
+# touch the database at once across all workers on the host (slots are flock'd
+# files, released automatically if a worker dies); the last
+# TRACKING_RESERVED_SLOTS are kept for completion events. Up to TRACKING_MAX_QUEUE
+# requests per worker wait at most TRACKING_QUEUE_TIMEOUT seconds for a slot.
+# Anything beyond that is shed: heartbeats get 429 with Retry-After, completions
+# go to the local spool.
+TRACKING_MAX_CONCURRENCY = int(os.getenv('TRACKING_MAX_CONCURRENCY', '2'))
+TRACKING_RESERVED_SLOTS = int(os.getenv('TRACKING_RESERVED_SLOTS', '1'))
+TRACKING_MAX_QUEUE = int(os.getenv('TRACKING_MAX_QUEUE', '4'))
+TRACKING_QUEUE_TIMEOUT = float(os.getenv('TRACKING_QUEUE_TIMEOUT', '0.25'))
+TRACKING_RETRY_AFTER = int(os.getenv('TRACKING_RETRY_AFTER', '5'))
+TRACKING_SLOT_FOLDER = os.path.join(INGEST_SPOOL_FOLDER, 'slots')
+os.makedirs(TRACKING_SLOT_FOLDER, exist_ok=True)
+
+tracking_stats_lock = threading.Lock()
+tracking_stats = {'in_flight': 0, 'waiting': 0, 'admitted': 0, 'shed': 0,
+                  'shed_by_kind': {}, 'spooled_on_shed': 0}
+
+def try_tracking_slot(limit):
+    for index in range(limit):
+        slot_file = open(os.path.join(TRACKING_SLOT_FOLDER, f"slot-{index}.lock"), 'a')
+        try:
+            fcntl.flock(slot_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return slot_file
+        except BlockingIOError:
+            slot_file.close()
+    return None
+
+def admit_tracking_request(kind):
+    """Take an ingest slot, waiting briefly if allowed; returns the slot, or None to shed the request"""
+    if fcntl is None:
+        # No cross-process locking (Windows development server); admit everything
+        return True
+
+    limit = TRACKING_MAX_CONCURRENCY
+    if kind != 'complete':
+        limit = max(1, TRACKING_MAX_CONCURRENCY - TRACKING_RESERVED_SLOTS)
+
+    slot = try_tracking_slot(limit)
+    if slot is None:
+        with tracking_stats_lock:
+            queue_full = tracking_stats['waiting'] >= TRACKING_MAX_QUEUE
+            if not queue_full:
+                tracking_stats['waiting'] += 1
+        if queue_full:
+            return record_shed(kind)
+        try:
+            deadline = time.monotonic() + TRACKING_QUEUE_TIMEOUT
+            while slot is None and time.monotonic() < deadline:
+                time.sleep(0.02)
+                slot = try_tracking_slot(limit)
+        finally:
+            with tracking_stats_lock:
+                tracking_stats['waiting'] -= 1
+        if slot is None:
+            return record_shed(kind)
+
+    with tracking_stats_lock:
+        tracking_stats['in_flight'] += 1
+        tracking_stats['admitted'] += 1
+    return slot
+
+def record_shed(kind):
+    with tracking_stats_lock:
+        tracking_stats['shed'] += 1
+        tracking_stats['shed_by_kind'][kind] = tracking_stats['shed_by_kind'].get(kind, 0) + 1
+    return None
+
+def release_tracking_request(slot):
+    if slot is True:
+        return
+    slot.close()
+    with tracking_stats_lock:
+        tracking_stats['in_flight'] -= 1
+
+def shed_response(message='Tracking temporarily overloaded, retry later', status=429):
+    response = jsonify({'status': 'error', 'message': message, 'retry_after': TRACKING_RETRY_AFTER})
+    response.status_code = status
+    response.headers['Retry-After'] = str(TRACKING_RETRY_AFTER)
+    return response
+
+@app.route('/tracking-stats')
+def tracking_stats_view():
+    if not session.get("admin_logged_in"):
+        return jsonify({"message": "Unauthorized"}), 401
+
+    with tracking_stats_lock:
+        stats = dict(tracking_stats, shed_by_kind=dict(tracking_stats['shed_by_kind']))
+    offered = stats['admitted'] + stats['shed']
+    stats['shed_rate'] = round(stats['shed'] / offered, 4) if offered else None
+    stats['max_concurrency'] = TRACKING_MAX_CONCURRENCY
+    # Counters are per worker process
+    stats['pid'] = os.getpid()
+    return jsonify(stats)
+
+LOG_VIEW_MAX_BATCH = int(os.getenv('LOG_VIEW_MAX_BATCH', '200'))
+
+def spool_view_events(events):
+    return [spool_view_event(event) for event in events]
+
 @app.route('/log-view', methods=['POST'])
 def log_view():
     conn = None
+    tracking_slot = None
     try:
-        data = request.get_json()
+        # sendBeacon posts text/plain, so don't insist on a JSON content type
+        data = request.get_json(force=True, silent=True)
         print("\n=== Received Data ===")
         print(f"Raw data: {data}")
         
@@ -841,193 +2971,78 @@ def log_view():
             print("No data received in request")
             return jsonify({"message": "No data received"}), 400
 
-        viewing_session_id = data.get('viewing_session_id')
-        pdf_id = data.get('pdf_id')
-        page = data.get('page')
-        duration = data.get('duration', 0)
-        scroll_depth = data.get('scroll_depth', 0)  # Default to 0 if None
-        zoom_level = data.get('zoom_level', 1.0)
-        time_to_first_view = data.get('time_to_first_view', 0)
-        is_complete = data.get('is_complete', False)
-        update_duration = data.get('update_duration', False)
-
-        # Ensure scroll_depth is not None
-        if scroll_depth is None:
-            scroll_depth = 0
-
-        # Get client information
-        user_agent = request.headers.get('User-Agent', '')
-        ip_address = request.remote_addr
-
-        print("\n=== Parsed Data ===")
-        print(f"Session ID: {viewing_session_id}")
-        print(f"PDF ID: {pdf_id}")
-        print(f"Page: {page}")
-        print(f"Duration: {duration}")
-        print(f"Scroll Depth: {scroll_depth}")
-        print(f"Zoom Level: {zoom_level}")
-        print(f"Time to First View: {time_to_first_view}")
-        print(f"Is Complete: {is_complete}")
-        print(f"Update Duration: {update_duration}")
-        print(f"User Agent: {user_agent}")
-        print(f"IP Address: {ip_address}")
-        print("===================\n")
-
-        # Validate required fields
-        if not viewing_session_id or not pdf_id or page is None:
-            print("Missing required fields")
+        # The viewer sends batches as {"events": [...]}; a bare event is a batch of one
+        is_batch = isinstance(data, dict) and 'events' in data
+        raw_events = data['events'] if is_batch else [data]
+        if not isinstance(raw_events, list) or not raw_events:
+            return jsonify({"message": "No data received"}), 400
+        if len(raw_events) > LOG_VIEW_MAX_BATCH:
+            return jsonify({"message": f"At most {LOG_VIEW_MAX_BATCH} events per request"}), 413
+
+        events = []
+        for raw_event in raw_events:
+            event, error = parse_view_event(raw_event)
+            if error:
+                print(f"Skipping event: {error}")
+                continue
+            events.append(event)
+        if not events:
             return jsonify({"message": "Missing required fields"}), 400
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        try:
-            # Verify the viewing session exists and get its data
-            cursor.execute("""
-                SELECT id, pdf_id, session_id, total_pages 
-                FROM viewing_sessions 
-                WHERE id = %s
-            """, (viewing_session_id,))
-            session = cursor.fetchone()
-            if not session:
-                print(f"Viewing session not found: {viewing_session_id}")
-                return jsonify({"message": "Viewing session not found"}), 404
-
-            # Use the PDF ID from the session if not provided
-            if not pdf_id:
-                pdf_id = session[1]
-
-            # If this is a completion signal, update session status
-            if is_complete:
-                print("Processing completion signal")
-                # First update the current page view
-                cursor.execute("""
-                    UPDATE page_views 
-                    SET duration = %s,
-                        scroll_depth = GREATEST(scroll_depth, %s),
-                        zoom_level = GREATEST(zoom_level, %s),
-                        end_time = NOW(),
-                        is_complete = TRUE
-                    WHERE session_id = %s AND page_number = %s
-                """, (duration, scroll_depth, zoom_level, viewing_session_id, page))
-                
-                # Then update the session status
-                cursor.execute("""
-                    UPDATE viewing_sessions 
-                    SET status = 'completed',
-                        end_time = NOW(),
-                        last_activity = NOW(),
-                        total_duration = (
-                            SELECT COALESCE(SUM(duration), 0)
-                            FROM page_views
-                            WHERE session_id = %s
-                        ),
-                        total_pages = %s,
-                        unique_pages = (
-                            SELECT COUNT(DISTINCT page_number)
-                            FROM page_views
-                            WHERE session_id = %s
-                        )
-                    WHERE id = %s
-                """, (viewing_session_id, session[3], viewing_session_id, viewing_session_id))
-                
-                conn.commit()
-                print("Session marked as completed")
-                return jsonify({'status': 'success', 'message': 'Session completed'})
+        print(f"Parsed {len(events)} event(s): {events}")
+        print(f"User Agent: {request.headers.get('User-Agent', '')}")
+        print(f"IP Address: {request.remote_addr}")
 
-            # Check if this is a duration update for a revisited page
-            if update_duration:
-                print("Processing duration update")
-                # Update the duration for the existing page view
-                cursor.execute("""
-                    UPDATE page_views 
-                    SET duration = %s,
-                        scroll_depth = GREATEST(scroll_depth, %s),
-                        zoom_level = GREATEST(zoom_level, %s),
-                        end_time = NOW()
-                    WHERE session_id = %s AND page_number = %s
-                """, (duration, scroll_depth, zoom_level, viewing_session_id, page))
-                
-                # Update session total duration
-                cursor.execute("""
-                    UPDATE viewing_sessions 
-                    SET total_duration = (
-                        SELECT COALESCE(SUM(duration), 0)
-                        FROM page_views
-                        WHERE session_id = %s
-                    ),
-                    last_activity = NOW()
-                    WHERE id = %s
-                """, (viewing_session_id, viewing_session_id))
-                
-                conn.commit()
-                print("Duration updated successfully")
-                return jsonify({'status': 'success', 'message': 'Duration updated'})
+        has_completion = any(event['kind'] == 'complete' for event in events)
+        tracking_slot = admit_tracking_request('complete' if has_completion else 'duration')
+        if not tracking_slot:
+            if not has_completion:
+                return shed_response()
+            # Completions are never dropped; keep them for the replayer
+            try:
+                event_keys = spool_view_events(events)
+            except OSError as e:
+                print(f"Could not spool shed completion event: {str(e)}")
+                return shed_response(status=503)
+            with tracking_stats_lock:
+                tracking_stats['spooled_on_shed'] += 1
+            return jsonify({'status': 'success', 'spooled': True, 'event_keys': event_keys,
+                            'message': 'Page view queued'}), 202
 
-            # For new page views, check if this page has been viewed in this session
-            print("Processing new page view")
-            cursor.execute("""
-                SELECT COUNT(*) 
-                FROM page_views 
-                WHERE session_id = %s AND page_number = %s
-            """, (viewing_session_id, page))
-            page_count = cursor.fetchone()[0]
-            is_new_page = page_count == 0
-
-            if is_new_page:
-                print("Inserting new page view")
-                # Get the original filename from the PDF
-                cursor.execute("SELECT original_filename, total_pages FROM pdfs WHERE id = %s", (pdf_id,))
-                pdf = cursor.fetchone()
-                if not pdf:
-                    return jsonify({"message": "PDF not found"}), 404
-
-                # Insert new page view
-                cursor.execute("""
-                    INSERT INTO page_views (
-                        session_id, pdf_id, page_number, duration, 
-                        scroll_depth, zoom_level, time_to_first_view, is_complete,
-                        start_time, end_time, original_filename
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW(), %s)
-                """, (
-                    viewing_session_id, pdf_id, page, duration, 
-                    scroll_depth, zoom_level, time_to_first_view, is_complete,
-                    pdf[0]  # original_filename
-                ))
-
-                # Update session statistics
-                cursor.execute("""
-                    UPDATE viewing_sessions 
-                    SET total_duration = (
-                        SELECT COALESCE(SUM(duration), 0)
-                        FROM page_views
-                        WHERE session_id = %s
-                    ),
-                    total_pages = %s,
-                    unique_pages = (
-                        SELECT COUNT(DISTINCT page_number)
-                        FROM page_views
-                        WHERE session_id = %s
-                    ),
-                    last_activity = NOW()
-                    WHERE id = %s
-                """, (viewing_session_id, pdf[1], viewing_session_id, viewing_session_id))
-                
-                conn.commit()
-                print("New page view logged successfully")
+        try:
+            conn = get_ingest_db_connection()
+            cursor = conn.cursor()
+            results = [ingest_view_event(cursor, event) for event in events]
+            conn.commit()
 
+            if not is_batch:
+                body, status = results[0]
+                return jsonify(body), status
+            statuses = [status for _, status in results]
             return jsonify({
                 'status': 'success',
-                'is_new_page': is_new_page,
-                'message': 'Page view logged successfully'
-            })
+                'accepted': sum(1 for status in statuses if status < 400),
+                'results': statuses,
+                'message': 'Page views logged'
+            }), 202 if INGEST_MODE == 'events' else 200
 
         except mysql.connector.Error as e:
-            conn.rollback()
-            print(f"Database error in log_view: {str(e)}")
-            return jsonify({'status': 'error', 'message': f'Database error: {str(e)}'}), 500
+            if conn:
+                try:
+                    conn.rollback()
+                except mysql.connector.Error:
+                    pass
+            if not is_transient_db_error(e):
+                print(f"Database error in log_view: {str(e)}")
+                return jsonify({'status': 'error', 'message': f'Database error: {str(e)}'}), 500
+            # Keep the events locally rather than failing the reader's request
+            print(f"Database error in log_view, spooling {len(events)} event(s): {str(e)}")
+            event_keys = spool_view_events(events)
+            return jsonify({'status': 'success', 'spooled': True, 'event_keys': event_keys,
+                            'message': 'Page view queued'}), 202
         except Exception as e:
-            conn.rollback()
+            if conn:
+                conn.rollback()
             print(f"Unexpected error in log_view: {str(e)}")
             return jsonify({'status': 'error', 'message': f'Unexpected error: {str(e)}'}), 500
 
@@ -1037,13 +3052,66 @@ def log_view():
     finally:
         if conn:
             conn.close()
+        if tracking_slot:
+            release_tracking_request(tracking_slot)
 
 # Get sessions for a PDF
+# viewing_sessions and page_views can be partitioned by month on start_time
+# (see partitions.py), so date filters go on start_time itself and MySQL skips
+# the months outside the range. Page views never start before their session,
+# but sessions are stamped in IST and page views by the database clock, so the
+# page view bound gets a day of slack.
+PAGE_VIEW_START_SLACK = datetime.timedelta(days=1)
+
+def parse_report_date(value, field):
+    if not value:
+        return None
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a YYYY-MM-DD date")
+
+def session_date_filter(start, end, sessions='vs', page_views=None):
+    """SQL (" AND ...") and params for sessions started in [start, end], end inclusive"""
+    sql = ""
+    params = []
+    if start:
+        sql += f" AND {sessions}.start_time >= %s"
+        params.append(start)
+        if page_views:
+            sql += f" AND {page_views}.start_time >= %s"
+            params.append(start - PAGE_VIEW_START_SLACK)
+    if end:
+        sql += f" AND {sessions}.start_time < %s"
+        params.append(end + datetime.timedelta(days=1))
+    return sql, params
+
+# Most points a dashboard chart series gets; longer documents are bucketed
+DASHBOARD_MAX_POINTS = int(os.getenv('DASHBOARD_MAX_POINTS', '200'))
+
+def bucket_page_durations(page_durations, bucket):
+    """Sum per-page durations over runs of `bucket` pages, keyed by each run's first page."""
+    if bucket <= 1:
+        return page_durations
+    buckets = {}
+    for page_num, duration in page_durations.items():
+        start = (page_num - 1) // bucket * bucket + 1
+        buckets[start] = buckets.get(start, 0) + duration
+    return buckets
+
 @app.route('/get-sessions/<unique_url>')
 def get_sessions(unique_url):
     if not session.get("admin_logged_in"):
         return jsonify({"message": "Unauthorized"}), 401
 
+    try:
+        start = parse_report_date(request.args.get('start'), 'start')
+        end = parse_report_date(request.args.get('end'), 'end')
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    session_filter, session_params = session_date_filter(start, end)
+    view_filter, view_params = session_date_filter(start, end, page_views='pv')
+
     conn = None
     try:
         print(f"\n=== Starting get_sessions for URL: {unique_url} ===")
@@ -1062,38 +3130,47 @@ def get_sessions(unique_url):
         print(f"Found PDF with ID: {pdf_id}")
         
         # Get all sessions
-        cursor.execute("""
-            SELECT * FROM viewing_sessions 
-            WHERE pdf_id = %s AND is_admin = FALSE
-            ORDER BY start_time DESC
-        """, [pdf_id])
+        cursor.execute(f"""
+            SELECT vs.id, vs.session_id, vs.start_time, vs.total_duration, vs.total_pages,
+                   vs.unique_pages, vs.status, vs.email,
+                   br.name as browser, dt.name as device_type, os.name as operating_system
+            FROM viewing_sessions vs{SESSION_DICTIONARY_JOINS}
+            WHERE vs.pdf_id = %s AND vs.is_admin = FALSE{session_filter}
+            ORDER BY vs.start_time DESC
+        """, [pdf_id] + session_params)
         
         sessions = cursor.fetchall()
         print(f"Found {len(sessions)} sessions")
         
-        # Now get page views for each session
+        # Page views for all of them in one query rather than one per session
+        cursor.execute(f"""
+            SELECT pv.session_id, pv.page_number, pv.duration
+            FROM page_views pv
+            JOIN viewing_sessions vs ON vs.id = pv.session_id
+            WHERE vs.pdf_id = %s AND vs.is_admin = FALSE{view_filter}
+        """, [pdf_id] + view_params)
+        
+        page_durations_by_session = {}
+        max_page = 0
+        for pv in cursor.fetchall():
+            page_num = int(pv['page_number'])
+            page_durations_by_session.setdefault(pv['session_id'], {})[page_num] = float(pv['duration'] or 0)
+            max_page = max(max_page, page_num)
+        
+        # Long documents are charted in buckets of consecutive pages, the same
+        # bucket size for every session so the series line up
+        max_points = request.args.get('max_points', DASHBOARD_MAX_POINTS, type=int)
+        page_bucket = -(-max_page // max_points) if max_points and max_points > 0 else 1
+        page_bucket = max(page_bucket, 1)
+        
         formatted_sessions = []
         for session_data in sessions:
             try:
-                session_id = session_data['id']
-                cursor.execute("""
-                    SELECT page_number, duration 
-                    FROM page_views 
-                    WHERE session_id = %s
-                """, [session_id])
-                
-                page_views = cursor.fetchall()
-                
-                # Convert to page durations dictionary
-                page_durations = {}
-                for pv in page_views:
-                    page_num = int(pv['page_number'])
-                    duration = float(pv['duration'] or 0)
-                    page_durations[page_num] = duration
+                page_durations = page_durations_by_session.get(session_data['id'], {})
                 
                 # Format the session data
                 formatted_session = {
-                    'session_id': session_data['session_id'],
+                    'session_id': session_uuid_str(session_data['session_id']),
                     'start_time': session_data['start_time'].strftime('%Y-%m-%d %H:%M:%S'),
                     'duration': float(session_data['total_duration'] or 0),
                     'total_pages': int(session_data['total_pages'] or 0),
@@ -1103,12 +3180,14 @@ def get_sessions(unique_url):
                     'device_type': session_data['device_type'] or 'Unknown',
                     'operating_system': session_data['operating_system'] or 'Unknown',
                     'email': session_data['email'] or 'Not provided',
-                    'page_durations': page_durations
+                    'pages_viewed': len(page_durations),
+                    'page_bucket': page_bucket,
+                    'page_durations': bucket_page_durations(page_durations, page_bucket)
                 }
                 formatted_sessions.append(formatted_session)
                 
             except Exception as e:
-                print(f"Error processing session {session_data.get('session_id', 'unknown')}: {str(e)}")
+                print(f"Error processing session {session_data.get('id', 'unknown')}: {str(e)}")
                 import traceback
                 print(f"Traceback: {traceback.format_exc()}")
                 continue
@@ -1136,30 +3215,30 @@ def get_session_details(user_session):
         cursor = conn.cursor(dictionary=True)
         
         # Get all views for this session with proper time formatting
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT 
                 pv.page_number,
                 pv.duration,
-                pv.scroll_depth,
-                pv.zoom_level,
+                pv.scroll_depth / 1e4 as scroll_depth,
+                pv.zoom_level / 1e2 as zoom_level,
                 pv.is_complete,
                 p.original_filename,
                 p.unique_url,
                 p.total_pages,
                 um.public_url,
                 vs.total_duration as session_duration,
-                vs.browser,
-                vs.device_type,
-                vs.operating_system,
+                br.name as browser,
+                dt.name as device_type,
+                os.name as operating_system,
                 DATE_FORMAT(CONVERT_TZ(pv.start_time, 'UTC', 'Asia/Kolkata'), '%Y-%m-%d %H:%i:%s') as formatted_start_time,
                 DATE_FORMAT(CONVERT_TZ(pv.end_time, 'UTC', 'Asia/Kolkata'), '%Y-%m-%d %H:%i:%s') as formatted_end_time
             FROM page_views pv
             JOIN viewing_sessions vs ON pv.session_id = vs.id
             JOIN pdfs p ON vs.pdf_id = p.id
-            LEFT JOIN url_mappings um ON p.unique_url = um.original_url
+            LEFT JOIN url_mappings um ON p.unique_url = um.original_url{SESSION_DICTIONARY_JOINS}
             WHERE vs.session_id = %s AND vs.is_admin = FALSE
             ORDER BY pv.start_time ASC
-        """, (user_session,))
+        """, (session_uuid_bytes(user_session),))
         views = cursor.fetchall()
         
         # Format the data for the graph
@@ -1230,7 +3309,7 @@ def admin_dashboard():
                 FROM pdfs p
                 LEFT JOIN viewing_sessions vs ON p.id = vs.pdf_id AND vs.is_admin = FALSE
                 LEFT JOIN page_views pv ON vs.id = pv.session_id
-                WHERE p.permanent_delete = FALSE OR p.permanent_delete IS NULL
+                WHERE p.permanent_delete = FALSE
                 GROUP BY 
                     p.id, 
                     p.original_filename, 
@@ -1332,7 +3411,7 @@ def delete_pdf(unique_url):
         cursor = conn.cursor(dictionary=True)
         
         # First get the filename and verify the PDF exists
-        cursor.execute("SELECT filename, original_filename FROM pdfs WHERE unique_url = %s", (unique_url,))
+        cursor.execute("SELECT filename, original_filename, linearized_filename FROM pdfs WHERE unique_url = %s", (unique_url,))
         pdf = cursor.fetchone()
         
         if not pdf:
@@ -1356,6 +3435,11 @@ def delete_pdf(unique_url):
             """, (unique_url,))
             
             conn.commit()
+            purge_page_cache(unique_url)
+            invalidate_hot_file(os.path.join(ADMIN_PDF_FOLDER, pdf['filename']),
+                                os.path.join(USER_PDF_FOLDER, pdf['filename']))
+            if pdf.get('linearized_filename'):
+                invalidate_hot_file(os.path.join(USER_PDF_FOLDER, pdf['linearized_filename']))
             print(f"Successfully marked PDF as permanently deleted: {pdf['original_filename']}")
         except Exception as e:
             print(f"Error updating database: {str(e)}")
@@ -1379,20 +3463,66 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,Range')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
-    response.headers.add('Access-Control-Expose-Headers', 'Content-Range,Content-Length,Content-Type')
+    response.headers.add('Access-Control-Expose-Headers', 'Accept-Ranges,Content-Range,Content-Length,Content-Type,ETag,X-Total-Pages')
     
-    # Add cache control headers
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
+    # Dynamic responses must not be cached; file responses (PDFs, static assets)
+    # set their own max-age and are left alone
+    if not response.cache_control.max_age:
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
+        response.headers['Pragma'] = 'no-cache'
+        response.headers['Expires'] = '0'
     
     return response
 
+# Compress text responses (JSON, HTML) when the client accepts it. PDFs are
+# left alone: they're already compressed and served with byte ranges.
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', '6'))
+# Quality 5 is about as fast as gzip -6 with a better ratio
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', '5'))
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/html', 'text/css', 'text/plain',
+                          'text/javascript', 'application/javascript'}
+
+@app.after_request
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code >= 300
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        encoding = 'br'
+    elif accepted['gzip']:
+        encoding = 'gzip'
+    else:
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
 @app.route('/get-pdf-analytics/<unique_url>')
 def get_pdf_analytics(unique_url):
     if not session.get("admin_logged_in"):
         return jsonify({"message": "Unauthorized"}), 401
 
+    try:
+        start = parse_report_date(request.args.get('start'), 'start')
+        end = parse_report_date(request.args.get('end'), 'end')
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    session_filter, session_params = session_date_filter(start, end)
+
     conn = None
     try:
         conn = get_db_connection()
@@ -1410,7 +3540,7 @@ def get_pdf_analytics(unique_url):
             return jsonify({"message": "PDF not found"}), 404
             
         # Get sessions first
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT 
                 vs.id as session_id,
                 vs.session_id as unique_session_id,
@@ -1420,69 +3550,50 @@ def get_pdf_analytics(unique_url):
                 COALESCE(vs.total_pages, 0) as total_pages,
                 COALESCE(vs.unique_pages, 0) as unique_pages,
                 COALESCE(vs.status, 'unknown') as status,
-                COALESCE(vs.browser, 'Unknown') as browser,
-                COALESCE(vs.device_type, 'Unknown') as device_type,
-                COALESCE(vs.operating_system, 'Unknown') as operating_system,
+                COALESCE(br.name, 'Unknown') as browser,
+                COALESCE(dt.name, 'Unknown') as device_type,
+                COALESCE(os.name, 'Unknown') as operating_system,
                 DATE_FORMAT(CONVERT_TZ(vs.start_time, 'UTC', 'Asia/Kolkata'), '%Y-%m-%d %H:%i:%s') as formatted_start_time,
                 DATE_FORMAT(CONVERT_TZ(vs.end_time, 'UTC', 'Asia/Kolkata'), '%Y-%m-%d %H:%i:%s') as formatted_end_time
-            FROM viewing_sessions vs
-            WHERE vs.pdf_id = %s AND vs.is_admin = FALSE
+            FROM viewing_sessions vs{SESSION_DICTIONARY_JOINS}
+            WHERE vs.pdf_id = %s AND vs.is_admin = FALSE{session_filter}
             ORDER BY vs.start_time DESC
-        """, (pdf['id'],))
+        """, [pdf['id']] + session_params)
         sessions = cursor.fetchall()
         
-        # Convert datetime objects to strings for JSON serialization
-        for session in sessions:
-            if isinstance(session['start_time'], datetime.datetime):
-                session['start_time'] = session['start_time'].strftime('%Y-%m-%d %H:%M:%S')
-            if isinstance(session['end_time'], datetime.datetime):
-                session['end_time'] = session['end_time'].strftime('%Y-%m-%d %H:%M:%S')
-            
-            # Ensure numeric values are properly formatted
-            session['total_duration'] = float(session['total_duration'] or 0)
-            session['total_pages'] = int(session['total_pages'] or 0)
-            session['unique_pages'] = int(session['unique_pages'] or 0)
-        
         # For each session, get its page analytics
-        for session in sessions:
+        for viewing_session in sessions:
+            viewing_session['unique_session_id'] = session_uuid_str(viewing_session['unique_session_id'])
             cursor.execute("""
                 SELECT 
                     pv.page_number,
                     COALESCE(pv.duration, 0) as duration,
-                    COALESCE(pv.scroll_depth, 0) as scroll_depth,
-                    COALESCE(pv.zoom_level, 1.0) as zoom_level,
+                    pv.scroll_depth / 1e4 as scroll_depth,
+                    pv.zoom_level / 1e2 as zoom_level,
                     COALESCE(pv.time_to_first_view, 0) as time_to_first_view,
                     pv.is_complete,
                     DATE_FORMAT(CONVERT_TZ(pv.start_time, 'UTC', 'Asia/Kolkata'), '%Y-%m-%d %H:%i:%s') as formatted_start_time,
                     DATE_FORMAT(CONVERT_TZ(pv.end_time, 'UTC', 'Asia/Kolkata'), '%Y-%m-%d %H:%i:%s') as formatted_end_time
                 FROM page_views pv
-                WHERE pv.session_id = %s
+                WHERE pv.session_id = %s AND pv.start_time >= %s
                 ORDER BY pv.page_number
-            """, (session['session_id'],))
+            """, (viewing_session['session_id'], viewing_session['start_time'] - PAGE_VIEW_START_SLACK))
             page_analytics = cursor.fetchall()
-            
-            # Convert decimal values to float for JSON serialization
-            for page in page_analytics:
-                page['duration'] = float(page['duration'] or 0)
-                page['scroll_depth'] = float(page['scroll_depth'] or 0)
-                page['zoom_level'] = float(page['zoom_level'] or 1.0)
-                page['time_to_first_view'] = float(page['time_to_first_view'] or 0)
-            
-            session['page_analytics'] = page_analytics
+            viewing_session['page_analytics'] = page_analytics
             
             # Calculate session statistics
             total_views = len(page_analytics)
-            avg_duration = sum(float(page['duration'] or 0) for page in page_analytics) / total_views if total_views > 0 else 0
-            avg_scroll_depth = sum(float(page['scroll_depth'] or 0) for page in page_analytics) / total_views if total_views > 0 else 0
+            avg_duration = sum(page['duration'] for page in page_analytics) / total_views if total_views > 0 else 0
+            avg_scroll_depth = sum(page['scroll_depth'] for page in page_analytics) / total_views if total_views > 0 else 0
             
-            session['statistics'] = {
+            viewing_session['statistics'] = {
                 'total_views': total_views,
-                'avg_duration': float(avg_duration),
-                'avg_scroll_depth': float(avg_scroll_depth)
+                'avg_duration': avg_duration,
+                'avg_scroll_depth': avg_scroll_depth
             }
         
         # Get time-based analytics
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT 
                 DATE(CONVERT_TZ(vs.start_time, 'UTC', 'Asia/Kolkata')) as date,
                 COUNT(DISTINCT vs.session_id) as sessions,
@@ -1490,36 +3601,26 @@ def get_pdf_analytics(unique_url):
                 COALESCE(AVG(pv.duration), 0) as avg_duration
             FROM viewing_sessions vs
             LEFT JOIN page_views pv ON vs.id = pv.session_id
-            WHERE vs.pdf_id = %s AND vs.is_admin = FALSE
+            WHERE vs.pdf_id = %s AND vs.is_admin = FALSE{session_filter}
             GROUP BY DATE(CONVERT_TZ(vs.start_time, 'UTC', 'Asia/Kolkata'))
             ORDER BY date DESC
             LIMIT 30
-        """, (pdf['id'],))
+        """, [pdf['id']] + session_params)
         time_analytics = cursor.fetchall()
         
-        # Convert date objects and decimal values for JSON serialization
-        for stat in time_analytics:
-            if isinstance(stat['date'], datetime.date):
-                stat['date'] = stat['date'].strftime('%Y-%m-%d')
-            stat['avg_duration'] = float(stat['avg_duration'] or 0)
-        
         # Get device analytics
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT 
-                COALESCE(device_type, 'Unknown') as device_type,
-                COALESCE(browser, 'Unknown') as browser,
-                COALESCE(operating_system, 'Unknown') as operating_system,
+                COALESCE(dt.name, 'Unknown') as device_type,
+                COALESCE(br.name, 'Unknown') as browser,
+                COALESCE(os.name, 'Unknown') as operating_system,
                 COUNT(*) as count
-            FROM viewing_sessions
-            WHERE pdf_id = %s AND is_admin = FALSE
-            GROUP BY device_type, browser, operating_system
-        """, (pdf['id'],))
+            FROM viewing_sessions vs{SESSION_DICTIONARY_JOINS}
+            WHERE vs.pdf_id = %s AND vs.is_admin = FALSE{session_filter}
+            GROUP BY dt.name, br.name, os.name
+        """, [pdf['id']] + session_params)
         device_analytics = cursor.fetchall()
         
-        # Convert count to int for JSON serialization
-        for device in device_analytics:
-            device['count'] = int(device['count'])
-        
         response_data = {
             'pdf_info': pdf,
             'sessions': sessions,
@@ -1538,6 +3639,237 @@ def get_pdf_analytics(unique_url):
         if conn:
             conn.close()
 
+# Metric groups for /batch-analytics. Each group is one GROUP BY query over all
+# requested PDFs, so a report costs the same number of queries for 3 PDFs or 300.
+BATCH_ANALYTICS_METRICS = {'sessions', 'views', 'dwell', 'completion', 'pages', 'devices'}
+BATCH_ANALYTICS_DEFAULT_METRICS = ['sessions', 'views', 'dwell', 'completion']
+BATCH_ANALYTICS_MAX_PDFS = int(os.getenv('BATCH_ANALYTICS_MAX_PDFS', '1000'))
+# rank_by -> (metric group it needs, field of the per-PDF summary)
+BATCH_ANALYTICS_RANKINGS = {
+    'views': ('views', 'views'),
+    'dwell': ('dwell', 'avg_dwell'),
+    'completion_rate': ('completion', 'completion_rate'),
+}
+
+@app.route('/batch-analytics', methods=['POST'])
+def batch_analytics():
+    if not session.get("admin_logged_in"):
+        return jsonify({"message": "Unauthorized"}), 401
+
+    data = request.get_json(silent=True) or {}
+    unique_urls = data.get('pdfs') or []
+    metrics = data.get('metrics') or BATCH_ANALYTICS_DEFAULT_METRICS
+    rank_by = data.get('rank_by', 'views')
+    try:
+        top_n = int(data.get('top_n', 10))
+    except (TypeError, ValueError):
+        return jsonify({"message": "top_n must be an integer"}), 400
+    try:
+        start = parse_report_date(data.get('start'), 'start')
+        end = parse_report_date(data.get('end'), 'end')
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    if not isinstance(unique_urls, list) or not all(isinstance(url, str) for url in unique_urls):
+        return jsonify({"message": "pdfs must be a list of PDF URLs"}), 400
+    if len(unique_urls) > BATCH_ANALYTICS_MAX_PDFS:
+        return jsonify({"message": f"At most {BATCH_ANALYTICS_MAX_PDFS} PDFs per request"}), 400
+    unknown_metrics = set(metrics) - BATCH_ANALYTICS_METRICS if isinstance(metrics, list) else {str(metrics)}
+    if unknown_metrics:
+        return jsonify({"message": f"Unknown metrics: {', '.join(sorted(unknown_metrics))}"}), 400
+    if rank_by not in BATCH_ANALYTICS_RANKINGS:
+        return jsonify({"message": f"rank_by must be one of {', '.join(BATCH_ANALYTICS_RANKINGS)}"}), 400
+    metrics = set(metrics) | {BATCH_ANALYTICS_RANKINGS[rank_by][0]}
+
+    # Sessions started in [start, end]; end is inclusive
+    session_filter, session_params = session_date_filter(start, end)
+    view_filter, view_params = session_date_filter(start, end, page_views='pv')
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+
+        pdf_query = """
+            SELECT id, unique_url, original_filename, total_pages
+            FROM pdfs
+            WHERE permanent_delete = FALSE
+        """
+        if unique_urls:
+            pdf_query += f" AND unique_url IN ({', '.join(['%s'] * len(unique_urls))})"
+        cursor.execute(pdf_query, unique_urls)
+        summaries = {}
+        for pdf in cursor.fetchall():
+            summaries[pdf['id']] = {
+                'unique_url': pdf['unique_url'],
+                'original_filename': pdf['original_filename'],
+                'total_pages': int(pdf['total_pages'] or 0),
+            }
+        found_urls = {summary['unique_url'] for summary in summaries.values()}
+        missing = [url for url in unique_urls if url not in found_urls]
+
+        if summaries:
+            pdf_ids = list(summaries)
+            in_pdfs = f"vs.pdf_id IN ({', '.join(['%s'] * len(pdf_ids))})"
+
+            if metrics & {'sessions', 'dwell', 'completion'}:
+                cursor.execute(f"""
+                    SELECT vs.pdf_id,
+                           COUNT(*) as sessions,
+                           COUNT(DISTINCT vs.email) as unique_viewers,
+                           COALESCE(SUM(vs.total_duration), 0) as total_duration,
+                           SUM(vs.status = 'completed') as completed_sessions
+                    FROM viewing_sessions vs
+                    WHERE {in_pdfs} AND vs.is_admin = FALSE{session_filter}
+                    GROUP BY vs.pdf_id
+                """, pdf_ids + session_params)
+                session_rows = {row['pdf_id']: row for row in cursor.fetchall()}
+                for pdf_id, summary in summaries.items():
+                    row = session_rows.get(pdf_id, {})
+                    sessions = int(row.get('sessions') or 0)
+                    total_duration = float(row.get('total_duration') or 0)
+                    completed = int(row.get('completed_sessions') or 0)
+                    if 'sessions' in metrics:
+                        summary['sessions'] = sessions
+                        summary['unique_viewers'] = int(row.get('unique_viewers') or 0)
+                    if 'dwell' in metrics:
+                        summary['total_duration'] = total_duration
+                        summary['avg_dwell'] = total_duration / sessions if sessions else 0.0
+                    if 'completion' in metrics:
+                        summary['completed_sessions'] = completed
+                        summary['completion_rate'] = completed / sessions if sessions else 0.0
+
+            if 'views' in metrics:
+                cursor.execute(f"""
+                    SELECT vs.pdf_id,
+                           COUNT(*) as views,
+                           COUNT(DISTINCT pv.page_number) as pages_viewed,
+                           COALESCE(AVG(pv.duration), 0) as avg_view_duration,
+                           COALESCE(AVG(pv.scroll_depth) / 1e4, 0) as avg_scroll_depth
+                    FROM page_views pv
+                    JOIN viewing_sessions vs ON vs.id = pv.session_id
+                    WHERE {in_pdfs} AND vs.is_admin = FALSE{view_filter}
+                    GROUP BY vs.pdf_id
+                """, pdf_ids + view_params)
+                view_rows = {row['pdf_id']: row for row in cursor.fetchall()}
+                for pdf_id, summary in summaries.items():
+                    row = view_rows.get(pdf_id, {})
+                    summary['views'] = int(row.get('views') or 0)
+                    summary['pages_viewed'] = int(row.get('pages_viewed') or 0)
+                    summary['avg_view_duration'] = float(row.get('avg_view_duration') or 0)
+                    summary['avg_scroll_depth'] = float(row.get('avg_scroll_depth') or 0)
+
+            if 'pages' in metrics:
+                cursor.execute(f"""
+                    SELECT vs.pdf_id, pv.page_number,
+                           COUNT(*) as views,
+                           COALESCE(AVG(pv.duration), 0) as avg_duration
+                    FROM page_views pv
+                    JOIN viewing_sessions vs ON vs.id = pv.session_id
+                    WHERE {in_pdfs} AND vs.is_admin = FALSE{view_filter}
+                    GROUP BY vs.pdf_id, pv.page_number
+                    ORDER BY vs.pdf_id, pv.page_number
+                """, pdf_ids + view_params)
+                for summary in summaries.values():
+                    summary['pages'] = []
+                for row in cursor.fetchall():
+                    summaries[row['pdf_id']]['pages'].append({
+                        'page_number': row['page_number'],
+                        'views': int(row['views']),
+                        'avg_duration': float(row['avg_duration']),
+                    })
+
+            if 'devices' in metrics:
+                cursor.execute(f"""
+                    SELECT vs.pdf_id, COALESCE(dt.name, 'Unknown') as device_type, COUNT(*) as count
+                    FROM viewing_sessions vs
+                    LEFT JOIN device_types dt ON dt.id = vs.device_type_id
+                    WHERE {in_pdfs} AND vs.is_admin = FALSE{session_filter}
+                    GROUP BY vs.pdf_id, dt.name
+                """, pdf_ids + session_params)
+                for summary in summaries.values():
+                    summary['devices'] = {}
+                for row in cursor.fetchall():
+                    summaries[row['pdf_id']]['devices'][row['device_type']] = int(row['count'])
+
+        # Top N over the per-PDF aggregates; ties go to the earlier PDF
+        rank_field = BATCH_ANALYTICS_RANKINGS[rank_by][1]
+        ranked = heapq.nlargest(max(top_n, 0), summaries.values(), key=lambda summary: summary[rank_field])
+        top = [{
+            'rank': position + 1,
+            'unique_url': summary['unique_url'],
+            'original_filename': summary['original_filename'],
+            rank_field: summary[rank_field],
+        } for position, summary in enumerate(ranked)]
+
+        return jsonify({
+            'start': data.get('start'),
+            'end': data.get('end'),
+            'rank_by': rank_by,
+            'pdfs': list(summaries.values()),
+            'top': top,
+            'missing': missing,
+        })
+
+    except Exception as e:
+        print(f"Error in batch_analytics: {str(e)}")
+        import traceback
+        print(f"Traceback: {traceback.format_exc()}")
+        return jsonify({"message": "Internal server error", "error": str(e)}), 500
+    finally:
+        if conn:
+            conn.close()
+
+@app.route('/viewer-activity/<path:email>')
+def viewer_activity(email):
+    if not session.get("admin_logged_in"):
+        return jsonify({"message": "Unauthorized"}), 401
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+
+        # Two primary/unique key lookups, however many sessions exist
+        cursor.execute("""
+            SELECT id, email, first_seen, last_seen
+            FROM viewers
+            WHERE email_hash = SHA2(LOWER(TRIM(%s)), 256)
+        """, (email,))
+        viewer = cursor.fetchone()
+        if not viewer:
+            return jsonify({"message": "Viewer not found"}), 404
+
+        cursor.execute("""
+            SELECT p.unique_url, p.original_filename, p.total_pages,
+                   a.sessions, a.completed_sessions, a.total_duration, a.max_unique_pages,
+                   a.first_seen, a.last_seen
+            FROM viewer_pdf_activity a
+            JOIN pdfs p ON p.id = a.pdf_id
+            WHERE a.viewer_id = %s
+              AND p.permanent_delete = FALSE
+            ORDER BY a.last_seen DESC
+        """, (viewer['id'],))
+        documents = cursor.fetchall()
+
+        return jsonify({
+            'email': viewer['email'],
+            'first_seen': viewer['first_seen'],
+            'last_seen': viewer['last_seen'],
+            'last_activity': max((doc['last_seen'] for doc in documents), default=viewer['last_seen']),
+            'total_duration': sum(doc['total_duration'] for doc in documents),
+            'documents': documents,
+        })
+
+    except Exception as e:
+        print(f"Error in viewer_activity: {str(e)}")
+        import traceback
+        print(f"Traceback: {traceback.format_exc()}")
+        return jsonify({"message": "Internal server error", "error": str(e)}), 500
+    finally:
+        if conn:
+            conn.close()
+
 @app.route('/get-session-analytics/<unique_url>')
 def get_session_analytics(unique_url):
     if not session.get("admin_logged_in"):
@@ -1555,25 +3887,22 @@ def get_session_analytics(unique_url):
         if not pdf:
             return jsonify({"message": "PDF not found"}), 404
         
-        # Get all sessions for this PDF with proper end time calculation
-        cursor.execute("""
+        # Closed sessions have end_time set (abandoned ones by the session reaper);
+        # active ones fall back to their last activity
+        cursor.execute(f"""
             SELECT 
                 vs.id,
                 vs.session_id,
                 vs.start_time,
-                COALESCE(vs.end_time, 
-                    (SELECT MAX(pv.end_time) 
-                     FROM page_views pv 
-                     WHERE pv.session_id = vs.id)
-                ) as end_time,
+                COALESCE(vs.end_time, vs.last_activity) as end_time,
                 vs.total_duration,
                 vs.total_pages,
                 vs.unique_pages,
-                vs.browser,
-                vs.device_type,
-                vs.operating_system,
+                br.name as browser,
+                dt.name as device_type,
+                os.name as operating_system,
                 vs.email
-            FROM viewing_sessions vs
+            FROM viewing_sessions vs{SESSION_DICTIONARY_JOINS}
             WHERE vs.pdf_id = %s AND vs.is_admin = FALSE
             ORDER BY vs.start_time DESC
         """, (pdf['id'],))
@@ -1585,18 +3914,14 @@ def get_session_analytics(unique_url):
                 SELECT 
                     page_number,
                     duration,
-                    zoom_level,
+                    zoom_level / 1e2 as zoom_level,
                     time_to_first_view,
                     start_time,
-                    COALESCE(end_time, 
-                        (SELECT MAX(end_time) 
-                         FROM page_views 
-                         WHERE session_id = %s AND page_number = page_views.page_number)
-                    ) as end_time
+                    end_time
                 FROM page_views 
                 WHERE session_id = %s 
                 ORDER BY page_number
-            """, (session_data['id'], session_data['id']))
+            """, (session_data['id'],))
             
             page_views = []
             for view in cursor.fetchall():
@@ -1614,7 +3939,7 @@ def get_session_analytics(unique_url):
             avg_duration = sum(v['duration'] for v in page_views) / len(page_views) if page_views else 0
             
             sessions.append({
-                'session_id': session_data['session_id'],
+                'session_id': session_uuid_str(session_data['session_id']),
                 'start_time': session_data['start_time'].strftime('%Y-%m-%d %H:%M:%S') if session_data['start_time'] else None,
                 'end_time': session_data['end_time'].strftime('%Y-%m-%d %H:%M:%S') if session_data['end_time'] else None,
                 'total_duration': total_duration,
@@ -1645,7 +3970,7 @@ def get_session_analytics(unique_url):
 @app.route('/update-session-end', methods=['POST'])
 def update_session_end():
     try:
-        session_id = session.get('session_id')
+        session_id = session_uuid_bytes(session.get('session_id'))
         if session_id:
             conn = get_db_connection()
             cursor = conn.cursor()
@@ -1663,6 +3988,11 @@ def update_session_end():
 
 if __name__ == "__main__":
     init_db()
+    # Pick up upload jobs left unfinished by a previous run
+    requeued = requeue_stale_upload_jobs()
+    if requeued:
+        print(f"Requeued {requeued} unfinished upload job(s)")
+    start_background_tasks()
     try:
         # Get the server's IP address
         import socket
@@ -0,0 +1,164 @@
+"""Measure row size, table size and InnoDB buffer-pool behaviour of the event tables.
+
+Usage: python storage_report.py [--analyze] [--interval SECONDS] [--buffer-pages]
+                                [--save FILE] [--compare FILE]
+
+Meant for before/after comparisons of a schema change such as migration 12
+(compact_event_tables): run with --save before.json, migrate, then run again under
+similar traffic with --compare before.json.
+
+Sizes come from information_schema.TABLES, which InnoDB estimates; --analyze runs
+ANALYZE TABLE first so they are current. The buffer-pool hit rate is measured over
+--interval seconds of live traffic (1 - disk reads / read requests). --buffer-pages
+also counts each table's pages resident in the buffer pool, which scans the whole
+pool and is best left for a quiet moment.
+"""
+import argparse
+import json
+import time
+
+TABLES = ['page_views', 'viewing_sessions', 'user_agents', 'browsers',
+          'operating_systems', 'device_types']
+
+
+def existing_tables(cursor):
+    cursor.execute("""
+        SELECT TABLE_NAME FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({})
+    """.format(', '.join(['%s'] * len(TABLES))), TABLES)
+    found = {row[0] for row in cursor.fetchall()}
+    return [name for name in TABLES if name in found]
+
+
+def table_sizes(cursor, tables):
+    """table -> rows, avg_row_bytes, data_bytes, index_bytes"""
+    cursor.execute("""
+        SELECT TABLE_NAME, TABLE_ROWS, AVG_ROW_LENGTH, DATA_LENGTH, INDEX_LENGTH
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({})
+    """.format(', '.join(['%s'] * len(tables))), tables)
+    return {name: {'rows': int(rows or 0), 'avg_row_bytes': int(avg_row or 0),
+                   'data_bytes': int(data or 0), 'index_bytes': int(index or 0)}
+            for name, rows, avg_row, data, index in cursor.fetchall()}
+
+
+def buffer_pool_counters(cursor):
+    cursor.execute("SHOW GLOBAL STATUS LIKE 'Innodb_buffer_pool_read%'")
+    return {name: int(value) for name, value in cursor.fetchall()
+            if name in ('Innodb_buffer_pool_read_requests', 'Innodb_buffer_pool_reads')}
+
+
+def buffer_pool_hit_rate(cursor, interval):
+    """Hit rate over the next interval seconds (since server start if interval is 0)"""
+    before = buffer_pool_counters(cursor) if interval > 0 else {
+        'Innodb_buffer_pool_read_requests': 0, 'Innodb_buffer_pool_reads': 0}
+    if interval > 0:
+        time.sleep(interval)
+    after = buffer_pool_counters(cursor)
+    requests = after['Innodb_buffer_pool_read_requests'] - before['Innodb_buffer_pool_read_requests']
+    reads = after['Innodb_buffer_pool_reads'] - before['Innodb_buffer_pool_reads']
+    return {'read_requests': requests, 'disk_reads': reads,
+            'hit_rate': 1 - reads / requests if requests else None}
+
+
+def buffer_pool_pages(cursor, tables):
+    """table -> pages and bytes of it currently in the buffer pool (partitions included)"""
+    cursor.execute("SELECT DATABASE()")
+    schema = cursor.fetchone()[0]
+    cursor.execute("""
+        SELECT TABLE_NAME, COUNT(*), COALESCE(SUM(DATA_SIZE), 0)
+        FROM information_schema.INNODB_BUFFER_PAGE
+        WHERE TABLE_NAME LIKE %s
+        GROUP BY TABLE_NAME
+    """, (f"`{schema}`.%",))
+    resident = {name: {'pages': 0, 'bytes': 0} for name in tables}
+    for name, pages, size in cursor.fetchall():
+        # `schema`.`table`, with a partition suffix on partitioned tables
+        table = name.split('.', 1)[1].split('`')[1]
+        if table in resident:
+            resident[table]['pages'] += int(pages)
+            resident[table]['bytes'] += int(size)
+    return resident
+
+
+def collect(conn, analyze, interval, buffer_pages):
+    cursor = conn.cursor(buffered=True)
+    try:
+        tables = existing_tables(cursor)
+        if analyze:
+            for table in tables:
+                cursor.execute(f"ANALYZE TABLE {table}")
+                cursor.fetchall()
+        report = {'measured_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                  'tables': table_sizes(cursor, tables),
+                  'buffer_pool': buffer_pool_hit_rate(cursor, interval)}
+        report['buffer_pool']['interval'] = interval
+        if buffer_pages:
+            report['buffer_pool']['resident'] = buffer_pool_pages(cursor, tables)
+        return report
+    finally:
+        cursor.close()
+
+
+def change(before, after):
+    if not before:
+        return ''
+    return f" ({(after - before) / before * 100:+.1f}%)"
+
+
+def print_report(report, baseline=None):
+    baseline = baseline or {}
+    old_tables = baseline.get('tables', {})
+    print(f"{'table':18} {'rows':>12} {'avg row':>18} {'data MB':>18} {'index MB':>18}")
+    for table, size in report['tables'].items():
+        old = old_tables.get(table, {})
+        avg_row = f"{size['avg_row_bytes']}{change(old.get('avg_row_bytes'), size['avg_row_bytes'])}"
+        data = f"{size['data_bytes'] / 2**20:.1f}{change(old.get('data_bytes'), size['data_bytes'])}"
+        index = f"{size['index_bytes'] / 2**20:.1f}{change(old.get('index_bytes'), size['index_bytes'])}"
+        print(f"{table:18} {size['rows']:>12} {avg_row:>18} {data:>18} {index:>18}")
+
+    pool = report['buffer_pool']
+    window = f"over {pool['interval']}s" if pool['interval'] else "since server start"
+    hit_rate = f"{pool['hit_rate'] * 100:.3f}%" if pool['hit_rate'] is not None else 'n/a (no reads)'
+    old_pool = baseline.get('buffer_pool', {})
+    if old_pool.get('hit_rate') is not None:
+        hit_rate += f" (was {old_pool['hit_rate'] * 100:.3f}%)"
+    print(f"\nBuffer pool hit rate {window}: {hit_rate}, "
+          f"{pool['disk_reads']} disk reads of {pool['read_requests']} requests")
+    for table, resident in pool.get('resident', {}).items():
+        old = old_pool.get('resident', {}).get(table, {})
+        print(f"  {table:18} {resident['pages']:>8} pages in memory"
+              f"{change(old.get('pages'), resident['pages'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--analyze', action='store_true', help="refresh table statistics first")
+    parser.add_argument('--interval', type=int, default=60,
+                        help="seconds to sample the buffer-pool counters (0: since server start)")
+    parser.add_argument('--buffer-pages', action='store_true', help="count resident pages per table")
+    parser.add_argument('--save', help="write the measurements to this JSON file")
+    parser.add_argument('--compare', help="show changes against a file written by --save")
+    args = parser.parse_args()
+
+    from pdftracker import get_db_connection
+    conn = get_db_connection()
+    try:
+        report = collect(conn, args.analyze, args.interval, args.buffer_pages)
+    finally:
+        conn.close()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.compare} ({baseline['measured_at']})\n")
+    print_report(report, baseline)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved to {args.save}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""X-Accel-Redirect responses of the PDF routes, through the Flask test client.
+
+These check what the app hands to nginx (PDF_ACCEL_REDIRECT=on); deployment/
+verify_accel.sh checks a live nginx in front of it.
+"""
+import os
+import uuid
+
+import pytest
+
+import pdftracker
+
+PDF_BYTES = b"%PDF-1.4\n" + b"0" * 4096 + b"\n%%EOF\n"
+
+
+class FakeCursor:
+    def __init__(self, row):
+        self.row = row
+
+    def execute(self, query, params=()):
+        pass
+
+    def fetchone(self):
+        return self.row
+
+
+class FakeConnection:
+    def __init__(self, row):
+        self.row = row
+
+    def cursor(self, **kwargs):
+        return FakeCursor(self.row)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def stored_pdf():
+    filename = f"{uuid.uuid4()}.pdf"
+    path = os.path.join(pdftracker.USER_PDF_FOLDER, filename)
+    with open(path, 'wb') as f:
+        f.write(PDF_BYTES)
+    yield filename
+    os.remove(path)
+
+
+@pytest.fixture
+def client(monkeypatch, stored_pdf):
+    monkeypatch.setattr(pdftracker, 'PDF_ACCEL_REDIRECT', True)
+    row = {'filename': stored_pdf, 'original_filename': 'report.pdf',
+           'permanent_delete': False, 'linearized_filename': None}
+    monkeypatch.setattr(pdftracker, 'get_db_connection', lambda: FakeConnection(row))
+    return pdftracker.app.test_client()
+
+
+def pdf_urls(filename):
+    unique_url = filename[:-len('.pdf')]
+    return [f"/serve-pdf/{filename}",
+            f"/serve-remote-pdf/{unique_url}",
+            f"/serve-online-pdf/{unique_url}"]
+
+
+def test_redirects_to_internal_location(client, stored_pdf):
+    etag = pdftracker.file_etag(os.path.join(pdftracker.USER_PDF_FOLDER, stored_pdf))
+    for url in pdf_urls(stored_pdf):
+        response = client.get(url)
+        assert response.status_code == 200, url
+        assert response.headers['X-Accel-Redirect'] == f"/_protected/pdfs/{stored_pdf}"
+        assert response.data == b''
+        assert response.headers['Content-Length'] == '0'
+        assert response.headers['Content-Type'] == 'application/pdf'
+        assert response.headers['ETag'] == f'"{etag}"'
+        assert 'private' in response.headers['Cache-Control']
+        assert 'X-Sendfile' not in response.headers
+
+
+def test_download_name_kept_for_nginx(client, stored_pdf):
+    for url in pdf_urls(stored_pdf)[1:]:
+        response = client.get(url)
+        assert 'report.pdf' in response.headers['Content-Disposition'], url
+
+
+def test_if_none_match_answered_before_redirect(client, stored_pdf):
+    etag = pdftracker.file_etag(os.path.join(pdftracker.USER_PDF_FOLDER, stored_pdf))
+    for url in pdf_urls(stored_pdf):
+        response = client.get(url, headers={'If-None-Match': f'"{etag}"'})
+        assert response.status_code == 304, url
+        assert 'X-Accel-Redirect' not in response.headers
+        assert response.headers['ETag'] == f'"{etag}"'
+
+        response = client.get(url, headers={'If-None-Match': '"stale"'})
+        assert response.status_code == 200, url
+        assert 'X-Accel-Redirect' in response.headers
+
+
+def test_range_left_to_nginx(client, stored_pdf):
+    for url in pdf_urls(stored_pdf):
+        response = client.get(url, headers={'Range': 'bytes=0-1023'})
+        assert response.status_code == 200, url
+        assert 'X-Accel-Redirect' in response.headers
+        assert 'Content-Range' not in response.headers
+
+
+def test_files_outside_accel_locations_are_sent_directly(client, monkeypatch, stored_pdf):
+    monkeypatch.setattr(pdftracker, 'ACCEL_LOCATIONS', {})
+    response = client.get(pdf_urls(stored_pdf)[0])
+    assert response.status_code == 200
+    assert 'X-Accel-Redirect' not in response.headers
+    assert response.data == PDF_BYTES
@@ -0,0 +1,65 @@
+"""Hot-file cache: PDFs served from the shared mapping."""
+import os
+import uuid
+
+import pytest
+
+import pdftracker
+
+PDF_BYTES = b"%PDF-1.4\n" + bytes(range(256)) * 64 + b"\n%%EOF\n"
+
+
+class RecordingFileWrapper:
+    """Stands in for a server's wsgi.file_wrapper (gunicorn sendfile()s its filelike)"""
+    wrapped = []
+
+    def __init__(self, filelike, block_size=8192):
+        self.filelike = filelike
+        self.block_size = block_size
+        RecordingFileWrapper.wrapped.append(filelike)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.filelike.read(self.block_size)
+        if not data:
+            raise StopIteration
+        return data
+
+
+@pytest.fixture
+def hot_pdf(monkeypatch):
+    monkeypatch.setattr(pdftracker, 'PDF_ACCEL_REDIRECT', False)
+    monkeypatch.setattr(pdftracker, 'HOT_CACHE_MIN_REQUESTS', 1)
+    filename = f"{uuid.uuid4()}.pdf"
+    path = os.path.join(pdftracker.USER_PDF_FOLDER, filename)
+    with open(path, 'wb') as f:
+        f.write(PDF_BYTES)
+    yield filename
+    pdftracker.invalidate_hot_file(path)
+    os.remove(path)
+
+
+def test_full_response_hands_the_mapped_file_to_the_server(hot_pdf):
+    client = pdftracker.app.test_client()
+    RecordingFileWrapper.wrapped.clear()
+    response = client.get(f"/serve-pdf/{hot_pdf}",
+                          environ_base={'wsgi.file_wrapper': RecordingFileWrapper})
+    assert response.status_code == 200
+    assert response.data == PDF_BYTES
+    reader, = RecordingFileWrapper.wrapped
+    assert isinstance(reader, pdftracker.MappedFileReader)
+    # A sendfile() from offset 0 of this descriptor sends the whole file
+    assert os.lseek(reader.fileno(), 0, os.SEEK_CUR) == 0
+    assert os.fstat(reader.fileno()).st_size == len(PDF_BYTES)
+
+
+def test_range_served_from_mapping(hot_pdf):
+    client = pdftracker.app.test_client()
+    client.get(f"/serve-pdf/{hot_pdf}")
+    assert pdftracker.get_hot_file(os.path.join(pdftracker.USER_PDF_FOLDER, hot_pdf))
+    response = client.get(f"/serve-pdf/{hot_pdf}", headers={'Range': 'bytes=100-1123'})
+    assert response.status_code == 206
+    assert response.data == PDF_BYTES[100:1124]
+    assert response.headers['Content-Range'] == f"bytes 100-1123/{len(PDF_BYTES)}"
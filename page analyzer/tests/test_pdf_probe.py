@@ -0,0 +1,315 @@
+"""xref page-count probe: small generated PDFs checked against PyPDF2."""
+import io
+import random
+import zlib
+
+import PyPDF2
+import pytest
+
+from pdf_probe import ProbeError, probe_pdf, probe_page_count
+
+
+def page_tree(count, info=None):
+    """Objects for a catalog (1), a /Pages node (2) and count pages (3..)"""
+    kids = b' '.join(b'%d 0 R' % (3 + i) for i in range(count))
+    objects = {
+        1: b'<< /Type /Catalog /Pages 2 0 R >>',
+        2: b'<< /Type /Pages /Kids [' + kids + b'] /Count %d >>' % count,
+    }
+    for i in range(count):
+        objects[3 + i] = b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>'
+    if info is not None:
+        objects[3 + count] = info
+    return objects
+
+
+def write_objects(out, objects):
+    offsets = {}
+    for num in sorted(objects):
+        offsets[num] = len(out)
+        out += b'%d 0 obj\n' % num + objects[num] + b'\nendobj\n'
+    return offsets
+
+
+def classic_xref(offsets, size, trailer):
+    """An xref table covering 0..size-1, or one subsection per run of offsets if size is None"""
+    table = b'xref\n'
+    numbers = range(size) if size is not None else sorted(offsets)
+    runs = []
+    for num in numbers:
+        if runs and runs[-1][-1] == num - 1:
+            runs[-1].append(num)
+        else:
+            runs.append([num])
+    for run in runs:
+        table += b'%d %d\n' % (run[0], len(run))
+        for num in run:
+            if num not in offsets:
+                table += b'0000000000 65535 f \n'
+            else:
+                table += b'%010d 00000 n \n' % offsets[num]
+    return table + b'trailer\n<< ' + trailer + b' >>\n'
+
+
+def classic_pdf(objects, trailer=b''):
+    out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = write_objects(out, objects)
+    xref_offset = len(out)
+    size = max(objects) + 1
+    out += classic_xref(offsets, size, b'/Size %d /Root 1 0 R ' % size + trailer)
+    out += b'startxref\n%d\n%%%%EOF\n' % xref_offset
+    return bytes(out)
+
+
+def incremental_update(pdf, objects, trailer=b''):
+    """Append a revision that replaces or adds objects, chained through /Prev"""
+    prev = int(pdf[pdf.rindex(b'startxref') + len(b'startxref'):].split()[0])
+    out = bytearray(pdf)
+    offsets = write_objects(out, objects)
+    xref_offset = len(out)
+    size = max(objects) + 1
+    out += classic_xref(offsets, None, b'/Size %d /Root 1 0 R /Prev %d ' % (size, prev) + trailer)
+    out += b'startxref\n%d\n%%%%EOF\n' % xref_offset
+    return bytes(out)
+
+
+def paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    if pb <= pc:
+        return b
+    return c
+
+
+def png_predict(rows, kind):
+    """Encode rows with PNG filter kind at one byte per pixel"""
+    out = bytearray()
+    previous = bytes(len(rows[0]))
+    for row in rows:
+        encoded = bytearray()
+        for i, value in enumerate(row):
+            left = row[i - 1] if i else 0
+            upper_left = previous[i - 1] if i else 0
+            predictor = (0, left, previous[i], (left + previous[i]) >> 1,
+                         paeth(left, previous[i], upper_left))[kind]
+            encoded.append((value - predictor) & 0xFF)
+        out += bytes([kind]) + encoded
+        previous = row
+    return bytes(out)
+
+
+def stream_object(stream_dict, data):
+    return b'<< ' + stream_dict + b' /Length %d >>\nstream\n' % len(data) + data + b'\nendstream'
+
+
+def xref_stream_pdf(objects, packed=None, predictor_kind=2, trailer=b''):
+    """A PDF 1.5 file indexed by an xref stream; packed objects go in an object stream"""
+    packed = packed or {}
+    size = max(list(objects) + list(packed)) + 1
+    stream_num, xref_num = size, size + 1
+    objects = dict(objects)
+    if packed:
+        header = b''
+        body = b''
+        for num in sorted(packed):
+            header += b'%d %d ' % (num, len(body))
+            body += packed[num] + b' '
+        objects[stream_num] = stream_object(
+            b'/Type /ObjStm /N %d /First %d /Filter /FlateDecode' % (len(packed), len(header)),
+            zlib.compress(header + body))
+
+    out = bytearray(b'%PDF-1.5\n%\xe2\xe3\xcf\xd3\n')
+    offsets = write_objects(out, objects)
+    xref_offset = len(out)
+    offsets[xref_num] = xref_offset
+    index = sorted(packed)
+
+    rows = []
+    for num in range(xref_num + 1):
+        if num in offsets:
+            rows.append(bytes([1]) + offsets[num].to_bytes(4, 'big') + bytes(2))
+        elif num in packed:
+            rows.append(bytes([2]) + stream_num.to_bytes(4, 'big') + index.index(num).to_bytes(2, 'big'))
+        else:
+            rows.append(bytes([0]) + bytes(4) + b'\xff\xff')
+    xref = stream_object(
+        b'/Type /XRef /Size %d /W [1 4 2] /Root 1 0 R /Filter /FlateDecode '
+        b'/DecodeParms << /Predictor 12 /Columns 7 >> ' % (xref_num + 1) + trailer,
+        zlib.compress(png_predict(rows, predictor_kind)))
+    out += b'%d 0 obj\n' % xref_num + xref + b'\nendobj\n'
+    out += b'startxref\n%d\n%%%%EOF\n' % xref_offset
+    return bytes(out)
+
+
+def pypdf2_pdf(pages, password=None):
+    writer = PyPDF2.PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(612, 792)
+    writer.add_metadata({'/Title': 'Quarterly report', '/Author': 'Analytics'})
+    if password:
+        writer.encrypt(password)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def pypdf2_page_count(pdf, password=None):
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf))
+    if password:
+        reader.decrypt(password)
+    return len(reader.pages)
+
+
+@pytest.fixture
+def probe(tmp_path):
+    def probe(pdf):
+        path = tmp_path / 'probe.pdf'
+        path.write_bytes(pdf)
+        return probe_pdf(str(path))
+    return probe
+
+
+@pytest.fixture
+def page_count(tmp_path):
+    def page_count(pdf):
+        path = tmp_path / 'count.pdf'
+        path.write_bytes(pdf)
+        return probe_page_count(str(path))
+    return page_count
+
+
+def test_classic_xref(probe):
+    objects = page_tree(3, info=b'<< /Title (Q3 \\(draft\\)) /Author <FEFF00C9006C00E9006E0061> >>')
+    result = probe(classic_pdf(objects, trailer=b'/Info 6 0 R'))
+    assert result == {'pages': 3, 'encrypted': False,
+                      'info': {'title': 'Q3 (draft)', 'author': 'Éléna'}}
+
+
+def test_classic_xref_with_free_entries_and_crlf(probe):
+    objects = {num: body.replace(b' ', b'\r\n') for num, body in page_tree(2).items()}
+    objects[9] = b'<< /Unused true >>'
+    assert probe(classic_pdf(objects))['pages'] == 2
+
+
+@pytest.mark.parametrize('predictor_kind', [0, 1, 2, 3, 4])
+def test_xref_stream_with_png_predictors(probe, predictor_kind):
+    pdf = xref_stream_pdf(page_tree(4), predictor_kind=predictor_kind)
+    assert probe(pdf)['pages'] == 4
+
+
+def test_object_stream(probe):
+    objects = page_tree(5, info=b'<< /Title (Packed) >>')
+    packed = {num: objects.pop(num) for num in (1, 2, 8)}
+    result = probe(xref_stream_pdf(objects, packed, trailer=b'/Info 8 0 R'))
+    assert result == {'pages': 5, 'encrypted': False, 'info': {'title': 'Packed'}}
+
+
+def test_incremental_update_uses_the_newest_revision(probe):
+    base = classic_pdf(page_tree(2))
+    update = {
+        2: b'<< /Type /Pages /Kids [3 0 R 4 0 R 5 0 R] /Count 3 >>',
+        5: b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>',
+    }
+    updated = incremental_update(base, update)
+    assert probe(base)['pages'] == 2
+    assert probe(updated)['pages'] == 3
+
+    # A second revision that only touches /Info still finds /Pages two revisions back
+    twice = incremental_update(updated, {6: b'<< /Title (Revised) >>'}, trailer=b'/Info 6 0 R')
+    assert probe(twice) == {'pages': 3, 'encrypted': False, 'info': {'title': 'Revised'}}
+
+
+def test_encrypted_input(probe):
+    pdf = pypdf2_pdf(3, password='secret')
+    result = probe(pdf)
+    assert result['pages'] == 3
+    assert result['encrypted'] is True
+    # Info strings are encrypted, so the probe doesn't report them
+    assert result['info'] == {}
+
+
+def test_encrypted_object_stream_needs_the_full_parser(probe, page_count):
+    objects = page_tree(2)
+    packed = {num: objects.pop(num) for num in (1, 2)}
+    objects[9] = b'<< /Filter /Standard /V 2 /R 3 /Length 128 /P -4 /O <00> /U <00> >>'
+    pdf = xref_stream_pdf(objects, packed, trailer=b'/Encrypt 9 0 R')
+    with pytest.raises(ProbeError):
+        probe(pdf)
+    assert page_count(pdf) is None
+
+
+def packed_pdf(pages, packed_nums=(1, 2)):
+    objects = page_tree(pages)
+    packed = {num: objects.pop(num) for num in packed_nums}
+    return xref_stream_pdf(objects, packed)
+
+
+def with_startxref(pdf, offset):
+    return pdf[:pdf.rindex(b'startxref')] + b'startxref\n%d\n%%%%EOF\n' % offset
+
+
+VALID_PDF = classic_pdf(page_tree(2))
+@pytest.mark.parametrize('pdf', [
+    b'',
+    b'%PDF-1.4\n',
+    VALID_PDF[:len(VALID_PDF) // 2],
+    VALID_PDF[:VALID_PDF.rindex(b'trailer') + 20],
+    VALID_PDF[:VALID_PDF.rindex(b'startxref')],
+    VALID_PDF.replace(b'/Count 2 >>', b'/Count 2 '),
+    with_startxref(VALID_PDF, len(VALID_PDF) * 2),
+    packed_pdf(3)[:-400] + b'\nstartxref\n%d\n%%%%EOF\n' % packed_pdf(3).rindex(b'obj\n<< /Type /XRef'),
+], ids=['empty', 'header-only', 'half', 'mid-trailer', 'no-startxref', 'unterminated-dict',
+        'startxref-past-end', 'cut-xref-stream'])
+def test_truncated_input_raises_probe_error(probe, page_count, pdf):
+    with pytest.raises(ProbeError):
+        probe(pdf)
+    assert page_count(pdf) is None
+
+
+@pytest.mark.parametrize('pdf', [
+    b'not a pdf at all',
+    random.Random(30).randbytes(8192),
+    b'%PDF-1.4\n' + random.Random(31).randbytes(4096) + b'\nstartxref\n12\n%%EOF\n',
+    b'%PDF-1.4\nxref\n0 1\nnot an entry\ntrailer\n<< >>\nstartxref\n9\n%%EOF\n',
+    b'%PDF-1.4\n1 0 obj\n<< /Type /Catalog >>\nendobj\nstartxref\n9\n%%EOF\n',
+], ids=['text', 'random', 'random-with-startxref', 'bad-xref-entry', 'startxref-at-object'])
+def test_garbage_input_raises_probe_error(probe, page_count, pdf):
+    with pytest.raises(ProbeError):
+        probe(pdf)
+    assert page_count(pdf) is None
+
+
+def test_missing_pages_count_raises_probe_error(probe):
+    objects = page_tree(1)
+    objects[2] = b'<< /Type /Pages /Kids [3 0 R] >>'
+    with pytest.raises(ProbeError):
+        probe(classic_pdf(objects))
+
+
+@pytest.mark.parametrize('pages', [1, 2, 7, 40])
+def test_agrees_with_pypdf2_on_pypdf2_output(probe, pages):
+    pdf = pypdf2_pdf(pages)
+    result = probe(pdf)
+    assert result['pages'] == pypdf2_page_count(pdf) == pages
+    assert result['info'] == {'title': 'Quarterly report', 'author': 'Analytics', 'producer': 'PyPDF2'}
+
+
+def test_agrees_with_pypdf2_on_encrypted_output(probe):
+    pdf = pypdf2_pdf(6, password='secret')
+    assert probe(pdf)['pages'] == pypdf2_page_count(pdf, password='secret') == 6
+
+
+@pytest.mark.parametrize('build', [
+    lambda: classic_pdf(page_tree(3)),
+    lambda: xref_stream_pdf(page_tree(4), predictor_kind=4),
+    lambda: packed_pdf(6),
+    lambda: incremental_update(classic_pdf(page_tree(1)), {
+        2: b'<< /Type /Pages /Kids [3 0 R 4 0 R] /Count 2 >>',
+        4: b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>',
+    }),
+], ids=['classic', 'xref-stream', 'object-stream', 'incremental'])
+def test_agrees_with_pypdf2_on_generated_files(probe, build):
+    pdf = build()
+    assert probe(pdf)['pages'] == pypdf2_page_count(pdf)
@@ -0,0 +1,160 @@
+"""Bundle the viewer's third-party assets (pdf.js, its worker and cMaps) locally.
+
+Usage: python vendor_assets.py [--registry URL]
+
+Downloads the pinned npm packages once, at deploy time, and writes every asset
+to static/vendor/ under a content-hashed name, plus static/vendor-manifest.json
+mapping logical names to those files. The app's asset_url() reads the manifest;
+since a hashed name never changes content, the files are served as immutable.
+
+For an air-gapped host, run this on a connected machine (or point --registry /
+NPM_REGISTRY at an internal npm mirror) and copy static/ across.
+"""
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import urllib.request
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+VENDOR_DIR = os.path.join(BASE_DIR, 'static', 'vendor')
+MANIFEST_PATH = os.path.join(BASE_DIR, 'static', 'vendor-manifest.json')
+
+NPM_REGISTRY = os.getenv('NPM_REGISTRY', 'https://registry.npmjs.org')
+PDFJS_VERSION = '3.11.174'
+
+# Logical name -> (npm package, version, path in the package, CDN fallback URL).
+# Names ending in '/' are directories.
+VENDOR_ASSETS = {
+    'pdf.js': ('pdfjs-dist', PDFJS_VERSION, 'build/pdf.min.js',
+               f'https://cdnjs.cloudflare.com/ajax/libs/pdf.js/{PDFJS_VERSION}/pdf.min.js'),
+    'pdf.worker.js': ('pdfjs-dist', PDFJS_VERSION, 'build/pdf.worker.min.js',
+                      f'https://cdnjs.cloudflare.com/ajax/libs/pdf.js/{PDFJS_VERSION}/pdf.worker.min.js'),
+    'cmaps/': ('pdfjs-dist', PDFJS_VERSION, 'cmaps/',
+               f'https://cdn.jsdelivr.net/npm/pdfjs-dist@{PDFJS_VERSION}/cmaps/'),
+}
+
+_manifest_cache = {'mtime': None, 'manifest': {}}
+
+
+def load_manifest(path=MANIFEST_PATH):
+    """Logical name -> path relative to static/vendor/, or {} when nothing is bundled."""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    if _manifest_cache['mtime'] != mtime:
+        with open(path) as f:
+            _manifest_cache['manifest'] = json.load(f)
+        _manifest_cache['mtime'] = mtime
+    return _manifest_cache['manifest']
+
+
+def cdn_url(name):
+    return VENDOR_ASSETS[name][3]
+
+
+def fetch_package(registry, package, version):
+    """Download an npm tarball and check it against the registry's integrity hash."""
+    with urllib.request.urlopen(f"{registry}/{package}/{version}", timeout=30) as response:
+        dist = json.load(response)['dist']
+    with urllib.request.urlopen(dist['tarball'], timeout=120) as response:
+        data = response.read()
+
+    algorithm, _, expected = dist.get('integrity', '').partition('-')
+    if algorithm in ('sha512', 'sha384', 'sha256'):
+        actual = base64.b64encode(hashlib.new(algorithm, data).digest()).decode()
+        if actual != expected:
+            raise RuntimeError(f"{package}@{version}: tarball does not match its integrity hash")
+    elif dist.get('shasum') and hashlib.sha1(data).hexdigest() != dist['shasum']:
+        raise RuntimeError(f"{package}@{version}: tarball does not match its shasum")
+    return tarfile.open(fileobj=io.BytesIO(data), mode='r:gz')
+
+
+def package_files(tar, prefix):
+    """(path relative to prefix, bytes) for every regular file under package/<prefix>."""
+    prefix = 'package/' + prefix
+    files = []
+    for member in tar.getmembers():
+        if not member.isfile():
+            continue
+        if member.name == prefix or (prefix.endswith('/') and member.name.startswith(prefix)):
+            relative = member.name[len(prefix):] or os.path.basename(member.name)
+            if relative.startswith('/') or '..' in relative.split('/'):
+                continue
+            files.append((relative, tar.extractfile(member).read()))
+    return sorted(files)
+
+
+def hashed_name(name, files):
+    digest = hashlib.sha256()
+    for relative, data in files:
+        digest.update(relative.encode() + b'\0')
+        digest.update(hashlib.sha256(data).digest())
+    short = digest.hexdigest()[:12]
+    if name.endswith('/'):
+        return f"{name.rstrip('/')}.{short}/"
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{short}{ext}"
+
+
+def write_asset(target, files):
+    """Write files under static/vendor/<target>; an existing hashed copy is left as is."""
+    destination = os.path.join(VENDOR_DIR, target)
+    if os.path.exists(destination.rstrip('/')):
+        return False
+    staging = destination.rstrip('/') + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    if target.endswith('/'):
+        for relative, data in files:
+            path = os.path.join(staging, relative)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+    else:
+        with open(staging, 'wb') as f:
+            f.write(files[0][1])
+    os.replace(staging, destination.rstrip('/'))
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--registry', default=NPM_REGISTRY, help="npm registry or internal mirror")
+    args = parser.parse_args()
+
+    os.makedirs(VENDOR_DIR, exist_ok=True)
+    packages = {}
+    manifest = {}
+    for name, (package, version, path, _) in VENDOR_ASSETS.items():
+        if (package, version) not in packages:
+            print(f"Fetching {package}@{version}")
+            tar = fetch_package(args.registry.rstrip('/'), package, version)
+            packages[(package, version)] = tar
+            # Licences travel with the redistributed files
+            license_files = package_files(tar, 'LICENSE')
+            if license_files:
+                with open(os.path.join(VENDOR_DIR, f"{package}-{version}.LICENSE"), 'wb') as f:
+                    f.write(license_files[0][1])
+        files = package_files(packages[(package, version)], path)
+        if not files:
+            raise RuntimeError(f"{package}@{version} has no {path}")
+        target = hashed_name(name, files)
+        written = write_asset(target, files)
+        manifest[name] = target
+        print(f"{name:15} -> {target}{'' if written else ' (unchanged)'}")
+
+    # Older hashed copies are kept so pages rendered before a deploy still load
+    staging = MANIFEST_PATH + '.tmp'
+    with open(staging, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(staging, MANIFEST_PATH)
+    print(f"Wrote {MANIFEST_PATH}")
+
+
+if __name__ == '__main__':
+    main()